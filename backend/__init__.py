@@ -1,22 +1,30 @@
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+from .database import env_flag, load_database_config, init_database
 
-db = SQLAlchemy()
+# Objects stay loaded after commit, so routes can read IDs without another SELECT
+db = SQLAlchemy(session_options={"expire_on_commit": False})
 login_manager = LoginManager()
 # login_manager.login_view = "auth.login"
 
 
-def create_app():
+def create_app(config=None):
+    config = config or {}  # Optional overrides, e.g. a separate database for tests
     app = Flask(__name__)
     app.config["SECRET_KEY"] = "your_secret_key"
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///todo.db"
+    # Database URI, SQLite pragmas and pool options come from the environment
+    app.config.update(load_database_config({**os.environ, **config}))
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["CORS_HEADERS"] = "Content-Type"
     app.config["CORS_SUPPORTS_CREDENTIALS"] = True
     app.config["JWT_SECRET_KEY"] = "your_secret_key"  # Replace with a strong secret key
+    # Also start a Flask-Login session on /login; clients can opt out per request
+    # with {"session": false}, JWT-only deployments can turn it off entirely
+    app.config["LOGIN_SESSIONS"] = True
     jwt = JWTManager(app)
     # app.config["SESSION_COOKIE_SAMESITE"] = "Lax"
     # app.config["SESSION_COOKIE_SECURE"] = False
@@ -31,10 +39,36 @@ def create_app():
         supports_credentials=True,  # Add This
         origins=["http://localhost:3000"],
     )
+    app.config.update(config)
     # Initialize extensions with app
     db.init_app(app)
+    init_database(app, db)
     login_manager.init_app(app)
 
+    from .archive import archiver
+    from .cache import snapshots
+    from .events import changes, restrict_stream_tokens
+    from .metrics import instrumentation
+    from .passwords import passwords
+    from .ratelimit import limiter
+
+    snapshots.init_app(app)
+    # /list bodies are stored compressed for clients that accept gzip or
+    # brotli; turn it off when a reverse proxy compresses responses instead
+    app.config.setdefault(
+        "COMPRESS_RESPONSES", env_flag("COMPRESS_RESPONSES", default="true")
+    )
+    changes.init_app(app)
+    # Stream tokens for /events?jwt= open nothing else
+    restrict_stream_tokens(jwt)
+    # Opt-in timings, SQL counters, profiles and /metrics (see metrics.py)
+    instrumentation.init_app(app)
+    # Bounded password hashing pool and /login, /signup rate limits
+    passwords.init_app(app)
+    limiter.init_app(app)
+    # Archives completed items in the background if ARCHIVE_INTERVAL is set
+    archiver.init_app(app)
+
     # Register blueprints
     from .auth import auth as auth_bp
     from .todo import todo as todo_bp
@@ -42,8 +76,30 @@ def create_app():
     app.register_blueprint(auth_bp)
     app.register_blueprint(todo_bp)
 
-    # Create database tables if they do not exist
-    with app.app_context():
-        db.create_all()
+    from .archive import archive_items_command
+    from .hierarchy import rebuild_paths_command
+    from .migrations import db_cli, run_migrations
+    from .ranks import rebalance_ranks_command
+    from .rollup import rebuild_rollups_command
+    from .search import rebuild_search_command
+    from .sync import prune_tombstones_command
+    from .transfer import export_user_command, import_user_command
+
+    app.cli.add_command(db_cli)
+    app.cli.add_command(archive_items_command)
+    app.cli.add_command(rebuild_paths_command)
+    app.cli.add_command(rebalance_ranks_command)
+    app.cli.add_command(rebuild_rollups_command)
+    app.cli.add_command(rebuild_search_command)
+    app.cli.add_command(prune_tombstones_command)
+    app.cli.add_command(export_user_command)
+    app.cli.add_command(import_user_command)
+
+    # Bring the database schema up to date (disable with AUTO_MIGRATE=False
+    # and run "flask --app backend db upgrade" during deploys instead)
+    app.config.setdefault("AUTO_MIGRATE", True)
+    if app.config["AUTO_MIGRATE"]:
+        with app.app_context():
+            run_migrations()
 
     return app
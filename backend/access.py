@@ -0,0 +1,97 @@
+import threading
+import time
+from flask import abort, jsonify, make_response
+from sqlalchemy.orm import contains_eager
+from .models import db, ArchivedItem, TodoList, TodoItem
+
+# Authorization helpers shared by the todo routes. They answer the same way the
+# routes always have: 404 for unknown IDs and a JSON 403 for someone else's data.
+
+# Seconds a list's owner is remembered. Lists never change owner and list IDs
+# are never reused, so an entry can only go stale when the list is deleted,
+# which evicts it in this process only. Other worker processes may keep it for
+# up to LIST_OWNER_TTL, so routes that write to a list check it in the
+# database instead (get_owned_list); reads of a deleted list just find nothing.
+LIST_OWNER_TTL = 30
+
+
+def unauthorized():
+    # Stop the request with the routes' usual JSON 403 response
+    abort(make_response(jsonify({"success": False, "message": "Unauthorized"}), 403))
+
+
+class ListOwnerCache:
+    """Small thread-safe TTL cache of list ID -> owner ID."""
+
+    def __init__(self, ttl=LIST_OWNER_TTL, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._owners = {}  # list_id -> (owner_id, expires_at)
+
+    def get(self, list_id):
+        entry = self._owners.get(list_id)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def set(self, list_id, owner_id):
+        with self._lock:
+            if len(self._owners) >= self.max_entries:
+                self._owners.clear()  # Cheaper than LRU upkeep for a tiny value
+            self._owners[list_id] = (owner_id, time.monotonic() + self.ttl)
+
+    def forget(self, list_id):
+        with self._lock:
+            self._owners.pop(list_id, None)
+
+
+list_owners = ListOwnerCache()
+
+
+def get_owned_item(item_id, user_id):
+    """Load an item together with its list in one query and check the owner."""
+    item = (
+        TodoItem.query.join(TodoItem.list)
+        .options(contains_eager(TodoItem.list))
+        .filter(TodoItem.id == item_id)
+        .one_or_none()
+    )
+    if item is None:
+        abort(404)
+    list_owners.set(item.list_id, item.list.owner_id)
+    if item.list.owner_id != user_id:
+        unauthorized()
+    return item
+
+
+def get_owned_archived_item(item_id, user_id):
+    """Load an archived item and check that the user owns its list."""
+    item = db.session.get(ArchivedItem, item_id)
+    if item is None:
+        abort(404)
+    check_list_owner(item.list_id, user_id)
+    return item
+
+
+def get_owned_list(list_id, user_id):
+    """Load a list and check that the user owns it."""
+    todo_list = db.session.get(TodoList, list_id)
+    if todo_list is None:
+        abort(404)
+    list_owners.set(list_id, todo_list.owner_id)
+    if todo_list.owner_id != user_id:
+        unauthorized()
+    return todo_list
+
+
+def check_list_owner(list_id, user_id):
+    """Check list ownership, skipping the query while the owner is cached.
+
+    Only for reads: a list deleted by another process may still be cached.
+    """
+    owner_id = list_owners.get(list_id)
+    if owner_id is None:
+        get_owned_list(list_id, user_id)
+    elif owner_id != user_id:
+        unauthorized()
@@ -0,0 +1,226 @@
+import asyncio
+import io
+from a2wsgi import WSGIMiddleware
+from a2wsgi.wsgi import build_environ
+from flask import request
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from werkzeug.datastructures import EnvironHeaders
+from . import db
+from .cache import snapshots
+from .database import apply_sqlite_pragmas
+from .encoding import (
+    EncodingError,
+    compress,
+    encode_lists,
+    encoded_response,
+    make_conditional,
+    negotiate,
+    variant,
+)
+from .events import changes, query_token_allowed
+from .metrics import instrumentation
+from .tree import index_children, user_tree_queries
+
+# ASGI front for the Flask app (served by "python -m backend.serve --asgi").
+# Every route still runs in Flask on a thread pool, except the hot reads
+# below, which are served on the event loop:
+#
+#   GET /list    reads on an async engine (aiosqlite for SQLite databases)
+#   GET /events  waits for changes without holding a thread, so thousands of
+#                idle EventSource connections cost no more than their sockets
+#
+# Both go through the Flask app for everything but the waiting: JWT checks,
+# the snapshot cache, ETags and after_request handlers such as CORS. Requests
+# these paths cannot authenticate are passed to Flask, which answers them
+# exactly like the WSGI server does.
+
+
+class AsyncReads:
+    """ASGI application serving the hot read routes natively."""
+
+    def __init__(self, app, threads=10):
+        self.app = app
+        # Thread pool running every other request through the WSGI app
+        self.wsgi = WSGIMiddleware(app, workers=threads)
+        self.engine = async_engine(app)
+        self.routes = {"/events": self.events}
+        if self.engine is not None:
+            self.routes["/list"] = self.get_lists
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        route = self.routes.get(scope["path"])
+        if scope["type"] != "http" or scope["method"] != "GET" or route is None:
+            return await self.wsgi(scope, receive, send)
+        if b"include_archived" in scope.get("query_string", b""):
+            # Reads the archive as well, and is not cached; Flask serves it
+            return await self.wsgi(scope, receive, send)
+        return await route(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self.open_pool()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.engine is not None:
+                    await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def open_pool(self):
+        # Connect the whole pool before serving: every aiosqlite connection
+        # starts a thread, which is slow to come up once the loop is busy
+        if self.engine is None:
+            return
+        size = getattr(self.engine.pool, "size", lambda: 1)()
+        connections = [await self.engine.connect() for _ in range(size)]
+        for conn in connections:
+            await conn.close()
+
+    def identity(self, environ, locations=None):
+        # The JWT identity of a request, or None to let Flask answer it
+        with self.app.request_context(environ):
+            try:
+                verify_jwt_in_request(locations=locations)
+            except (JWTExtendedException, PyJWTError):
+                return None
+            if not query_token_allowed():
+                return None
+            return get_jwt_identity()
+
+    async def get_lists(self, scope, receive, send):
+        environ = wsgi_environ(scope)
+        current_user_id = self.identity(environ)
+        if current_user_id is None:
+            return await self.wsgi(scope, receive, send)
+        with self.app.request_context(environ):
+            try:
+                fmt, coding = negotiate(request)
+            except EncodingError:
+                return await self.wsgi(scope, receive, send)
+        if instrumentation.enabled:
+            # Finished by the after_request hook in process_response below
+            instrumentation.start(EnvironHeaders(environ))
+
+        # Same steps as todo.get_lists, with the queries awaited
+        version = snapshots.version(current_user_id)
+        encoding = variant(fmt, coding)
+        body = snapshots.get(current_user_id, version, encoding)
+        if body is None:
+            lists, items = user_tree_queries(current_user_id)
+            async with self.engine.connect() as conn:
+                todo_lists = (await conn.execute(lists)).all()
+                children = index_children((await conn.execute(items)).all())
+            body = compress(encode_lists(fmt, todo_lists, children), coding)
+            snapshots.put(current_user_id, version, body, encoding)
+
+        with self.app.request_context(environ):
+            response = encoded_response(body, fmt, coding)
+            response.set_etag(snapshots.etag(current_user_id, version, encoding))
+            response.headers["Cache-Control"] = "private, no-cache"
+            response = self.app.process_response(make_conditional(response, request))
+        # The WSGI view of the response drops the body of a 304
+        body, status, headers = response.get_wsgi_response(environ)
+        await send(response_start(status, headers))
+        await send({"type": "http.response.body", "body": b"".join(body)})
+
+    async def events(self, scope, receive, send):
+        environ = wsgi_environ(scope)
+        current_user_id = self.identity(environ, ["headers", "query_string"])
+        if current_user_id is None:
+            return await self.wsgi(scope, receive, send)
+
+        with self.app.request_context(environ):
+            last_event_id = request.headers.get("Last-Event-ID") or request.args.get(
+                "last_event_id"
+            )
+            response = self.app.response_class(mimetype="text/event-stream")
+            response.headers["Cache-Control"] = "no-cache"
+            response.headers["X-Accel-Buffering"] = "no"
+            response = self.app.process_response(response)
+        await send(response_start(response.status, response.headers.to_wsgi_list()))
+
+        # DatabaseBackend reads through db.engine, which needs the app context
+        with self.app.app_context():
+            messages = changes.stream_async(current_user_id, last_event_id)
+            streaming = asyncio.ensure_future(stream_body(messages, send))
+            disconnected = asyncio.ensure_future(wait_disconnect(receive))
+            try:
+                await asyncio.wait(
+                    [streaming, disconnected], return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                for task in (streaming, disconnected):
+                    task.cancel()
+                await asyncio.gather(streaming, disconnected, return_exceptions=True)
+                await messages.aclose()
+            if streaming.done() and not streaming.cancelled():
+                streaming.result()  # Re-raise an error of the stream, if any
+
+
+def async_engine(app):
+    """Create the async engine for the app's database, or None if there is none.
+
+    ASYNC_DATABASE_URI names it explicitly; otherwise an SQLite file is
+    opened again through aiosqlite, with the same pragmas and pool options.
+    """
+    uri = app.config.get("ASYNC_DATABASE_URI")
+    if uri is None:
+        with app.app_context():
+            url = db.engine.url
+        # An in-memory database cannot be shared with a second engine
+        in_memory = url.database in (None, "", ":memory:") or "mode=memory" in str(url)
+        if url.get_backend_name() != "sqlite" or in_memory:
+            return None
+        uri = url.set(drivername="sqlite+aiosqlite")
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    if "pool_size" in options:
+        # aiosqlite defaults to no pool at all. Its connections each run a
+        # thread that is slow to start under load, so keep every connection
+        # the sync engine could have open instead of discarding overflow ones
+        options["poolclass"] = AsyncAdaptedQueuePool
+        options["pool_size"] += options.pop("max_overflow", 0)
+        options["max_overflow"] = 0
+    engine = create_async_engine(uri, **options)
+    apply_sqlite_pragmas(engine.sync_engine, app.config.get("SQLITE_PRAGMAS", {}))
+    if instrumentation.enabled:
+        instrumentation.instrument_engine(engine.sync_engine)
+    return engine
+
+
+def wsgi_environ(scope):
+    # The WSGI environ of a bodyless ASGI request, to run Flask code against
+    return build_environ(scope, io.BytesIO())
+
+
+def response_start(status, headers):
+    # The ASGI message starting a response with a WSGI status line and headers
+    return {
+        "type": "http.response.start",
+        "status": int(status.split(" ", 1)[0]),
+        "headers": [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in headers
+        ],
+    }
+
+
+async def stream_body(messages, send):
+    async for message in messages:
+        await send(
+            {"type": "http.response.body", "body": message.encode(), "more_body": True}
+        )
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def wait_disconnect(receive):
+    # Read request messages until the client goes away
+    while (await receive())["type"] != "http.disconnect":
+        pass
@@ -0,0 +1,280 @@
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import String, cast, delete, exists, func, insert, literal, or_, select
+from sqlalchemy.orm import aliased
+from .models import db, ArchivedItem, TodoList, TodoItem
+from .events import publish_change
+from .hierarchy import prefix_range, subtree_prefix
+from .rollup import RollupDeltas, path_ids, subtree_totals
+from .sync import add_tombstones, begin_revision
+
+# Cold storage for finished work. A completed item whose subtasks are all
+# completed too, and none of which changed for ARCHIVE_AFTER_DAYS, is moved
+# with its whole subtree from todo_items to archived_items, so tree loads,
+# counters and indexes only cover live items. To clients an archived item
+# looks deleted (it leaves a tombstone for /sync); GET /list?include_archived=1
+# shows archived items again, flagged "archived", and POST /item/<id>/restore
+# brings a subtree back under its parent at its old rank.
+#
+# Archiving runs in batches of ARCHIVE_BATCH_SIZE subtrees, one owner per
+# transaction, from "flask --app backend archive-items" or, with
+# ARCHIVE_INTERVAL set, from a background thread of each server process.
+
+# Columns copied between todo_items and archived_items
+ARCHIVED_COLUMNS = (
+    "id",
+    "content",
+    "completed",
+    "list_id",
+    "parent_id",
+    "path",
+    "rank",
+    "updated_at",
+)
+
+
+class ArchiveError(ValueError):
+    """Raised when an archived item cannot be restored."""
+
+
+def archivable_roots(cutoff, limit):
+    """Query up to ``limit`` (item ID, owner ID) pairs of subtrees to archive.
+
+    The item and all of its descendants are completed (read from the rollup
+    counters) and none of them changed since ``cutoff``; rows older than
+    change tracking have no update time and count as old. Shallow items come
+    first, so a subtree is archived whole rather than branch by branch.
+    """
+    descendant = aliased(TodoItem)
+    prefix = func.coalesce(TodoItem.path, "") + cast(TodoItem.id, String)
+    recently_changed = exists().where(
+        descendant.path >= prefix + "/",
+        descendant.path < prefix + "0",
+        descendant.updated_at >= cutoff,
+    )
+    return (
+        select(TodoItem.id, TodoList.owner_id)
+        .join(TodoList, TodoItem.list_id == TodoList.id)
+        .where(
+            TodoItem.completed.is_(True),
+            TodoItem.completed_descendants == TodoItem.total_descendants,
+            or_(TodoItem.updated_at.is_(None), TodoItem.updated_at < cutoff),
+            ~recently_changed,
+        )
+        .order_by(func.length(TodoItem.path), TodoItem.id)
+        .limit(limit)
+    )
+
+
+def archive_subtree(item, archived_at):
+    """Move an item and its descendants to archived_items; return their IDs.
+
+    Like delete_subtree, the rows leave tombstones and their weight is taken
+    off the counters of their live ancestors and list.
+    """
+    size, completed = subtree_totals(item.id)
+    in_subtree = or_(TodoItem.id == item.id, prefix_range(subtree_prefix(item)))
+    db.session.execute(
+        insert(ArchivedItem).from_select(
+            [*ARCHIVED_COLUMNS, "archived_at"],
+            select(
+                *(getattr(TodoItem, name) for name in ARCHIVED_COLUMNS),
+                literal(archived_at),
+            ).where(in_subtree),
+        )
+    )
+    moved = db.session.scalars(
+        delete(TodoItem)
+        .where(in_subtree)
+        .returning(TodoItem.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    add_tombstones("item", moved)
+    deltas = RollupDeltas()
+    deltas.add(item.path, item.list_id, -size, -completed)
+    deltas.apply()
+    return moved
+
+
+def archive_completed(cutoff, batch_size):
+    """Archive every subtree completed and unchanged since ``cutoff``.
+
+    Each batch commits one owner's subtrees under a single revision and
+    notifies their clients. Yields (owner ID, archived items) per batch.
+    """
+    while True:
+        roots = db.session.execute(archivable_roots(cutoff, batch_size)).all()
+        # End the read before writing, so a concurrent archiver that got
+        # there first is seen instead of failing on a stale snapshot
+        db.session.rollback()
+        if not roots:
+            return
+        by_owner = defaultdict(list)
+        for item_id, owner_id in roots:
+            by_owner[owner_id].append(item_id)
+        for owner_id, item_ids in by_owner.items():
+            begin_revision(owner_id)
+            # Check again under the write lock: a root completed a moment ago
+            # may have been reopened or edited since the read above
+            still_archivable = archivable_roots(cutoff, len(item_ids)).where(
+                TodoItem.id.in_(item_ids)
+            )
+            archived = set()
+            items = TodoItem.query.filter(
+                TodoItem.id.in_(db.session.scalars(still_archivable).all())
+            ).order_by(func.length(TodoItem.path), TodoItem.id)
+            archived_at = datetime.utcnow()
+            for item in items.all():
+                if item.id not in archived:  # Not inside a subtree moved already
+                    archived.update(archive_subtree(item, archived_at))
+            db.session.commit()
+            if archived:
+                publish_change(owner_id, "archive", fields={"items": len(archived)})
+            yield owner_id, len(archived)
+
+
+def restore_subtree(root):
+    """Move an archived item and its archived descendants back to todo_items.
+
+    The item returns under its parent, which has to be live, at its old rank;
+    items keep their IDs, which are never reused. Returns the restored root.
+    """
+    if root.parent_id is not None and db.session.get(TodoItem, root.parent_id) is None:
+        raise ArchiveError("Restore the parent item first")
+    rows = (
+        ArchivedItem.query.filter(
+            or_(
+                ArchivedItem.id == root.id,
+                prefix_range(subtree_prefix(root), ArchivedItem.path),
+            )
+        )
+        # Parents before their children
+        .order_by(func.length(ArchivedItem.path), ArchivedItem.id).all()
+    )
+    # Paths and list IDs are current, as moves of live ancestors update them
+    items = [
+        TodoItem(
+            id=row.id,
+            content=row.content,
+            completed=row.completed,
+            list_id=row.list_id,
+            parent_id=row.parent_id,
+            path=row.path,
+            rank=row.rank,
+        )
+        for row in rows
+    ]
+
+    # Counters of the restored items, then of their live ancestors and list
+    counts = defaultdict(lambda: [0, 0])
+    for item in items:
+        for ancestor_id in path_ids(item.path):
+            counts[ancestor_id][0] += 1
+            counts[ancestor_id][1] += int(bool(item.completed))
+    for item in items:
+        item.total_descendants, item.completed_descendants = counts[item.id]
+    db.session.add_all(items)
+    deltas = RollupDeltas()
+    deltas.add(
+        root.path,
+        root.list_id,
+        len(items),
+        sum(int(bool(item.completed)) for item in items),
+    )
+    deltas.apply()
+    db.session.execute(
+        delete(ArchivedItem).where(ArchivedItem.id.in_([row.id for row in rows]))
+    )
+    return items[0]
+
+
+def archived_items_query(owner_id):
+    # Every archived item of a user's lists
+    return (
+        select(ArchivedItem)
+        .join(TodoList, ArchivedItem.list_id == TodoList.id)
+        .where(TodoList.owner_id == owner_id)
+    )
+
+
+def add_archived(children, items):
+    """Merge archived items into a children index, keeping rank order."""
+    groups = set()
+    for item in items:
+        key = ("list", item.list_id) if item.parent_id is None else item.parent_id
+        children[key].append(item)
+        groups.add(key)
+    for key in groups:
+        children[key].sort(key=lambda item: (item.rank, item.id))
+    return children
+
+
+class Archiver:
+    """Archives completed subtrees every ARCHIVE_INTERVAL seconds, if set."""
+
+    def __init__(self, app=None):
+        self._thread = None
+        self._stopped = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault(
+            "ARCHIVE_AFTER_DAYS", int(os.environ.get("ARCHIVE_AFTER_DAYS", 30))
+        )
+        app.config.setdefault(
+            "ARCHIVE_BATCH_SIZE", int(os.environ.get("ARCHIVE_BATCH_SIZE", 200))
+        )
+        # Seconds between runs in each server process; 0 leaves archiving to
+        # the archive-items command (e.g. from cron)
+        app.config.setdefault(
+            "ARCHIVE_INTERVAL", float(os.environ.get("ARCHIVE_INTERVAL", 0))
+        )
+        if app.config["ARCHIVE_INTERVAL"] > 0 and self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, args=(app,), name="archiver", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self, app):
+        while not self._stopped.wait(app.config["ARCHIVE_INTERVAL"]):
+            with app.app_context():
+                cutoff = datetime.utcnow() - timedelta(
+                    days=app.config["ARCHIVE_AFTER_DAYS"]
+                )
+                try:
+                    for _ in archive_completed(
+                        cutoff, app.config["ARCHIVE_BATCH_SIZE"]
+                    ):
+                        if self._stopped.is_set():
+                            break
+                except Exception:
+                    db.session.rollback()
+                    app.logger.exception("Archiving completed items failed")
+                finally:
+                    db.session.remove()
+
+    def stop(self):
+        self._stopped.set()
+
+
+# Shared archiver instance, bound to the app in create_app
+archiver = Archiver()
+
+
+# CLI command to archive completed items: flask --app backend archive-items
+@click.command("archive-items")
+@click.option("--days", type=int, default=None, help="Default: ARCHIVE_AFTER_DAYS.")
+@click.option("--batch-size", type=int, default=None)
+@with_appcontext
+def archive_items_command(days, batch_size):
+    days = current_app.config["ARCHIVE_AFTER_DAYS"] if days is None else days
+    batch_size = batch_size or current_app.config["ARCHIVE_BATCH_SIZE"]
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    total = sum(count for _, count in archive_completed(cutoff, batch_size))
+    click.echo(f"Archived {total} item(s) completed over {days} day(s) ago")
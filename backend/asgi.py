@@ -0,0 +1,6 @@
+from . import create_app
+from .aio import AsyncReads
+from .serve import load_server_config
+
+# ASGI entry point: uvicorn backend.asgi:app ("python -m backend.serve --asgi")
+app = AsyncReads(create_app(), threads=load_server_config()["threads"])
@@ -1,13 +1,32 @@
-from flask import Blueprint, request, jsonify, url_for
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, current_app, request, jsonify, url_for
 from flask_login import login_user, login_required, logout_user, current_user
 from .models import db, User
+from .passwords import HasherBusy, passwords
+from .ratelimit import limiter
 from flask_jwt_extended import create_access_token
 
 # Create a Blueprint for authentication routes
 auth = Blueprint("auth", __name__)
 
 
+# Answer requests the rate limiter or the password hasher turned away
+def too_many_attempts(retry_after):
+    response = jsonify(
+        {"success": False, "message": "Too many attempts, please try again later"}
+    )
+    response.headers["Retry-After"] = str(retry_after)
+    return response, 429
+
+
+@auth.errorhandler(HasherBusy)
+def hasher_busy(error):
+    response = jsonify(
+        {"success": False, "message": "Server is busy, please try again shortly"}
+    )
+    response.headers["Retry-After"] = "1"
+    return response, 503
+
+
 # Route for user signup
 @auth.route("/signup", methods=["POST"])
 def signup_post():
@@ -19,6 +38,14 @@ def signup_post():
     # Check if all required fields are provided
     if not email or not name or not password:
         return jsonify({"message": "All fields are required"}), 400
+    # Only text goes on to the limiter, the database and the hasher
+    if not all(isinstance(value, str) for value in (email, name, password)):
+        return jsonify({"message": "Email, name and password must be strings"}), 400
+
+    # Turn floods away per client address before anything is hashed
+    retry_after = limiter.hit(ip=request.remote_addr)
+    if retry_after:
+        return too_many_attempts(retry_after)
 
     # Check if a user with the same email already exists
     user = User.query.filter_by(email=email).first()
@@ -33,9 +60,8 @@ def signup_post():
         email=email,
         name=name,
         username=username,
-        password=generate_password_hash(
-            password, method="pbkdf2:sha256"
-        ),  # Hash the password
+        # Hash the password with the configured method, on the hashing threads
+        password=passwords.hash(password),
     )
 
     # Add the new user to the database session and commit
@@ -59,19 +85,39 @@ def login_post():
             jsonify({"success": False, "message": "Email and password are required"}),
             400,
         )
+    # Only text goes on to the limiter and the password check
+    if not isinstance(email, str) or not isinstance(password, str):
+        return (
+            jsonify(
+                {"success": False, "message": "Email and password must be strings"}
+            ),
+            400,
+        )
+
+    # Limit attempts per client address and per account before the lookup and
+    # the (slow, on purpose) password check
+    retry_after = limiter.hit(ip=request.remote_addr, account=email.strip().lower())
+    if retry_after:
+        return too_many_attempts(retry_after)
 
     # Query the user by email
     user = User.query.filter_by(email=email).first()
 
     # Check if user exists and if the password is correct
-    if user is None or not check_password_hash(user.password, password):
+    if user is None or not passwords.verify(user.password, password):
         return jsonify({"success": False, "message": "Invalid email or password"}), 401
 
+    # Upgrade the stored hash if the hashing method or cost has changed since
+    if passwords.needs_rehash(user.password):
+        user.password = passwords.hash(password)
+        db.session.commit()
+
     # Create a JWT access token using the user's ID as identity
     access_token = create_access_token(identity=user.id)
 
-    # Log the user in using Flask-Login
-    login_user(user)
+    # Log the user in using Flask-Login as well, unless the client only uses the JWT
+    if data.get("session", current_app.config["LOGIN_SESSIONS"]):
+        login_user(user)
 
     # Return the access token and a success message
     return (
@@ -0,0 +1,322 @@
+from sqlalchemy import insert
+from sqlalchemy.orm import contains_eager
+from .models import db, TodoList, TodoItem
+from .hierarchy import (
+    HierarchyError,
+    child_path,
+    delete_subtree,
+    is_in_subtree,
+    move_subtree,
+)
+from .ranks import last_rank, rank_between
+from .rollup import RollupDeltas, completion_changed, item_added
+from .sync import begin_revision, stamp
+
+# Upper bound on the number of operations accepted in a single /batch request
+MAX_BATCH_OPS = 5000
+
+BATCH_OPS = ("create", "edit", "toggle", "move", "delete")
+
+
+class BatchError(Exception):
+    """Raised when an operation of a batch cannot be applied.
+
+    ``index`` is the position of the failing operation (None when the batch as
+    a whole is rejected) and ``status`` the HTTP status to answer with.
+    """
+
+    def __init__(self, message, index=None, status=400):
+        super().__init__(message)
+        self.message = message
+        self.index = index
+        self.status = status
+
+
+def is_real_id(ref):
+    # Client-supplied temporary IDs are strings, database IDs are integers
+    return isinstance(ref, int) and not isinstance(ref, bool)
+
+
+def is_content(value):
+    # Item content is a non-empty string, as the single-item routes require
+    return isinstance(value, str) and value != ""
+
+
+def referenced_ids(ops):
+    """Collect the existing item and list IDs a batch refers to."""
+    item_ids, list_ids = set(), set()
+    for op in ops:
+        for key in ("id", "parent_id", "new_parent_id", "after_id", "before_id"):
+            if is_real_id(op.get(key)):
+                item_ids.add(op[key])
+        if is_real_id(op.get("list_id")):
+            list_ids.add(op["list_id"])
+    return item_ids, list_ids
+
+
+def load_owned(ops, owner_id):
+    """Load every referenced item and list in two queries and check ownership once."""
+    item_ids, list_ids = referenced_ids(ops)
+    items = {}
+    if item_ids:
+        # Items are loaded together with their list, so no lazy load is needed
+        rows = (
+            TodoItem.query.join(TodoItem.list)
+            .options(contains_eager(TodoItem.list))
+            .filter(TodoItem.id.in_(item_ids))
+            .all()
+        )
+        items = {item.id: item for item in rows}
+    lists = {item.list.id: item.list for item in items.values()}
+    missing_lists = list_ids - lists.keys()
+    if missing_lists:
+        for todo_list in TodoList.query.filter(TodoList.id.in_(missing_lists)):
+            lists[todo_list.id] = todo_list
+
+    if item_ids - items.keys() or list_ids - lists.keys():
+        raise BatchError("Item or list not found", status=404)
+    if any(todo_list.owner_id != owner_id for todo_list in lists.values()):
+        raise BatchError("Unauthorized", status=403)
+    return items, lists
+
+
+class BatchApplier:
+    """Apply an ordered list of item operations inside the current transaction.
+
+    Consecutive ``create`` operations are buffered and inserted with a single
+    multi-row INSERT ... RETURNING; the other operations mutate the loaded ORM
+    objects, so their UPDATEs are flushed together as executemany batches.
+    """
+
+    def __init__(self, items, lists):
+        self.items = items  # Existing items by ID
+        self.lists = lists  # Existing lists by ID
+        self.created = {}  # Created items by temporary ID
+        self.pending = []  # Buffered create operations not yet inserted
+        self.pending_by_temp_id = {}
+        self.deleted = set()  # IDs of items removed earlier in the batch
+        self.deltas = RollupDeltas()  # Progress counter changes not yet written
+        self.last_ranks = {}  # (list_id, parent_id) -> rank of the last sibling
+        self.changes = []  # Change feed entries, in the order they happened
+
+    def resolve(self, ref, index):
+        # Look up an item by database ID or by a temporary ID from this batch
+        if not isinstance(ref, (int, str)):
+            raise BatchError(f"Invalid item reference {ref!r}", index)
+        if ref in self.pending_by_temp_id:
+            self.flush_creates()
+        item = self.created.get(ref) if isinstance(ref, str) else self.items.get(ref)
+        if item is None or item.id in self.deleted:
+            raise BatchError(f"Unknown item {ref!r}", index)
+        return item
+
+    def apply(self, index, op):
+        kind = op.get("op")
+        if kind not in BATCH_OPS:
+            raise BatchError(f"Unsupported operation {kind!r}", index)
+        if kind == "create":
+            return self.create(index, op)
+        # Everything but create needs real rows, so insert what is buffered first
+        self.flush_creates()
+        return getattr(self, kind)(index, op)
+
+    def create(self, index, op):
+        content = op.get("content")
+        temp_id = op.get("temp_id")
+        parent_ref = op.get("parent_id")
+        if not is_content(content):
+            raise BatchError("Content is required", index)
+        if temp_id is not None and (
+            not isinstance(temp_id, str)
+            or temp_id in self.created
+            or temp_id in self.pending_by_temp_id
+        ):
+            raise BatchError("temp_id must be a new, unique string", index)
+
+        if parent_ref is None:
+            list_id = op.get("list_id")
+            if list_id is None:
+                raise BatchError("A list_id or parent_id is required", index)
+            if not is_real_id(list_id) or list_id not in self.lists:
+                raise BatchError("Invalid list_id", index)
+        else:
+            if not isinstance(parent_ref, (int, str)):
+                raise BatchError(f"Invalid item reference {parent_ref!r}", index)
+            if parent_ref in self.pending_by_temp_id:
+                parent_list_id = self.pending_by_temp_id[parent_ref]["list_id"]
+            else:
+                parent_list_id = self.resolve(parent_ref, index).list_id
+            list_id = op.get("list_id", parent_list_id)
+            if list_id != parent_list_id:
+                raise BatchError("Parent item belongs to another list", index)
+
+        result = {"op": "create", "success": True, "temp_id": temp_id}
+        pending = {
+            "content": content,
+            "list_id": list_id,
+            "parent_ref": parent_ref,
+            "temp_id": temp_id,
+            "result": result,
+        }
+        self.pending.append(pending)
+        if temp_id is not None:
+            self.pending_by_temp_id[temp_id] = pending
+        return result
+
+    def flush_creates(self):
+        """Insert the buffered creates with one statement, then link their parents.
+
+        Each row is inserted with a unique placeholder path so the RETURNING
+        rows can be matched back to their operation regardless of order; the
+        real parent_id and path are set once every new ID is known.
+        """
+        if not self.pending:
+            return
+        pending, self.pending, self.pending_by_temp_id = self.pending, [], {}
+        rows = [
+            {
+                "content": p["content"],
+                "list_id": p["list_id"],
+                "path": f"~{n}",
+                **stamp(),
+            }
+            for n, p in enumerate(pending)
+        ]
+        new_items = db.session.scalars(insert(TodoItem).returning(TodoItem), rows)
+        by_tag = {item.path: item for item in new_items}
+        for n, p in enumerate(pending):
+            item = by_tag[f"~{n}"]
+            parent = None
+            if p["parent_ref"] is not None:
+                parent = (
+                    self.created[p["parent_ref"]]
+                    if isinstance(p["parent_ref"], str)
+                    else self.items[p["parent_ref"]]
+                )
+            # Parents always precede their children, so their path is already set
+            item.parent_id = None if parent is None else parent.id
+            item.path = child_path(parent)
+            item.rank = self.next_rank(item.list_id, item.parent_id)
+            if p["temp_id"] is not None:
+                self.created[p["temp_id"]] = item
+            self.items[item.id] = item
+            item_added(item, self.deltas)
+            p["result"]["item_id"] = item.id
+            self.changed(
+                "item.create",
+                item,
+                list_id=item.list_id,
+                fields={
+                    "content": item.content,
+                    "parent_id": item.parent_id,
+                    "completed": False,
+                },
+            )
+
+    def next_rank(self, list_id, parent_id):
+        # Rank after the last sibling, looked up once per group and batch
+        group = (list_id, parent_id)
+        if group not in self.last_ranks:
+            self.last_ranks[group] = last_rank(list_id, parent_id)
+        self.last_ranks[group] = rank_between(self.last_ranks[group], None)
+        return self.last_ranks[group]
+
+    def changed(self, op, item, **change):
+        self.changes.append({"op": op, "item_id": item.id, **change})
+
+    def edit(self, index, op):
+        item = self.resolve(op.get("id"), index)
+        fields = {}
+        if "content" in op:
+            if not is_content(op["content"]):
+                raise BatchError("Content is required", index)
+            item.content = fields["content"] = op["content"]
+        if "completed" in op:
+            if not isinstance(op["completed"], bool):
+                raise BatchError("completed must be true or false", index)
+            completion_changed(item, op["completed"], self.deltas)
+            item.completed = fields["completed"] = op["completed"]
+        self.changed("item.update", item, fields=fields)
+        return {"op": "edit", "success": True, "item_id": item.id}
+
+    def toggle(self, index, op):
+        item = self.resolve(op.get("id"), index)
+        # Set an explicit state if given, otherwise flip the current one
+        completed = op["completed"] if "completed" in op else not item.completed
+        if not isinstance(completed, bool):
+            raise BatchError("completed must be true or false", index)
+        completion_changed(item, completed, self.deltas)
+        item.completed = completed
+        self.changed("item.update", item, fields={"completed": completed})
+        return {
+            "op": "toggle",
+            "success": True,
+            "item_id": item.id,
+            "completed": item.completed,
+        }
+
+    def move(self, index, op):
+        item = self.resolve(op.get("id"), index)
+        new_parent_ref = op.get("new_parent_id")
+        new_parent = (
+            None if new_parent_ref is None else self.resolve(new_parent_ref, index)
+        )
+        # Optional siblings to place the item between, as in /item/move
+        after, before = (
+            None if op.get(key) is None else self.resolve(op[key], index)
+            for key in ("after_id", "before_id")
+        )
+        try:
+            # Moves read fresh subtree counters, so settle pending changes first
+            self.deltas.apply()
+            move_subtree(item, new_parent, after, before)
+        except HierarchyError as e:
+            raise BatchError(str(e), index)
+        # Ranks handed out to later creates must follow the moved item
+        self.last_ranks.pop((item.list_id, item.parent_id), None)
+        self.changed(
+            "item.move",
+            item,
+            fields={
+                "parent_id": item.parent_id,
+                "list_id": item.list_id,
+                "rank": item.rank,
+            },
+        )
+        return {"op": "move", "success": True, "item_id": item.id}
+
+    def delete(self, index, op):
+        item = self.resolve(op.get("id"), index)
+        # Forget every loaded object of the subtree before the rows disappear
+        doomed = [
+            other
+            for other in self.items.values()
+            if other.id not in self.deleted and is_in_subtree(other, item)
+        ]
+        self.deltas.apply()
+        delete_subtree(item)
+        for other in doomed:
+            self.deleted.add(other.id)
+            db.session.expunge(other)
+        self.changed("item.delete", item)
+        return {"op": "delete", "success": True, "item_id": item.id}
+
+
+def apply_batch(ops, owner_id):
+    """Apply a /batch request for the given user.
+
+    Returns the per-op results and the change feed entries of the batch. The
+    caller owns the transaction: commit on success, roll back on BatchError.
+    """
+    if not isinstance(ops, list) or not all(isinstance(op, dict) for op in ops):
+        raise BatchError("ops must be a list of operations")
+    if len(ops) > MAX_BATCH_OPS:
+        raise BatchError(f"A batch is limited to {MAX_BATCH_OPS} operations")
+
+    items, lists = load_owned(ops, owner_id)
+    begin_revision(owner_id)
+    applier = BatchApplier(items, lists)
+    results = [applier.apply(index, op) for index, op in enumerate(ops)]
+    applier.flush_creates()
+    applier.deltas.apply()
+    return results, applier.changes
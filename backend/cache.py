@@ -0,0 +1,175 @@
+import threading
+import uuid
+from collections import OrderedDict
+from werkzeug.utils import import_string
+
+
+class SnapshotBackend:
+    """Storage interface for cached /list snapshots and per-user versions.
+
+    The in-process MemoryBackend is used by default. A backend shared between
+    worker processes (Redis, memcached, ...) only needs to implement these
+    methods and be named in the SNAPSHOT_CACHE_BACKEND setting.
+
+    Snapshots are stored under a user ID, or under a (user ID, variant) pair
+    for the other encodings of the same response (see encoding.py); versions
+    are always per user ID.
+    """
+
+    # Identifies the lifetime of the stored versions, so ETags issued by a
+    # backend that has since been reset can never match again
+    epoch = ""
+
+    def get_version(self, user_id):
+        raise NotImplementedError
+
+    def bump_version(self, user_id):
+        raise NotImplementedError
+
+    def get(self, key):
+        """Return the stored (version, body) pair for a key, or None."""
+        raise NotImplementedError
+
+    def set(self, key, version, body):
+        raise NotImplementedError
+
+    def stats(self):
+        return {}
+
+
+class MemoryBackend(SnapshotBackend):
+    """Thread-safe in-process LRU bounded by entry count and total body size.
+
+    Versions live in this process only, so with several worker processes a
+    shared backend is needed for one worker to see another worker's writes.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.epoch = uuid.uuid4().hex[:8]
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (version, body), oldest first
+        self._versions = {}  # Versions are tiny and are never evicted
+        self._variants = {}  # user_id -> (user_id, variant) keys stored for it
+        self._bytes = 0
+        self.evictions = 0
+
+    def get_version(self, user_id):
+        return self._versions.get(user_id, 0)
+
+    def bump_version(self, user_id):
+        with self._lock:
+            version = self._versions.get(user_id, 0) + 1
+            self._versions[user_id] = version
+            # The stored snapshots are stale now, so free their memory right away
+            for key in (user_id, *self._variants.pop(user_id, ())):
+                entry = self._entries.pop(key, None)
+                if entry is not None:
+                    self._bytes -= len(entry[1])
+            return version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, version, body):
+        if len(body) > self.max_bytes:
+            return  # Never let a single snapshot flush the whole cache
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old[1])
+            if isinstance(key, tuple):
+                self._variants.setdefault(key[0], set()).add(key)
+            self._entries[key] = (version, body)
+            self._bytes += len(body)
+            # Evict least recently used snapshots until both budgets are met
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+
+class SnapshotCache:
+    """Per-user cache of serialized /list responses with write-through invalidation.
+
+    Every mutating route bumps the user's version after committing; a snapshot
+    is only served while it was built for the current version.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("SNAPSHOT_CACHE_BACKEND", None)
+        app.config.setdefault("SNAPSHOT_CACHE_MAX_ENTRIES", 1024)
+        app.config.setdefault("SNAPSHOT_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+        backend = app.config["SNAPSHOT_CACHE_BACKEND"]
+        if backend is None:
+            backend = MemoryBackend(
+                max_entries=app.config["SNAPSHOT_CACHE_MAX_ENTRIES"],
+                max_bytes=app.config["SNAPSHOT_CACHE_MAX_BYTES"],
+            )
+        elif isinstance(backend, str):
+            # Allow "package.module:Class" or "package.module.Class" in config
+            backend = import_string(backend)()
+        self.backend = backend
+
+    def version(self, user_id):
+        return self.backend.get_version(user_id)
+
+    def bump(self, user_id):
+        # Called after every committed change to the user's lists or items
+        return self.backend.bump_version(user_id)
+
+    def etag(self, user_id, version, variant=None):
+        # Each variant is a different representation, so it needs its own ETag
+        etag = f"{self.backend.epoch}-{user_id}-{version}"
+        return etag if variant is None else f"{etag}-{variant}"
+
+    def get(self, user_id, version, variant=None):
+        """Return the cached body for the given version, or None on a miss."""
+        entry = self.backend.get(key(user_id, variant))
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def put(self, user_id, version, body, variant=None):
+        self.backend.set(key(user_id, variant), version, body)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            **self.backend.stats(),
+        }
+
+
+def key(user_id, variant):
+    # The default response is stored under the bare user ID
+    return user_id if variant is None else (user_id, variant)
+
+
+# Shared cache instance, bound to the app in create_app
+snapshots = SnapshotCache()
@@ -0,0 +1,89 @@
+import os
+from sqlalchemy import event
+
+# Database settings read from the environment, with the defaults used when a
+# variable is not set. SQLALCHEMY_DATABASE_URI may point at any server database
+# SQLAlchemy supports; the SQLITE_* pragmas only apply to SQLite URIs.
+DEFAULTS = {
+    "SQLALCHEMY_DATABASE_URI": "sqlite:///todo.db",
+    # SQLite connect-time pragmas
+    "SQLITE_JOURNAL_MODE": "WAL",  # Readers no longer block the single writer
+    "SQLITE_SYNCHRONOUS": "NORMAL",  # fsync at checkpoints, not on every commit
+    "SQLITE_BUSY_TIMEOUT_MS": "5000",  # Wait for the write lock instead of failing
+    "SQLITE_MMAP_SIZE": str(256 * 1024 * 1024),  # Bytes of the file to memory-map
+    "SQLITE_CACHE_SIZE": "-65536",  # Page cache size, negative values are KiB
+    # Engine connection pool
+    "DB_POOL_SIZE": "10",
+    "DB_MAX_OVERFLOW": "20",
+    "DB_POOL_TIMEOUT": "30",
+    "DB_POOL_RECYCLE": "3600",
+    "DB_POOL_PRE_PING": "false",
+    # Async engine for the hot reads of the ASGI app (see aio.py); when unset,
+    # SQLite databases are opened with aiosqlite and others are not used
+    "ASYNC_DATABASE_URI": "",
+}
+
+
+def env_setting(name, environ):
+    return environ.get(name, DEFAULTS[name])
+
+
+def env_flag(name, environ=None, default=""):
+    # Boolean setting: the DEFAULTS entry of a database setting, else ``default``
+    environ = os.environ if environ is None else environ
+    value = environ.get(name, DEFAULTS.get(name, default))
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def load_database_config(environ=None):
+    """Build the Flask config for the database from environment variables."""
+    environ = os.environ if environ is None else environ
+    uri = env_setting("SQLALCHEMY_DATABASE_URI", environ)
+    config = {
+        "SQLALCHEMY_DATABASE_URI": uri,
+        "ASYNC_DATABASE_URI": env_setting("ASYNC_DATABASE_URI", environ) or None,
+        "SQLITE_PRAGMAS": {
+            "journal_mode": env_setting("SQLITE_JOURNAL_MODE", environ),
+            "synchronous": env_setting("SQLITE_SYNCHRONOUS", environ),
+            "busy_timeout": int(env_setting("SQLITE_BUSY_TIMEOUT_MS", environ)),
+            "mmap_size": int(env_setting("SQLITE_MMAP_SIZE", environ)),
+            "cache_size": int(env_setting("SQLITE_CACHE_SIZE", environ)),
+        },
+    }
+
+    engine_options = {"pool_pre_ping": env_flag("DB_POOL_PRE_PING", environ)}
+    in_memory = uri in ("sqlite://", "sqlite:///:memory:") or "mode=memory" in uri
+    if not in_memory:
+        # In-memory SQLite uses a single static connection and takes no pool sizing
+        engine_options.update(
+            pool_size=int(env_setting("DB_POOL_SIZE", environ)),
+            max_overflow=int(env_setting("DB_MAX_OVERFLOW", environ)),
+            pool_timeout=int(env_setting("DB_POOL_TIMEOUT", environ)),
+            pool_recycle=int(env_setting("DB_POOL_RECYCLE", environ)),
+        )
+    if uri.startswith("sqlite"):
+        # Let pysqlite wait as long as the busy_timeout pragma
+        busy_timeout = config["SQLITE_PRAGMAS"]["busy_timeout"]
+        engine_options["connect_args"] = {"timeout": busy_timeout / 1000}
+    config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
+    return config
+
+
+def init_database(app, db):
+    """Apply the configured pragmas to every new SQLite connection of the app."""
+    with app.app_context():
+        engine = db.engine
+    apply_sqlite_pragmas(engine, app.config.get("SQLITE_PRAGMAS", {}))
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    # Also used on the sync side of the ASGI app's async engine
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
@@ -0,0 +1,397 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import timedelta
+from flask import current_app, jsonify, request
+from flask_jwt_extended import create_access_token, get_jwt, get_jwt_request_location
+from sqlalchemy import Column, Index, Integer, MetaData, Table, Text, func, select
+from werkzeug.utils import import_string
+from .cache import snapshots
+from .sync import last_revision
+
+# Change feed: every committed change to a user's data is published as a
+# compact event that /events streams to the user's open tabs and devices, so
+# they can patch their copy instead of re-fetching /list. An event looks like
+#
+#   {"op": "item.update", "item_id": 16, "fields": {"completed": true},
+#    "version": 42, "revision": 97}
+#
+# where "version" is the user's /list snapshot version after the change and
+# "revision" its /sync revision, so a client that missed events can catch up
+# with /sync?since=<the last revision it applied>.
+# Requests that change several things at once (/batch, /list/update) publish
+# one event with op "batch" and a "changes" list of such entries.
+#
+# Each backend stores a bounded history per user and hands out increasing
+# cursors, which /events sends as SSE ids so a reconnecting client can resume
+# with Last-Event-ID. When the history no longer reaches back that far the
+# client is told to reload instead.
+#
+# EventSource cannot send headers, so /events also takes its token as ?jwt=.
+# Query strings end up in server and proxy access logs, so only stream tokens
+# from POST /events/token are accepted there: they expire after
+# EVENTS_TOKEN_TTL seconds and open nothing but /events.
+
+# "scope" claim of stream tokens
+STREAM_SCOPE = "events"
+
+
+# Event log of DatabaseBackend, created by migration 6
+change_events = Table(
+    "change_events",
+    MetaData(),
+    Column("id", Integer, primary_key=True),  # The event's cursor
+    Column("user_id", Integer, nullable=False),
+    Column("event", Text, nullable=False),  # The event as JSON
+    Index("ix_change_events_user_id_id", "user_id", "id"),
+)
+
+
+class ChangeBackend:
+    """Storage and fan-out interface for change events.
+
+    The in-process MemoryBackend is used by default. DatabaseBackend shares
+    events between worker processes through the app's database; a broker
+    backend (Redis streams, ...) only needs to implement these methods and be
+    named in the CHANGE_FEED_BACKEND setting.
+    """
+
+    # Identifies the lifetime of the cursors, like SnapshotBackend.epoch
+    epoch = ""
+    # Seconds between since() calls of the default wait_async()
+    poll_interval = 0.5
+
+    def publish(self, user_id, event):
+        """Store an event and wake the user's subscribers; return its cursor."""
+        raise NotImplementedError
+
+    def latest(self, user_id):
+        """Return the cursor of the newest event, so a stream can start there."""
+        raise NotImplementedError
+
+    def since(self, user_id, cursor):
+        """Return the [(cursor, event)] newer than a cursor, oldest first.
+
+        Returns None if events after the cursor may already have been dropped.
+        """
+        raise NotImplementedError
+
+    def wait(self, user_id, cursor, timeout):
+        """Like since(), but block up to ``timeout`` seconds for a new event."""
+        raise NotImplementedError
+
+    async def wait_async(self, user_id, cursor, timeout):
+        """Like wait(), for the ASGI app; waiting must not block the event loop.
+
+        This default polls since() from a worker thread every poll_interval.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            events = await asyncio.to_thread(self.since, user_id, cursor)
+            remaining = deadline - time.monotonic()
+            if events or events is None or remaining <= 0:
+                return events
+            await asyncio.sleep(min(self.poll_interval, remaining))
+
+
+class MemoryBackend(ChangeBackend):
+    """Thread-safe in-process event log, keeping the newest events of each user.
+
+    Subscribers in other worker processes never see these events; use a
+    shared backend when running more than one process.
+    """
+
+    def __init__(self, history=1000):
+        self.history = history
+        self.epoch = uuid.uuid4().hex[:8]
+        self._cond = threading.Condition()
+        self._cursor = 0  # Last cursor handed out, shared by all users
+        self._events = defaultdict(deque)  # user_id -> deque of (cursor, event)
+        self._dropped = {}  # user_id -> cursor of the newest dropped event
+        self._waiters = defaultdict(set)  # user_id -> {(loop, future)} of streams
+
+    def publish(self, user_id, event):
+        with self._cond:
+            self._cursor += 1
+            events = self._events[user_id]
+            events.append((self._cursor, event))
+            if len(events) > self.history:
+                self._dropped[user_id] = events.popleft()[0]
+            self._cond.notify_all()
+            # Wake the user's async streams, which may run on another thread
+            for loop, waiter in self._waiters.pop(user_id, ()):
+                loop.call_soon_threadsafe(wake, waiter)
+            return self._cursor
+
+    def latest(self, user_id):
+        return self._cursor
+
+    def since(self, user_id, cursor):
+        with self._cond:
+            if cursor < self._dropped.get(user_id, 0) or cursor > self._cursor:
+                return None
+            return [
+                entry for entry in self._events.get(user_id, ()) if entry[0] > cursor
+            ]
+
+    def wait(self, user_id, cursor, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events = self.since(user_id, cursor)
+                remaining = deadline - time.monotonic()
+                if events or events is None or remaining <= 0:
+                    return events
+                self._cond.wait(remaining)
+
+    async def wait_async(self, user_id, cursor, timeout):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            with self._cond:
+                events = self.since(user_id, cursor)
+                remaining = deadline - loop.time()
+                if events or events is None or remaining <= 0:
+                    return events
+                waiter = loop.create_future()
+                self._waiters[user_id].add((loop, waiter))
+            await asyncio.wait([waiter], timeout=remaining)
+            with self._cond:
+                self._waiters[user_id].discard((loop, waiter))
+
+
+def wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class DatabaseBackend(ChangeBackend):
+    """Event log in the change_events table, shared by every worker process.
+
+    Needs no broker, which makes it the simple choice for several gunicorn
+    workers on one SQLite file. Subscribers poll the table, so each open
+    stream costs one indexed query per poll interval. Only the newest
+    ``history`` events of all users are kept.
+    """
+
+    epoch = "db"
+
+    def __init__(self, history=10000, poll_interval=0.5):
+        self.history = history
+        self.poll_interval = poll_interval
+        self._published = 0
+
+    def engine(self):
+        from . import db
+
+        return db.engine
+
+    def publish(self, user_id, event):
+        with self.engine().begin() as conn:
+            cursor = conn.execute(
+                change_events.insert().values(user_id=user_id, event=json.dumps(event))
+            ).inserted_primary_key[0]
+            self._published += 1
+            if self._published % 100 == 0:
+                # Trim the log now and then rather than on every write
+                conn.execute(
+                    change_events.delete().where(
+                        change_events.c.id <= cursor - self.history
+                    )
+                )
+        return cursor
+
+    def latest(self, user_id):
+        with self.engine().connect() as conn:
+            return conn.execute(select(func.max(change_events.c.id))).scalar() or 0
+
+    def since(self, user_id, cursor):
+        with self.engine().connect() as conn:
+            oldest = conn.execute(select(func.min(change_events.c.id))).scalar()
+            if oldest is not None and cursor < oldest - 1:
+                return None
+            rows = conn.execute(
+                select(change_events.c.id, change_events.c.event)
+                .where(change_events.c.user_id == user_id, change_events.c.id > cursor)
+                .order_by(change_events.c.id)
+            ).all()
+        return [(row.id, json.loads(row.event)) for row in rows]
+
+    def wait(self, user_id, cursor, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            events = self.since(user_id, cursor)
+            remaining = deadline - time.monotonic()
+            if events or events is None or remaining <= 0:
+                return events
+            time.sleep(min(self.poll_interval, remaining))
+
+
+def create_stream_token(user_id):
+    # Short-lived token for the ?jwt= parameter of /events
+    expires = timedelta(seconds=current_app.config["EVENTS_TOKEN_TTL"])
+    return create_access_token(
+        identity=user_id,
+        expires_delta=expires,
+        additional_claims={"scope": STREAM_SCOPE},
+    )
+
+
+def query_token_allowed():
+    """Check the token of a verified request against the query string rule.
+
+    A token sent in the query string must be a stream token; a full access
+    token there would be written to access logs.
+    """
+    return (
+        get_jwt_request_location() != "query_string"
+        or get_jwt().get("scope") == STREAM_SCOPE
+    )
+
+
+def restrict_stream_tokens(jwt):
+    # Refuse stream tokens on every route but /events (JWTManager callbacks)
+    @jwt.token_verification_loader
+    def check_token_scope(jwt_header, jwt_data):
+        return (
+            jwt_data.get("scope") != STREAM_SCOPE or request.endpoint == "todo.events"
+        )
+
+    @jwt.token_verification_failed_loader
+    def token_scope_failed(jwt_header, jwt_data):
+        message = "This token only opens /events"
+        return jsonify({"success": False, "message": message}), 401
+
+
+class ChangeFeed:
+    """Publishes users' change events and streams them as Server-Sent Events."""
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("CHANGE_FEED_BACKEND", None)
+        app.config.setdefault("CHANGE_FEED_HISTORY", 1000)
+        # Seconds between keep-alive comments on an idle stream
+        app.config.setdefault("CHANGE_FEED_HEARTBEAT", 15)
+        # Streams end after this many seconds; EventSource reconnects and
+        # resumes, which keeps threads and expired tokens from lingering
+        app.config.setdefault("CHANGE_FEED_STREAM_SECONDS", 300)
+        # Lifetime of the stream tokens of POST /events/token; a stream keeps
+        # running after its token expires, but reconnecting needs a new one
+        app.config.setdefault("EVENTS_TOKEN_TTL", 60)
+        backend = app.config["CHANGE_FEED_BACKEND"]
+        if backend is None:
+            backend = MemoryBackend(history=app.config["CHANGE_FEED_HISTORY"])
+        elif isinstance(backend, str):
+            # Allow "package.module:Class" or "package.module.Class" in config
+            backend = import_string(backend)()
+        self.backend = backend
+        self.heartbeat = app.config["CHANGE_FEED_HEARTBEAT"]
+        self.stream_seconds = app.config["CHANGE_FEED_STREAM_SECONDS"]
+
+    def publish(self, user_id, event):
+        return self.backend.publish(user_id, event)
+
+    def event_id(self, cursor):
+        return f"{self.backend.epoch}-{cursor}"
+
+    def parse_event_id(self, event_id):
+        # Cursor of an SSE id issued by this backend, or None if it is foreign
+        epoch, _, cursor = (event_id or "").rpartition("-")
+        if epoch != self.backend.epoch or not cursor.isdigit():
+            return None
+        return int(cursor)
+
+    def open(self, user_id, last_event_id):
+        # Cursor a stream starts after, and the messages it opens with
+        cursor = self.parse_event_id(last_event_id)
+        messages = ["retry: 3000\n\n"]  # Reconnect delay for EventSource, in ms
+        if cursor is None:
+            cursor = self.backend.latest(user_id)
+            if last_event_id:
+                # Unknown or expired ID: the client must reload to catch up
+                messages.append(
+                    self.message(cursor, "reset", {"reason": "unknown event id"})
+                )
+            else:
+                messages.append(self.message(cursor, "ready", {}))
+        return cursor, messages
+
+    def deliver(self, cursor, events):
+        # Messages for the result of a wait, and the cursor to continue after
+        if events is None:
+            # Events were dropped from the history before the client got them;
+            # the cursor is the backend's latest one
+            return cursor, [
+                self.message(cursor, "reset", {"reason": "history expired"})
+            ]
+        if not events:
+            return cursor, [": keep-alive\n\n"]
+        return events[-1][0], [
+            self.message(event_cursor, "change", event)
+            for event_cursor, event in events
+        ]
+
+    def stream(self, user_id, last_event_id=None):
+        """Yield the SSE messages of a user's feed, resuming after an event ID."""
+        cursor, messages = self.open(user_id, last_event_id)
+        yield from messages
+        ends_at = time.monotonic() + self.stream_seconds
+        while True:
+            remaining = ends_at - time.monotonic()
+            if remaining <= 0:
+                return
+            events = self.backend.wait(user_id, cursor, min(self.heartbeat, remaining))
+            if events is None:
+                cursor = self.backend.latest(user_id)
+            cursor, messages = self.deliver(cursor, events)
+            yield from messages
+
+    async def stream_async(self, user_id, last_event_id=None):
+        """Async version of stream() for the ASGI app, holding no thread."""
+        cursor, messages = await asyncio.to_thread(self.open, user_id, last_event_id)
+        for message in messages:
+            yield message
+        ends_at = time.monotonic() + self.stream_seconds
+        while True:
+            remaining = ends_at - time.monotonic()
+            if remaining <= 0:
+                return
+            events = await self.backend.wait_async(
+                user_id, cursor, min(self.heartbeat, remaining)
+            )
+            if events is None:
+                cursor = await asyncio.to_thread(self.backend.latest, user_id)
+            cursor, messages = self.deliver(cursor, events)
+            for message in messages:
+                yield message
+
+    def message(self, cursor, kind, data):
+        return (
+            f"id: {self.event_id(cursor)}\nevent: {kind}\n"
+            f"data: {json.dumps(data, separators=(',', ':'))}\n\n"
+        )
+
+
+# Shared feed instance, bound to the app in create_app
+changes = ChangeFeed()
+
+
+def publish_change(user_id, op, revision=None, **change):
+    """Record a committed change: bump the /list version and notify clients.
+
+    Call after the commit, in place of a bare snapshots.bump(); returns the
+    new version. ``revision`` defaults to the one of the committed transaction.
+    """
+    version = snapshots.bump(user_id)
+    if revision is None:
+        revision = last_revision()
+    event = {"op": op, **change, "version": version, "revision": revision}
+    changes.publish(user_id, event)
+    return version
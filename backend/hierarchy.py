@@ -0,0 +1,285 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.orm import aliased
+from .models import db, ArchivedItem, TodoList, TodoItem
+from .ranks import RankError, append_rank, rank_next_to
+from .rollup import RollupDeltas, rebuild_rollups, subtree_totals
+from .sync import add_tombstones, revision_entry, stamp, stamp_other_owner
+
+# Materialized-path helpers for the TodoItem hierarchy.
+#
+# Every item stores the IDs of its ancestors in ``path``, root first, each one
+# terminated by a "/" (a top-level item has the empty path, a child of item 7
+# has "7/", a grandchild "7/12/" and so on). The descendants of an item are
+# then exactly the rows whose path starts with ``<item.path><item.id>/``, which
+# SQLite answers as a range scan on the path index.
+
+
+class HierarchyError(ValueError):
+    """Raised when a change would corrupt the tree (e.g. moving under a descendant)."""
+
+
+def subtree_prefix(item):
+    # Path shared by every descendant of the item
+    return f"{item.path or ''}{item.id}/"
+
+
+def prefix_range(prefix, column=TodoItem.path):
+    # All paths starting with the prefix sort between the prefix itself and the
+    # same string with its trailing "/" replaced by "0" (the next ASCII character)
+    return and_(column >= prefix, column < prefix[:-1] + "0")
+
+
+def descendants_query(item):
+    """Query every descendant of an item, at any depth, with one indexed range scan."""
+    return TodoItem.query.filter(prefix_range(subtree_prefix(item)))
+
+
+def ancestor_ids(item):
+    # Ancestor IDs ordered from the root down to the direct parent
+    return [int(part) for part in (item.path or "").split("/") if part]
+
+
+def ancestors_query(item):
+    """Query the ancestors of an item by primary key, from the path alone."""
+    return TodoItem.query.filter(TodoItem.id.in_(ancestor_ids(item)))
+
+
+def child_path(parent):
+    # Path for a new item placed under the given parent (or at the top level)
+    return "" if parent is None else subtree_prefix(parent)
+
+
+def is_in_subtree(candidate, item):
+    # True if the candidate is the item itself or one of its descendants
+    return candidate.id == item.id or (candidate.path or "").startswith(
+        subtree_prefix(item)
+    )
+
+
+def move_subtree(item, new_parent, after=None, before=None):
+    """Re-parent an item and rewrite the paths of its whole subtree.
+
+    The descendants are updated with a single UPDATE over the path range, and
+    follow the item into the new parent's list if it belongs to another one.
+    The item is placed after the sibling ``after`` and/or before ``before``,
+    or else last among its new siblings; when only its position changes,
+    its own row is the only one written. Raises HierarchyError if the new
+    parent is the item or one of its descendants, or a given sibling is not
+    a child of the new parent.
+    """
+    if new_parent is not None and is_in_subtree(new_parent, item):
+        raise HierarchyError("An item cannot be moved under itself or its subtasks")
+    new_parent_id = None if new_parent is None else new_parent.id
+    new_list_id = item.list_id if new_parent is None else new_parent.list_id
+    for sibling in (after, before):
+        if sibling is not None and (
+            sibling.id == item.id
+            or sibling.parent_id != new_parent_id
+            or sibling.list_id != new_list_id
+        ):
+            raise HierarchyError("Items can only be placed next to their siblings")
+
+    if item.parent_id != new_parent_id or item.list_id != new_list_id:
+        reparent(item, new_parent)
+        if after is None and before is None:
+            item.rank = append_rank(item.list_id, item.parent_id)
+    if after is not None or before is not None:
+        try:
+            item.rank = rank_next_to(item, after, before)
+        except RankError as e:
+            raise HierarchyError(str(e))
+
+
+def reparent(item, new_parent):
+    # Move the item and its subtree under the new parent, with their counters
+    old_prefix = subtree_prefix(item)
+    old_path = item.path
+    old_list_id = item.list_id
+    size, completed = subtree_totals(item.id)
+    new_list_id = item.list_id if new_parent is None else new_parent.list_id
+    item.parent_id = None if new_parent is None else new_parent.id
+    item.path = child_path(new_parent)
+    item.list_id = new_list_id
+    new_prefix = subtree_prefix(item)
+
+    if new_prefix != old_prefix or new_list_id != old_list_id:
+        # Swap the old prefix for the new one on every descendant; a change of
+        # list is visible to clients, so the descendants are synced again then
+        db.session.execute(
+            update(TodoItem)
+            .where(prefix_range(old_prefix))
+            .values(
+                path=new_prefix + func.substr(TodoItem.path, len(old_prefix) + 1),
+                list_id=new_list_id,
+                **(stamp() if new_list_id != old_list_id else {}),
+            )
+            .execution_options(synchronize_session="fetch")
+        )
+        # Archived descendants follow, so they can be restored in place
+        db.session.execute(
+            update(ArchivedItem)
+            .where(prefix_range(old_prefix, ArchivedItem.path))
+            .values(
+                path=new_prefix + func.substr(ArchivedItem.path, len(old_prefix) + 1),
+                list_id=new_list_id,
+            )
+        )
+
+    # Move the subtree's weight from the old ancestor chain to the new one
+    deltas = RollupDeltas()
+    deltas.add(old_path, old_list_id, -size, -completed)
+    deltas.add(item.path, new_list_id, size, completed)
+    deltas.apply()
+
+
+def delete_subtree(item):
+    """Delete an item and all of its descendants with a single DELETE statement.
+
+    Leaves a tombstone for each deleted row and returns how many there were.
+    Archived descendants are deleted as well.
+    """
+    size, completed = subtree_totals(item.id)
+    db.session.execute(
+        delete(ArchivedItem).where(
+            prefix_range(subtree_prefix(item), ArchivedItem.path)
+        )
+    )
+    deleted = db.session.scalars(
+        delete(TodoItem)
+        .where(or_(TodoItem.id == item.id, prefix_range(subtree_prefix(item))))
+        .returning(TodoItem.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    add_tombstones("item", deleted)
+    # Take the removed subtree off the counters of its ancestors and list
+    deltas = RollupDeltas()
+    deltas.add(item.path, item.list_id, -size, -completed)
+    deltas.apply()
+    return len(deleted)
+
+
+def reroot_children(list_id):
+    """Make the items that other lists keep under a list's items top-level.
+
+    Subtasks normally share their parent's list, but rows written before
+    that was enforced may not. Each such item becomes the last top-level item
+    of its own list, with its subtree. Items of another user's lists are
+    stamped with a revision of that user (see stamp_other_owner). Returns
+    (item ID, list ID, owner ID, revision or None) for each re-rooted item.
+    """
+    parent = aliased(TodoItem)
+    outermost = (
+        select(TodoItem)
+        .join(parent, TodoItem.parent_id == parent.id)
+        .where(parent.list_id == list_id, TodoItem.list_id != list_id)
+        .order_by(func.length(TodoItem.path), TodoItem.id)
+        .limit(1)
+    )
+    user_id = revision_entry(db.session)[0]
+    rerooted = []
+    while True:
+        # One at a time: a re-rooted subtree takes any nested ones along
+        item = db.session.scalars(outermost).first()
+        if item is None:
+            break
+        reparent(item, None)
+        item.rank = append_rank(item.list_id, None)
+        db.session.flush()
+        owner_id = db.session.get(TodoList, item.list_id).owner_id
+        # Stamp the whole subtree: items of the deleted list came along with it
+        in_subtree = or_(TodoItem.id == item.id, prefix_range(subtree_prefix(item)))
+        revision = None
+        if owner_id == user_id:
+            db.session.execute(
+                update(TodoItem)
+                .where(in_subtree)
+                .values(**stamp())
+                .execution_options(synchronize_session=False)
+            )
+        else:
+            revision = stamp_other_owner(owner_id, in_subtree)
+        rerooted.append((item.id, item.list_id, owner_id, revision))
+    if rerooted:
+        # Subtrees may have mixed lists, so recount the lists they are in now
+        rebuild_rollups(db.session.connection(), sorted({row[1] for row in rerooted}))
+    return rerooted
+
+
+def delete_list_items(list_id):
+    """Delete every item of a list and its archived items.
+
+    Items of other lists under them are kept and re-rooted first; returns
+    them as reroot_children does.
+    """
+    rerooted = reroot_children(list_id)
+    deleted = db.session.scalars(
+        delete(TodoItem)
+        .where(TodoItem.list_id == list_id)
+        .returning(TodoItem.id)
+        .execution_options(synchronize_session=False)
+    ).all()
+    add_tombstones("item", deleted)
+    db.session.execute(delete(ArchivedItem).where(ArchivedItem.list_id == list_id))
+    return rerooted
+
+
+def compute_paths(parents):
+    """Compute the path of every item in a {id: parent_id} mapping.
+
+    Items whose parent is missing from the mapping, or that sit on a parent_id
+    cycle, are treated as top-level items.
+    """
+    paths = {}
+
+    def resolve(item_id):
+        # Walk up to the nearest item with a known path, then fill paths back down
+        chain = []
+        seen = set()
+        current = item_id
+        while current is not None and current not in paths:
+            if current in seen or current not in parents:
+                break
+            seen.add(current)
+            chain.append(current)
+            current = parents[current]
+        prefix = paths[current] + f"{current}/" if current in paths else ""
+        for node in reversed(chain):
+            paths[node] = prefix
+            prefix += f"{node}/"
+
+    for item_id in parents:
+        resolve(item_id)
+    return paths
+
+
+def rebuild_paths():
+    """Recompute the path of every item from parent_id and return how many changed.
+
+    Used to backfill databases created before the path column existed and to
+    repair the index.
+    """
+    rows = db.session.execute(
+        db.select(TodoItem.id, TodoItem.parent_id, TodoItem.path)
+    ).all()
+    paths = compute_paths({row.id: row.parent_id for row in rows})
+
+    changes = [
+        {"id": row.id, "path": paths[row.id]}
+        for row in rows
+        if row.path != paths[row.id]
+    ]
+    if changes:
+        # Bulk UPDATE by primary key, executed as a single executemany
+        db.session.execute(update(TodoItem), changes)
+    db.session.commit()
+    return len(changes)
+
+
+# CLI command to recompute the hierarchy index: flask --app backend rebuild-paths
+@click.command("rebuild-paths")
+@with_appcontext
+def rebuild_paths_command():
+    changed = rebuild_paths()
+    click.echo(f"Rebuilt paths, {changed} item(s) updated")
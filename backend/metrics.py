@@ -0,0 +1,347 @@
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from flask import Response, request
+from sqlalchemy import event
+from .cache import snapshots
+from .database import env_flag
+
+# Opt-in request instrumentation, turned on with INSTRUMENTATION=true in the
+# environment or the app config. Each request then records its wall time, the
+# number and total time of its SQL statements and the time spent serializing
+# trees, and answers with a Server-Timing header. Aggregates are served in the
+# Prometheus text format on /metrics; they are per process, like the snapshot
+# cache. When it is off nothing is registered at all: no request hooks, no
+# engine listeners and no /metrics route, and measure() returns a no-op.
+#
+# Requests with more than INSTRUMENTATION_QUERY_LIMIT statements are logged
+# and counted as likely N+1 query patterns. PROFILE_REQUESTS="header" samples
+# the stack of requests sent with "X-Profile: <PROFILE_TOKEN>" (any value on a
+# debug server when no token is set), "all" samples every request;
+# each profile is written to PROFILE_DIR in the collapsed-stack format read by
+# flamegraph.pl and speedscope, and named in the X-Profile response header.
+
+# Statistics of the request being served, if it is instrumented
+current_stats = ContextVar("request_stats", default=None)
+
+NOT_MEASURED = nullcontext()
+
+# Upper bounds of the request duration histogram, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """Timings collected while serving one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.timings = defaultdict(float)  # Named sections, see measure()
+        self.sampler = None
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - started
+
+    def server_timing(self, total):
+        # Server-Timing header value, shown by browser developer tools
+        parts = [
+            f"total;dur={total * 1000:.1f}",
+            f'sql;dur={self.sql_seconds * 1000:.1f};desc="{self.queries} queries"',
+        ]
+        for name, seconds in self.timings.items():
+            parts.append(f"{name};dur={seconds * 1000:.1f}")
+        return ", ".join(parts)
+
+
+def measure(name):
+    """Time a section of the current request under ``name``.
+
+    A no-op outside instrumented requests, so hot code can always call it.
+    """
+    stats = current_stats.get()
+    if stats is None:
+        return NOT_MEASURED
+    return stats.timer(name)
+
+
+class Sampler:
+    """Sampling profiler recording the stack of one thread at an interval."""
+
+    def __init__(self, interval, thread_id=None):
+        self.interval = interval
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                filename = os.path.basename(code.co_filename)
+                stack.append(f"{code.co_name} ({filename})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def dump(self, path):
+        # One "frame;frame;frame count" line per distinct stack
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Instrumentation:
+    """Per-request timings, SQL counters and profiles, with Prometheus output."""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault("INSTRUMENTATION", env_flag("INSTRUMENTATION"))
+        # Statements per request above which it is reported as a likely N+1
+        app.config.setdefault("INSTRUMENTATION_QUERY_LIMIT", 20)
+        # "off", "header" (requests sent with X-Profile: <token>) or "all"
+        app.config.setdefault(
+            "PROFILE_REQUESTS", os.environ.get("PROFILE_REQUESTS", "off")
+        )
+        # Secret a client must send in X-Profile to have its request profiled
+        app.config.setdefault("PROFILE_TOKEN", os.environ.get("PROFILE_TOKEN", ""))
+        app.config.setdefault("PROFILE_INTERVAL", 0.005)  # Seconds between samples
+        app.config.setdefault(
+            "PROFILE_DIR", os.path.join(app.instance_path, "profiles")
+        )
+        self.enabled = bool(app.config["INSTRUMENTATION"])
+        if not self.enabled:
+            return
+        self.query_limit = app.config["INSTRUMENTATION_QUERY_LIMIT"]
+        self.profile_requests = app.config["PROFILE_REQUESTS"]
+        self.profile_interval = app.config["PROFILE_INTERVAL"]
+        self.profile_dir = app.config["PROFILE_DIR"]
+        self.profile_token = app.config["PROFILE_TOKEN"]
+        self.debug = app.debug
+        self.logger = app.logger
+
+        from . import db
+
+        with app.app_context():
+            self.instrument_engine(db.engine)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+
+    def reset(self):
+        with self._lock:
+            # (method, endpoint, status) -> count
+            self.requests = Counter()
+            # (method, endpoint) -> totals
+            self.durations = defaultdict(lambda: [0] * len(DURATION_BUCKETS))
+            self.duration_sums = defaultdict(float)
+            self.duration_counts = Counter()
+            self.queries = Counter()
+            self.sql_seconds = defaultdict(float)
+            self.timings = defaultdict(float)  # (method, endpoint, name) -> seconds
+            self.n_plus_one = Counter()
+
+    def instrument_engine(self, engine):
+        # Count statements and their time for the request running them
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_cursor_execute(conn, cursor, statement, params, context, many):
+            if current_stats.get() is not None:
+                context.query_started = time.perf_counter()
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_cursor_execute(conn, cursor, statement, params, context, many):
+            stats = current_stats.get()
+            started = getattr(context, "query_started", None)
+            if stats is not None and started is not None:
+                stats.queries += 1
+                stats.sql_seconds += time.perf_counter() - started
+
+    def start(self, headers):
+        """Start collecting statistics for a request with the given headers."""
+        stats = RequestStats()
+        if self.profile_requests == "all" or (
+            self.profile_requests == "header"
+            and self.profile_allowed(headers.get("X-Profile"))
+        ):
+            stats.sampler = Sampler(self.profile_interval)
+        current_stats.set(stats)
+        return stats
+
+    def profile_allowed(self, value):
+        # Every profile costs samples and a file on disk, so only clients that
+        # know PROFILE_TOKEN may ask for one; without a token, only in debug
+        if not value:
+            return False
+        if self.profile_token:
+            return hmac.compare_digest(value.encode(), self.profile_token.encode())
+        return self.debug
+
+    def finish(self, response):
+        # Record the request's statistics and report them on the response
+        stats = current_stats.get()
+        if stats is None:
+            return response
+        current_stats.set(None)
+        total = time.perf_counter() - stats.started
+        key = (request.method, request.endpoint or "unmatched")
+        with self._lock:
+            self.requests[(*key, response.status_code)] += 1
+            buckets = self.durations[key]
+            for n, bound in enumerate(DURATION_BUCKETS):
+                if total <= bound:
+                    buckets[n] += 1
+            self.duration_sums[key] += total
+            self.duration_counts[key] += 1
+            self.queries[key] += stats.queries
+            self.sql_seconds[key] += stats.sql_seconds
+            for name, seconds in stats.timings.items():
+                self.timings[(*key, name)] += seconds
+            if stats.queries > self.query_limit:
+                self.n_plus_one[key] += 1
+        if stats.queries > self.query_limit:
+            self.logger.warning(
+                "%s %s ran %d SQL statements (limit %d), likely an N+1 query",
+                request.method,
+                request.path,
+                stats.queries,
+                self.query_limit,
+            )
+        response.headers["Server-Timing"] = stats.server_timing(total)
+        if stats.sampler is not None:
+            response.headers["X-Profile"] = self.save_profile(stats.sampler, key)
+        return response
+
+    def save_profile(self, sampler, key):
+        sampler.stop()
+        os.makedirs(self.profile_dir, exist_ok=True)
+        method, endpoint = key
+        name = (
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{method}-{endpoint}"
+            f"-{uuid.uuid4().hex[:6]}.txt"
+        )
+        sampler.dump(os.path.join(self.profile_dir, name))
+        return name
+
+    def before_request(self):
+        self.start(request.headers)
+
+    def after_request(self, response):
+        return self.finish(response)
+
+    def teardown_request(self, exc):
+        # A request that failed before after_request still has to stop
+        stats = current_stats.get()
+        if stats is not None:
+            current_stats.set(None)
+            if stats.sampler is not None:
+                stats.sampler.stop()
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+    def render(self):
+        """Return the aggregates in the Prometheus text exposition format."""
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def sample(name, labels, value):
+            lines.append(f"{name}{format_labels(labels)} {value}")
+
+        with self._lock:
+            family("todo_requests_total", "counter", "Requests served.")
+            for (method, endpoint, status), count in sorted(self.requests.items()):
+                labels = {"method": method, "endpoint": endpoint, "status": status}
+                sample("todo_requests_total", labels, count)
+
+            name = "todo_request_duration_seconds"
+            family(name, "histogram", "Request wall time.")
+            for key, buckets in sorted(self.durations.items()):
+                labels = {"method": key[0], "endpoint": key[1]}
+                for bound, count in zip(DURATION_BUCKETS, buckets):
+                    sample(f"{name}_bucket", {**labels, "le": bound}, count)
+                count = self.duration_counts[key]
+                sample(f"{name}_bucket", {**labels, "le": "+Inf"}, count)
+                sample(f"{name}_sum", labels, self.duration_sums[key])
+                sample(f"{name}_count", labels, count)
+
+            for name, help_text, values in (
+                ("todo_sql_queries_total", "SQL statements run.", self.queries),
+                ("todo_sql_duration_seconds_total", "Time in SQL.", self.sql_seconds),
+                (
+                    "todo_suspected_n_plus_one_total",
+                    "Requests over INSTRUMENTATION_QUERY_LIMIT statements.",
+                    self.n_plus_one,
+                ),
+            ):
+                family(name, "counter", help_text)
+                for (method, endpoint), value in sorted(values.items()):
+                    sample(name, {"method": method, "endpoint": endpoint}, value)
+
+            name = "todo_section_duration_seconds_total"
+            family(name, "counter", "Time in measured sections, such as serialize.")
+            for (method, endpoint, section), value in sorted(self.timings.items()):
+                labels = {"method": method, "endpoint": endpoint, "section": section}
+                sample(name, labels, value)
+
+        # Counters kept by the snapshot cache itself
+        cache = snapshots.stats() if snapshots.backend is not None else {}
+        for key, kind in (
+            ("hits", "counter"),
+            ("misses", "counter"),
+            ("evictions", "counter"),
+            ("entries", "gauge"),
+            ("bytes", "gauge"),
+        ):
+            if key in cache:
+                name = f"todo_snapshot_cache_{key}" + (
+                    "_total" if kind == "counter" else ""
+                )
+                family(name, kind, f"/list snapshot cache {key}.")
+                sample(name, {}, cache[key])
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+
+def escape(value):
+    # Label values may not contain raw backslashes, quotes or newlines
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return value.replace("\n", "\\n")
+
+
+# Shared instrumentation instance, bound to the app in create_app
+instrumentation = Instrumentation()
@@ -0,0 +1,416 @@
+from datetime import datetime
+import re
+import click
+from flask.cli import AppGroup
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    inspect,
+    text,
+)
+from sqlalchemy.exc import IntegrityError
+from . import db
+
+# Versioned schema migrations, applied in order at startup and by
+# "flask --app backend db upgrade". Each migration is a function taking a
+# SQLAlchemy connection, runs inside engine.begin() and is recorded in the
+# schema_migrations table. Migrations check the current schema before changing
+# it, so they also bring databases created by the old db.create_all() call in
+# line and are harmless to re-run if two workers start at the same time.
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    # Register a migration function under a version number
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda entry: entry[0])
+        return fn
+
+    return register
+
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def columns(conn, table):
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+def indexes(conn, table):
+    return {index["name"] for index in inspect(conn).get_indexes(table)}
+
+
+def create_index(conn, name, table, *cols):
+    if name not in indexes(conn, table):
+        conn.execute(text(f"CREATE INDEX {name} ON {table} ({', '.join(cols)})"))
+
+
+def drop_index(conn, name, table):
+    if name in indexes(conn, table):
+        conn.execute(text(f"DROP INDEX {name}"))
+
+
+@migration(1, "initial schema")
+def initial_schema(conn):
+    # The tables as they were first created by db.create_all()
+    metadata = MetaData()
+    Table(
+        "users",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("email", String, unique=True, index=True),
+        Column("name", String),
+        Column("username", String, unique=True, index=True),
+        Column("password", String),
+        Column("is_active", Boolean),
+    )
+    Table(
+        "todo_lists",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("title", String, index=True, nullable=False),
+        Column("owner_id", Integer, ForeignKey("users.id")),
+    )
+    Table(
+        "todo_items",
+        metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("content", String, index=True),
+        Column("completed", Boolean),
+        Column("list_id", Integer, ForeignKey("todo_lists.id")),
+        Column("parent_id", Integer, ForeignKey("todo_items.id")),
+    )
+    metadata.create_all(conn, checkfirst=True)
+
+
+@migration(2, "materialized hierarchy path")
+def hierarchy_path(conn):
+    from .hierarchy import compute_paths
+
+    if "path" not in columns(conn, "todo_items"):
+        conn.execute(text("ALTER TABLE todo_items ADD COLUMN path VARCHAR"))
+    create_index(conn, "ix_todo_items_path", "todo_items", "path")
+
+    # Backfill the paths of existing items from their parent links
+    rows = conn.execute(text("SELECT id, parent_id FROM todo_items")).all()
+    paths = compute_paths({row.id: row.parent_id for row in rows})
+    if paths:
+        conn.execute(
+            text("UPDATE todo_items SET path = :path WHERE id = :id"),
+            [{"id": item_id, "path": path} for item_id, path in paths.items()],
+        )
+
+
+@migration(3, "indexes for hot query shapes")
+def hot_query_indexes(conn):
+    # Lookups of a list's top-level items and of an item's children
+    create_index(
+        conn, "ix_todo_items_list_id_parent_id", "todo_items", "list_id", "parent_id"
+    )
+    create_index(conn, "ix_todo_items_parent_id", "todo_items", "parent_id")
+    # Every /list request starts from the user's lists
+    create_index(conn, "ix_todo_lists_owner_id", "todo_lists", "owner_id")
+    # Never queried; each one only slowed down inserts and edits
+    drop_index(conn, "ix_todo_items_content", "todo_items")
+    drop_index(conn, "ix_todo_lists_title", "todo_lists")
+    # Duplicates of the integer primary keys
+    drop_index(conn, "ix_todo_items_id", "todo_items")
+    drop_index(conn, "ix_todo_lists_id", "todo_lists")
+    drop_index(conn, "ix_users_id", "users")
+
+
+@migration(4, "rollup completion counters")
+def rollup_counters(conn):
+    from .rollup import rebuild_rollups
+
+    for table in ("todo_items", "todo_lists"):
+        for column in ("total_descendants", "completed_descendants"):
+            if column not in columns(conn, table):
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {table} ADD COLUMN {column}"
+                        " INTEGER NOT NULL DEFAULT 0"
+                    )
+                )
+    rebuild_rollups(conn)
+
+
+@migration(5, "full-text search index")
+def search_index(conn):
+    # FTS5 is SQLite only; elsewhere search falls back to LIKE (see search.py)
+    if conn.dialect.name != "sqlite":
+        return
+    # External-content index over this view: it stores only the tokens. The
+    # owner column lets a search intersect a word with the user's own items
+    # instead of ranking every user's matches. 2- and 3-character prefix
+    # indexes keep short "ab*" queries cheap.
+    conn.execute(
+        text(
+            "CREATE VIEW IF NOT EXISTS todo_items_search AS"
+            " SELECT todo_items.id, todo_items.content, todo_lists.owner_id AS owner"
+            " FROM todo_items JOIN todo_lists ON todo_lists.id = todo_items.list_id"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS todo_items_fts USING fts5("
+            "content, owner, content='todo_items_search', content_rowid='id',"
+            " tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+    )
+    # Keep the index in sync with every write, including bulk statements.
+    # Updates that leave content alone (toggles, moves) do not touch it. Lists
+    # never change owner, and their items are deleted before the list itself.
+    conn.execute(
+        text(
+            "CREATE TRIGGER IF NOT EXISTS todo_items_fts_insert"
+            " AFTER INSERT ON todo_items BEGIN"
+            " INSERT INTO todo_items_fts(rowid, content, owner)"
+            " SELECT new.id, new.content, owner_id FROM todo_lists"
+            " WHERE id = new.list_id;"
+            " END"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE TRIGGER IF NOT EXISTS todo_items_fts_delete"
+            " AFTER DELETE ON todo_items BEGIN"
+            " INSERT INTO todo_items_fts(todo_items_fts, rowid, content, owner)"
+            " SELECT 'delete', old.id, old.content, owner_id FROM todo_lists"
+            " WHERE id = old.list_id;"
+            " END"
+        )
+    )
+    conn.execute(
+        text(
+            "CREATE TRIGGER IF NOT EXISTS todo_items_fts_update"
+            " AFTER UPDATE OF content ON todo_items BEGIN"
+            " INSERT INTO todo_items_fts(todo_items_fts, rowid, content, owner)"
+            " SELECT 'delete', old.id, old.content, owner_id FROM todo_lists"
+            " WHERE id = old.list_id;"
+            " INSERT INTO todo_items_fts(rowid, content, owner)"
+            " SELECT new.id, new.content, owner_id FROM todo_lists"
+            " WHERE id = new.list_id;"
+            " END"
+        )
+    )
+    # Index the existing items
+    conn.execute(text("INSERT INTO todo_items_fts(todo_items_fts) VALUES ('rebuild')"))
+
+
+@migration(6, "change feed event log")
+def change_event_log(conn):
+    # Only used by events.DatabaseBackend, but cheap to have everywhere
+    from .events import change_events
+
+    change_events.create(conn, checkfirst=True)
+
+
+@migration(7, "revisions and tombstones for delta sync")
+def sync_revisions(conn):
+    from .models import Tombstone
+
+    wanted = {
+        "users": ("revision", "sync_floor"),
+        "todo_lists": ("revision",),
+        "todo_items": ("revision",),
+    }
+    for table, names in wanted.items():
+        for column in names:
+            if column not in columns(conn, table):
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {table} ADD COLUMN {column}"
+                        " INTEGER NOT NULL DEFAULT 0"
+                    )
+                )
+    for table in ("todo_lists", "todo_items"):
+        if "updated_at" not in columns(conn, table):
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN updated_at DATETIME"))
+    create_index(
+        conn, "ix_todo_items_list_id_revision", "todo_items", "list_id", "revision"
+    )
+    Tombstone.__table__.create(conn, checkfirst=True)
+
+
+@migration(8, "sibling ranks")
+def sibling_ranks(conn):
+    from itertools import groupby
+    from .ranks import spread_ranks
+
+    if "rank" not in columns(conn, "todo_items"):
+        conn.execute(
+            text("ALTER TABLE todo_items ADD COLUMN rank VARCHAR NOT NULL DEFAULT ''")
+        )
+    # Rank the existing items of each sibling group in ID order, which is the
+    # order they were shown in so far
+    rows = conn.execute(
+        text(
+            "SELECT id, list_id, parent_id FROM todo_items WHERE rank = ''"
+            " ORDER BY list_id, parent_id, id"
+        )
+    ).all()
+    ranks = []
+    for _, group in groupby(rows, key=lambda row: (row.list_id, row.parent_id)):
+        group = list(group)
+        ranks.extend(
+            {"id": row.id, "rank": rank}
+            for row, rank in zip(group, spread_ranks(len(group)))
+        )
+    if ranks:
+        conn.execute(text("UPDATE todo_items SET rank = :rank WHERE id = :id"), ranks)
+    # Same lookups as before, now also returning each group in rank order
+    create_index(
+        conn,
+        "ix_todo_items_list_id_parent_id_rank",
+        "todo_items",
+        "list_id",
+        "parent_id",
+        "rank",
+    )
+    create_index(
+        conn, "ix_todo_items_parent_id_rank", "todo_items", "parent_id", "rank"
+    )
+    drop_index(conn, "ix_todo_items_list_id_parent_id", "todo_items")
+    drop_index(conn, "ix_todo_items_parent_id", "todo_items")
+
+
+@migration(9, "archive of completed items")
+def archived_items(conn):
+    from .models import ArchivedItem
+
+    # SQLite gives a new row the highest ID plus one, so the ID of an archived
+    # item could go to a new item, whose path would then also be a prefix of
+    # the archived subtree. AUTOINCREMENT never hands out an ID twice.
+    if conn.dialect.name == "sqlite":
+        autoincrement_ids(conn, "todo_items")
+    ArchivedItem.__table__.create(conn, checkfirst=True)
+
+
+@migration(10, "list IDs are never reused")
+def list_autoincrement(conn):
+    # Owner checks are cached per process (see access.py). If a deleted
+    # list's ID went to someone else's new list, a process that never saw the
+    # delete would let the old owner write to it.
+    if conn.dialect.name == "sqlite":
+        autoincrement_ids(conn, "todo_lists")
+
+
+def autoincrement_ids(conn, table):
+    """Rebuild an SQLite table with an AUTOINCREMENT primary key.
+
+    The table is copied row for row; its indexes, and the triggers and views
+    that use it, are dropped and recreated from their stored SQL.
+    """
+    create = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :t"),
+        {"t": table},
+    ).scalar_one()
+    if "AUTOINCREMENT" in create.upper():
+        return
+    # The "id INTEGER NOT NULL, ..., PRIMARY KEY (id)" of SQLAlchemy's DDL
+    create, found = re.subn(r",\s*PRIMARY KEY \(id\)", "", create)
+    create, found_id = re.subn(
+        r"\bid INTEGER NOT NULL\b",
+        "id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT",
+        create,
+    )
+    if not found or not found_id:
+        raise RuntimeError(f"Unexpected primary key in the {table} table")
+    create = create.replace(f"CREATE TABLE {table}", f"CREATE TABLE {table}_rebuild", 1)
+
+    dependents = conn.execute(
+        text(
+            "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL AND ("
+            "(type IN ('index', 'trigger') AND tbl_name = :t)"
+            " OR (type IN ('trigger', 'view') AND sql LIKE :like))"
+        ),
+        {"t": table, "like": f"%{table}%"},
+    ).all()
+    # Triggers of other tables reading this one would fail the rename below
+    for row in dependents:
+        if row.type in ("trigger", "view"):
+            conn.execute(text(f"DROP {row.type.upper()} {row.name}"))
+    names = ", ".join(columns(conn, table))
+    conn.execute(text(create))
+    conn.execute(
+        text(f"INSERT INTO {table}_rebuild ({names}) SELECT {names} FROM {table}")
+    )
+    conn.execute(text(f"DROP TABLE {table}"))
+    conn.execute(text(f"ALTER TABLE {table}_rebuild RENAME TO {table}"))
+    # Views first, since triggers may read them
+    for row in sorted(dependents, key=lambda row: row.type != "view"):
+        conn.execute(text(row.sql))
+
+
+def applied_versions(engine):
+    schema_migrations.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        return set(
+            conn.execute(
+                schema_migrations.select().with_only_columns(
+                    schema_migrations.c.version
+                )
+            ).scalars()
+        )
+
+
+def run_migrations(engine=None, target=None):
+    """Apply pending migrations up to ``target`` (all by default).
+
+    Returns the list of (version, name) pairs that were applied.
+    """
+    engine = db.engine if engine is None else engine
+    done = applied_versions(engine)
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+        try:
+            with engine.begin() as conn:
+                fn(conn)
+                conn.execute(
+                    schema_migrations.insert().values(
+                        version=version, name=name, applied_at=datetime.utcnow()
+                    )
+                )
+        except IntegrityError:
+            # Another process recorded this version first
+            continue
+        applied.append((version, name))
+    return applied
+
+
+# CLI group for schema management: flask --app backend db upgrade|status
+db_cli = AppGroup("db", help="Manage the database schema.")
+
+
+@db_cli.command("upgrade")
+@click.option("--target", type=int, default=None, help="Stop at this version.")
+def upgrade_command(target):
+    applied = run_migrations(target=target)
+    for version, name in applied:
+        click.echo(f"Applied {version}: {name}")
+    if not applied:
+        click.echo("Database is up to date")
+
+
+@db_cli.command("status")
+def status_command():
+    done = applied_versions(db.engine)
+    for version, name, _ in MIGRATIONS:
+        click.echo(f"[{'x' if version in done else ' '}] {version}: {name}")
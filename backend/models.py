@@ -1,4 +1,13 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Text
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    Boolean,
+    ForeignKey,
+    DateTime,
+    Text,
+    Index,
+)
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from flask_login import UserMixin
@@ -8,16 +17,14 @@ from . import db, login_manager
 # User loader callback for Flask-Login
 @login_manager.user_loader
 def load_user(user):
-    # Load the user from the database by ID
-    return User.query.get(int(user))
+    # Load the user by ID, served from the session's identity map when possible
+    return db.session.get(User, int(user))
 
 
 # User model representing the 'users' table
 class User(UserMixin, db.Model):
     __tablename__ = "users"
-    id = Column(
-        Integer, primary_key=True, index=True
-    )  # Unique identifier for each user
+    id = Column(Integer, primary_key=True)  # Unique identifier for each user
     email = Column(
         String, unique=True, index=True
     )  # User's email address (must be unique)
@@ -32,6 +39,12 @@ class User(UserMixin, db.Model):
     lists = relationship(
         "TodoList", back_populates="owner"
     )  # One-to-many relationship to TodoList
+    revision = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )  # Change sequence of the user's data, bumped once per write (see sync.py)
+    sync_floor = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )  # Oldest revision /sync can still send deletes from
 
     def get_id(self):
         # Return the user's ID as a string (required by Flask-Login)
@@ -41,12 +54,12 @@ class User(UserMixin, db.Model):
 # TodoList model representing the 'todo_lists' table
 class TodoList(db.Model):
     __tablename__ = "todo_lists"
-    id = Column(
-        Integer, primary_key=True, index=True
-    )  # Unique identifier for each todo list
-    title = Column(String, index=True, nullable=False)  # Title of the todo list
+    # IDs are never reused, so a cached owner stays right (migration 10)
+    __table_args__ = {"sqlite_autoincrement": True}
+    id = Column(Integer, primary_key=True)  # Unique identifier for each todo list
+    title = Column(String, nullable=False)  # Title of the todo list
     owner_id = Column(
-        Integer, ForeignKey("users.id")
+        Integer, ForeignKey("users.id"), index=True
     )  # Foreign key linking to the User table
     owner = relationship(
         "User", back_populates="lists"
@@ -54,15 +67,33 @@ class TodoList(db.Model):
     items = relationship(
         "TodoItem", back_populates="list"
     )  # One-to-many relationship to TodoItem
+    total_descendants = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )  # Number of items in the list (see rollup.py)
+    completed_descendants = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )  # Number of completed items in the list
+    revision = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )  # Owner's revision when the list last changed
+    updated_at = Column(DateTime)  # Time of the last change
 
 
 # TodoItem model representing the 'todo_items' table
 class TodoItem(db.Model):
     __tablename__ = "todo_items"
-    id = Column(
-        Integer, primary_key=True, index=True
-    )  # Unique identifier for each todo item
-    content = Column(String, index=True)  # Description or content of the todo item
+    __table_args__ = (
+        # Serves a list's items and top-level items, each group in rank order
+        Index("ix_todo_items_list_id_parent_id_rank", "list_id", "parent_id", "rank"),
+        # Serves the children of an item in rank order
+        Index("ix_todo_items_parent_id_rank", "parent_id", "rank"),
+        # Serves /sync, which reads a list's items changed after a revision
+        Index("ix_todo_items_list_id_revision", "list_id", "revision"),
+        # IDs are never reused, so archived items keep theirs (migration 9)
+        {"sqlite_autoincrement": True},
+    )
+    id = Column(Integer, primary_key=True)  # Unique identifier for each todo item
+    content = Column(String)  # Description or content of the todo item
     completed = Column(
         Boolean, default=False
     )  # Status indicating if the item is completed
@@ -76,3 +107,62 @@ class TodoItem(db.Model):
         Integer, ForeignKey("todo_items.id")
     )  # Self-referential foreign key for subtasks
     children = relationship("TodoItem")  # One-to-many relationship to subtasks
+    path = Column(
+        String, index=True, default=""
+    )  # Materialized path of ancestor IDs, e.g. "7/12/" (see hierarchy.py)
+    rank = Column(
+        String, nullable=False, default="", server_default=""
+    )  # Sort key among the item's siblings (see ranks.py)
+    total_descendants = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )  # Number of subtasks at any depth (see rollup.py)
+    completed_descendants = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )  # Number of completed subtasks at any depth
+    revision = Column(
+        Integer, nullable=False, default=0, server_default="0"
+    )  # Owner's revision when the item last changed
+    updated_at = Column(DateTime)  # Time of the last change
+
+    @property
+    def depth(self):
+        # Nesting level of the item, 1 for top-level items
+        return (self.path or "").count("/") + 1
+
+
+# ArchivedItem model representing the 'archived_items' table: completed
+# subtrees moved out of todo_items so tree loads only read live items (see
+# archive.py). Paths and list IDs are kept up to date when live ancestors move.
+class ArchivedItem(db.Model):
+    __tablename__ = "archived_items"
+    __table_args__ = (
+        # Serves the archived subtrees under a path, and their list
+        Index("ix_archived_items_path", "path"),
+        Index("ix_archived_items_list_id", "list_id"),
+    )
+    id = Column(Integer, primary_key=True)  # ID the item had while it was live
+    content = Column(String)  # Description or content of the todo item
+    completed = Column(Boolean, default=True)  # Archived items are all completed
+    list_id = Column(
+        Integer, ForeignKey("todo_lists.id"), nullable=False
+    )  # Foreign key linking to the TodoList table
+    parent_id = Column(Integer)  # Parent item, live or archived
+    path = Column(String, default="")  # Materialized path of ancestor IDs
+    rank = Column(
+        String, nullable=False, default="", server_default=""
+    )  # Sort key among the item's siblings
+    updated_at = Column(DateTime)  # Time of the last change before archiving
+    archived_at = Column(DateTime, nullable=False)  # Time the item was archived
+
+
+# Tombstone model representing the 'tombstones' table: one row per deleted
+# list or item, so /sync can tell clients what to remove from their copy
+class Tombstone(db.Model):
+    __tablename__ = "tombstones"
+    __table_args__ = (Index("ix_tombstones_user_id_revision", "user_id", "revision"),)
+    id = Column(Integer, primary_key=True)  # Unique identifier for each tombstone
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)  # Owner
+    kind = Column(String, nullable=False)  # "list" or "item"
+    row_id = Column(Integer, nullable=False)  # ID of the deleted list or item
+    revision = Column(Integer, nullable=False)  # Owner's revision of the delete
+    deleted_at = Column(DateTime, nullable=False)  # Time of the delete
@@ -0,0 +1,103 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug.security import (
+    DEFAULT_PBKDF2_ITERATIONS,
+    check_password_hash,
+    generate_password_hash,
+)
+
+# Password hashing for /signup and /login. Hashes are deliberately slow, so
+# they run on a small pool of PASSWORD_HASH_WORKERS threads instead of in the
+# request thread: a login storm then uses at most that many cores while the
+# other routes keep being served. When the pool and its queue are full, new
+# requests fail fast with HasherBusy rather than piling up behind it.
+#
+# PASSWORD_HASH_METHOD takes Werkzeug's method strings, e.g.
+# "pbkdf2:sha256:600000" or "scrypt:32768:8:1". Stored hashes name the method
+# that made them, so after the setting changes each user's hash is upgraded
+# the next time they log in.
+
+DEFAULT_METHOD = f"pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}"
+
+
+class HasherBusy(Exception):
+    """Raised when no hashing thread is free to take a password in time."""
+
+
+def canonical_method(method):
+    """Spell out a Werkzeug hash method with its defaults, as stored in hashes."""
+    name, *args = method.split(":")
+    if name == "pbkdf2":
+        hash_name = args[0] if args else "sha256"
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f"pbkdf2:{hash_name}:{iterations}"
+    if name == "scrypt":
+        n, r, p = (int(arg) for arg in args) if args else (2**15, 8, 1)
+        return f"scrypt:{n}:{r}:{p}"
+    raise ValueError(f"Unsupported password hash method {method!r}")
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a bounded pool of threads."""
+
+    def __init__(self, app=None):
+        self.method = DEFAULT_METHOD
+        self._executor = None
+        self._slots = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault(
+            "PASSWORD_HASH_METHOD",
+            os.environ.get("PASSWORD_HASH_METHOD", DEFAULT_METHOD),
+        )
+        app.config.setdefault(
+            "PASSWORD_HASH_WORKERS", int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+        )
+        # Passwords waiting for a thread, beyond the ones being hashed
+        app.config.setdefault("PASSWORD_HASH_QUEUE", 32)
+        app.config.setdefault("PASSWORD_HASH_TIMEOUT", 10)  # Seconds
+        self.method = canonical_method(app.config["PASSWORD_HASH_METHOD"])
+        self.timeout = app.config["PASSWORD_HASH_TIMEOUT"]
+        workers = app.config["PASSWORD_HASH_WORKERS"]
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="password")
+        self._slots = threading.BoundedSemaphore(
+            workers + app.config["PASSWORD_HASH_QUEUE"]
+        )
+
+    def run(self, fn, *args):
+        # Run fn on the pool and wait for it, or raise HasherBusy
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy("Too many passwords waiting to be hashed")
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot stays taken until the hash is done, even after a timeout
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            raise HasherBusy("Password hashing timed out") from None
+
+    def hash(self, password):
+        return self.run(generate_password_hash, password, self.method)
+
+    def verify(self, stored, password):
+        """Check a password against a stored hash (False if there is none)."""
+        if not stored:
+            return False
+        return self.run(check_password_hash, stored, password)
+
+    def needs_rehash(self, stored):
+        # Hashes start with the method that made them: "method$salt$hash"
+        return stored.split("$", 1)[0] != self.method
+
+
+# Shared hasher instance, bound to the app in create_app
+passwords = PasswordHasher()
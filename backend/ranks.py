@@ -0,0 +1,241 @@
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import func, select, tuple_
+from .models import db, TodoList, TodoItem
+from .sync import begin_revision
+
+# Sibling order. Every item has a rank, a string key that sorts it among the
+# items sharing its list and parent; loaders order by (rank, id) through the
+# (list_id, parent_id, rank) and (parent_id, rank) indexes.
+#
+# Ranks are base-36 fractions written without the leading "0.": "i" is 0.5,
+# "i8" sits between "i" and "j", and so on. There is always a key between two
+# different ranks, so placing an item between two siblings only rewrites that
+# item's rank. Ranks never end in "0" (which would leave no key right below
+# them), and digits and lowercase letters sort the same in any collation.
+# Rows without a rank have the empty string and sort first, by ID.
+#
+# Inserting again and again at the same spot makes the keys longer. When a
+# new rank would exceed MAX_RANK_LENGTH, or two siblings share a rank, the
+# sibling group is rebalanced to short, evenly spaced ranks in the same
+# transaction; "flask --app backend rebalance-ranks" does the same offline.
+
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+
+# Appending adds one unit at this digit, so roughly BASE**STEP_DIGITS / 2
+# items can be appended to a group before its ranks get any longer
+STEP_DIGITS = 4
+
+# Longest rank written before the sibling group is rebalanced
+MAX_RANK_LENGTH = 24
+
+# Groups with ranks longer than this are rebalanced by rebalance-ranks
+REBALANCE_LENGTH = 12
+
+
+class RankError(ValueError):
+    """Raised when there is no rank between two keys (they are out of order)."""
+
+
+def digit(key, n):
+    # Value of the nth digit of a key, which is followed by implicit zeros
+    return DIGITS.index(key[n]) if n < len(key) else 0
+
+
+def to_key(value, width):
+    # The ``width``-digit base-36 fraction of an integer, without trailing zeros
+    digits = []
+    for _ in range(width):
+        value, remainder = divmod(value, BASE)
+        digits.append(DIGITS[remainder])
+    return "".join(reversed(digits)).rstrip("0")
+
+
+def to_int(key, width):
+    value = 0
+    for n in range(width):
+        value = value * BASE + digit(key, n)
+    return value
+
+
+def midpoint(low, high):
+    """Return a key strictly between ``low`` ("" for the start) and ``high``.
+
+    ``high`` is None for the end. The key is about as long as the longer of
+    the two, plus one digit when they are adjacent.
+    """
+    prefix = ""
+    if high is not None:
+        # Skip the digits both keys share
+        n = 0
+        while digit(low, n) == digit(high, n):
+            n += 1
+        prefix, low, high = high[:n], low[n:], high[n:]
+    low_digit = digit(low, 0)
+    high_digit = BASE if high is None else digit(high, 0)
+    if high_digit - low_digit > 1:
+        return prefix + DIGITS[(low_digit + high_digit) // 2]
+    if high is not None and len(high) > 1:
+        # high's first digit alone is below high and above low
+        return prefix + high[0]
+    # Adjacent digits: keep low's digit and go halfway up from the rest of it
+    return prefix + DIGITS[low_digit] + midpoint(low[1:], None)
+
+
+def rank_between(low=None, high=None):
+    """Return a rank that sorts after ``low`` and before ``high``.
+
+    Either may be None (or "" for ``low``) for the start or end of the group.
+    Raises RankError if ``low`` does not sort before ``high``.
+    """
+    low = low or ""
+    if high is not None and low >= high:
+        raise RankError(f"No rank between {low!r} and {high!r}")
+    if high is None:
+        # Append: one unit up at STEP_DIGITS, which keeps the keys short
+        if not low:
+            return DIGITS[BASE // 2]
+        step = to_int(low, STEP_DIGITS) + 1
+        if step < BASE**STEP_DIGITS:
+            return to_key(step, STEP_DIGITS)
+        return midpoint(low, None)
+    if not low:
+        # Prepend: one unit down at STEP_DIGITS, or the truncated key
+        if len(high) > STEP_DIGITS:
+            key = high[:STEP_DIGITS].rstrip("0")
+        else:
+            key = to_key(to_int(high, STEP_DIGITS) - 1, STEP_DIGITS)
+        return key or midpoint("", high)
+    return midpoint(low, high)
+
+
+def spread_ranks(count):
+    """Return ``count`` short ranks, evenly spaced and in increasing order."""
+    width = 1
+    while BASE**width < (count + 1) * BASE:
+        width += 1
+    gap = BASE**width // (count + 1)
+    return [to_key(gap * (n + 1), width) for n in range(count)]
+
+
+def is_valid_rank(key):
+    return (
+        isinstance(key, str)
+        and 0 < len(key) <= MAX_RANK_LENGTH
+        and not key.endswith("0")
+        and all(char in DIGITS for char in key)
+    )
+
+
+def siblings(list_id, parent_id):
+    # Items sharing a list and parent (parent_id None is the top level)
+    return (TodoItem.list_id == list_id) & (TodoItem.parent_id == parent_id)
+
+
+def last_rank(list_id, parent_id):
+    # Highest rank among the siblings, read from the index
+    return db.session.scalar(
+        select(func.max(TodoItem.rank)).where(siblings(list_id, parent_id))
+    )
+
+
+def append_rank(list_id, parent_id):
+    """Rank placing a new item after every existing sibling."""
+    return rank_between(last_rank(list_id, parent_id), None)
+
+
+def neighbour(item, anchor, following):
+    # (id, rank) of the sibling right after (or before) the anchor, skipping item
+    position = tuple_(TodoItem.rank, TodoItem.id)
+    anchor_position = tuple_(anchor.rank, anchor.id)
+    query = select(TodoItem.id, TodoItem.rank).where(
+        siblings(item.list_id, item.parent_id), TodoItem.id != item.id
+    )
+    if following:
+        query = query.where(position > anchor_position).order_by(
+            TodoItem.rank, TodoItem.id
+        )
+    else:
+        query = query.where(position < anchor_position).order_by(
+            TodoItem.rank.desc(), TodoItem.id.desc()
+        )
+    return db.session.execute(query.limit(1)).first()
+
+
+def rank_next_to(item, after=None, before=None):
+    """Return a rank placing an item between two of its siblings.
+
+    ``after`` is the sibling the item should follow and ``before`` the one it
+    should precede; with only one of them, the item goes right next to it.
+    Both must already share the item's list and parent. Rebalances the group
+    first when there is no short rank between the two.
+    """
+    for _ in range(2):
+        low = high = None
+        if after is not None:
+            low = (after.id, after.rank)
+            if before is None:
+                high = neighbour(item, after, following=True)
+        if before is not None:
+            high = (before.id, before.rank)
+            if after is None:
+                low = neighbour(item, before, following=False)
+        try:
+            rank = rank_between(low and low[1], high and high[1])
+        except RankError:
+            rank = None
+        if rank is not None and len(rank) <= MAX_RANK_LENGTH:
+            return rank
+        rebalance_siblings(item.list_id, item.parent_id)
+    raise RankError("The sibling items are out of order")
+
+
+def rebalance_siblings(list_id, parent_id):
+    """Rewrite the ranks of a sibling group as short, evenly spaced keys.
+
+    Keeps the current order, with ties broken by ID. The rows are loaded
+    through the session, so loaded items see their new rank and are stamped
+    for /sync like any other change. Returns the number of items.
+    """
+    items = (
+        TodoItem.query.filter(siblings(list_id, parent_id))
+        .order_by(TodoItem.rank, TodoItem.id)
+        .all()
+    )
+    for item, rank in zip(items, spread_ranks(len(items))):
+        item.rank = rank
+    db.session.flush()
+    return len(items)
+
+
+def groups_to_rebalance():
+    """Find sibling groups with long, missing or shared ranks, with their owner."""
+    odd_ranks = select(TodoItem.list_id, TodoItem.parent_id, TodoList.owner_id).where(
+        (func.length(TodoItem.rank) > REBALANCE_LENGTH) | (TodoItem.rank == "")
+    )
+    shared_ranks = (
+        select(TodoItem.list_id, TodoItem.parent_id, TodoList.owner_id)
+        .group_by(
+            TodoItem.list_id, TodoItem.parent_id, TodoItem.rank, TodoList.owner_id
+        )
+        .having(func.count() > 1)
+    )
+    rows = set()
+    for query in (odd_ranks, shared_ranks):
+        query = query.join(TodoList, TodoItem.list_id == TodoList.id)
+        rows.update(db.session.execute(query).all())
+    return sorted(rows, key=lambda row: (row[0], row[1] or 0))
+
+
+# CLI command to rebalance sibling ranks: flask --app backend rebalance-ranks
+@click.command("rebalance-ranks")
+@with_appcontext
+def rebalance_ranks_command():
+    groups = groups_to_rebalance()
+    for list_id, parent_id, owner_id in groups:
+        # Each group is its own revision, so syncing clients fetch the new ranks
+        begin_revision(owner_id)
+        rebalance_siblings(list_id, parent_id)
+        db.session.commit()
+    click.echo(f"Rebalanced {len(groups)} sibling group(s)")
@@ -0,0 +1,89 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from .database import env_flag
+
+# In-memory token buckets for /login and /signup, checked before the user is
+# looked up or any password is hashed, so a brute-force flood costs a dict
+# lookup per request instead of a hash. Each kind of key (the client address,
+# the account being logged into) has a bucket per value holding up to "burst"
+# attempts, refilled at "rate" attempts per second. An attempt must find a
+# token in every bucket it names and then takes one from each.
+#
+# Buckets live in this process only; with several workers each one keeps its
+# own, which multiplies the allowance by the number of workers. Behind a
+# reverse proxy, apply werkzeug's ProxyFix so that remote_addr is the client's.
+
+# kind -> (burst, tokens per second)
+DEFAULT_LIMITS = {
+    "ip": (20, 1.0),  # 20 attempts at once, then one per second
+    "account": (5, 1 / 12),  # 5 attempts at once, then five a minute
+}
+
+
+class RateLimiter:
+    """Token buckets keyed by (kind, value), bounded to the most recent keys."""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.limits = dict(DEFAULT_LIMITS)
+        self.max_keys = 100_000
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # (kind, value) -> [tokens, updated]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault(
+            "RATE_LIMIT_ENABLED", env_flag("RATE_LIMIT_ENABLED", default="true")
+        )
+        app.config.setdefault("RATE_LIMITS", DEFAULT_LIMITS)
+        # Least recently used buckets beyond this are dropped; a dropped bucket
+        # starts full again, like one that has had time to refill
+        app.config.setdefault("RATE_LIMIT_MAX_KEYS", 100_000)
+        self.enabled = bool(app.config["RATE_LIMIT_ENABLED"])
+        self.limits = {**DEFAULT_LIMITS, **app.config["RATE_LIMITS"]}
+        self.max_keys = app.config["RATE_LIMIT_MAX_KEYS"]
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def hit(self, **keys):
+        """Take a token from the bucket of each key, e.g. hit(ip=..., account=...).
+
+        Returns 0 if the attempt is allowed, or else the number of seconds
+        until it would be; a rejected attempt takes no tokens.
+        """
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            buckets, wait = [], 0.0
+            for kind, value in keys.items():
+                if value is None:
+                    continue
+                burst, rate = self.limits[kind]
+                bucket = self._buckets.get((kind, value))
+                if bucket is None:
+                    bucket = self._buckets[(kind, value)] = [burst, now]
+                else:
+                    self._buckets.move_to_end((kind, value))
+                    bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                    bucket[1] = now
+                if bucket[0] < 1:
+                    wait = max(wait, (1 - bucket[0]) / rate)
+                buckets.append(bucket)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            if wait:
+                return math.ceil(wait)
+            for bucket in buckets:
+                bucket[0] -= 1
+            return 0
+
+
+# Shared limiter instance, bound to the app in create_app
+limiter = RateLimiter()
@@ -0,0 +1,175 @@
+from collections import defaultdict
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, text, update
+from .models import db, TodoList, TodoItem
+
+# Denormalized progress counters. Every item keeps the number of its
+# descendants (total_descendants) and how many of them are completed
+# (completed_descendants); every list keeps the same two numbers for all of
+# its items. Changes are applied to the ancestor chain only, which the
+# materialized path already lists, so no tree walk is ever needed.
+
+
+def path_ids(path):
+    # Ancestor IDs encoded in a materialized path such as "7/12/"
+    return [int(part) for part in (path or "").split("/") if part]
+
+
+class RollupDeltas:
+    """Collect counter changes and apply them with as few UPDATEs as possible.
+
+    Ancestors that receive the same change are updated together with one
+    ``UPDATE ... WHERE id IN (...)``, so a toggle costs one statement for the
+    items and one for the list whatever the depth.
+    """
+
+    def __init__(self):
+        self.items = defaultdict(lambda: [0, 0])  # item_id -> [total, completed]
+        self.lists = defaultdict(lambda: [0, 0])  # list_id -> [total, completed]
+
+    def add(self, path, list_id, total=0, completed=0):
+        # Record that a subtree with `total` items, `completed` of them done,
+        # appeared (or, with negative numbers, disappeared) under this path
+        if not total and not completed:
+            return
+        for item_id in path_ids(path):
+            self.items[item_id][0] += total
+            self.items[item_id][1] += completed
+        if list_id is not None:
+            self.lists[list_id][0] += total
+            self.lists[list_id][1] += completed
+
+    def apply(self):
+        for model, deltas in ((TodoItem, self.items), (TodoList, self.lists)):
+            groups = defaultdict(list)
+            for row_id, (total, completed) in deltas.items():
+                if total or completed:
+                    groups[(total, completed)].append(row_id)
+            for (total, completed), ids in groups.items():
+                db.session.execute(
+                    update(model)
+                    .where(model.id.in_(ids))
+                    .values(
+                        total_descendants=model.total_descendants + total,
+                        completed_descendants=model.completed_descendants + completed,
+                    )
+                )
+            deltas.clear()
+
+
+def subtree_totals(item_id):
+    """Return (items, completed items) of a subtree, including its root.
+
+    Read from the database rather than from a loaded object, so counters
+    changed by bulk statements earlier in the transaction are taken into account.
+    """
+    row = db.session.execute(
+        select(
+            TodoItem.completed,
+            TodoItem.total_descendants,
+            TodoItem.completed_descendants,
+        ).where(TodoItem.id == item_id)
+    ).one()
+    return 1 + (row.total_descendants or 0), int(bool(row.completed)) + (
+        row.completed_descendants or 0
+    )
+
+
+def item_added(item, deltas=None):
+    # A new, childless item counts once for each of its ancestors and its list
+    apply_now = deltas is None
+    deltas = RollupDeltas() if apply_now else deltas
+    deltas.add(item.path, item.list_id, 1, int(bool(item.completed)))
+    if apply_now:
+        deltas.apply()
+
+
+def completion_changed(item, completed, deltas=None):
+    # Call before changing item.completed; does nothing if the state is unchanged
+    if bool(item.completed) == bool(completed):
+        return
+    apply_now = deltas is None
+    deltas = RollupDeltas() if apply_now else deltas
+    deltas.add(item.path, item.list_id, 0, 1 if completed else -1)
+    if apply_now:
+        deltas.apply()
+
+
+def rebuild_rollups(conn, list_ids=None):
+    """Recompute the counters from scratch and return how many rows were wrong.
+
+    Restricted to the given lists when ``list_ids`` is passed. Runs on a plain
+    connection so it can be used from migrations as well as from the app.
+    """
+    where = ""
+    params = {}
+    if list_ids is not None:
+        if not list_ids:
+            return 0
+        where = " WHERE list_id IN ({})".format(
+            ", ".join(f":l{n}" for n in range(len(list_ids)))
+        )
+        params = {f"l{n}": list_id for n, list_id in enumerate(list_ids)}
+    rows = conn.execute(
+        text(
+            "SELECT id, list_id, path, completed, total_descendants,"
+            " completed_descendants FROM todo_items" + where
+        ),
+        params,
+    ).all()
+
+    items = defaultdict(lambda: [0, 0])
+    lists = defaultdict(lambda: [0, 0])
+    for row in rows:
+        done = int(bool(row.completed))
+        for ancestor in path_ids(row.path):
+            items[ancestor][0] += 1
+            items[ancestor][1] += done
+        lists[row.list_id][0] += 1
+        lists[row.list_id][1] += done
+
+    item_fixes = [
+        {"id": row.id, "t": items[row.id][0], "c": items[row.id][1]}
+        for row in rows
+        if (row.total_descendants, row.completed_descendants)
+        != (items[row.id][0], items[row.id][1])
+    ]
+    if list_ids is None:
+        current = conn.execute(
+            text("SELECT id, total_descendants, completed_descendants FROM todo_lists")
+        ).all()
+    else:
+        current = conn.execute(
+            text(
+                "SELECT id, total_descendants, completed_descendants FROM todo_lists"
+                + where.replace("list_id", "id")
+            ),
+            params,
+        ).all()
+    list_fixes = [
+        {"id": row.id, "t": lists[row.id][0], "c": lists[row.id][1]}
+        for row in current
+        if (row.total_descendants, row.completed_descendants)
+        != (lists[row.id][0], lists[row.id][1])
+    ]
+
+    for table, fixes in (("todo_items", item_fixes), ("todo_lists", list_fixes)):
+        if fixes:
+            conn.execute(
+                text(
+                    f"UPDATE {table} SET total_descendants = :t,"
+                    " completed_descendants = :c WHERE id = :id"
+                ),
+                fixes,
+            )
+    return len(item_fixes) + len(list_fixes)
+
+
+# CLI command to repair the progress counters: flask --app backend rebuild-rollups
+@click.command("rebuild-rollups")
+@with_appcontext
+def rebuild_rollups_command():
+    fixed = rebuild_rollups(db.session.connection())
+    db.session.commit()
+    click.echo(f"Rebuilt progress counters, {fixed} row(s) repaired")
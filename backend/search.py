@@ -0,0 +1,142 @@
+import re
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import select, text
+from .models import db, TodoList, TodoItem
+from .rollup import path_ids
+
+# Full-text search over item content. On SQLite the todo_items_fts table
+# (an FTS5 index over item content and list owner, see migration 5) is kept in
+# sync by triggers, so every write path, including the bulk UPDATE/DELETE statements,
+# updates it without any code in the routes. Other databases fall back to a
+# LIKE scan with the same response shape.
+
+FTS_TABLE = "todo_items_fts"
+
+# Words of a query; a trailing "*" asks for a prefix match
+TERM = re.compile(r"(\w+)(\*?)", re.UNICODE)
+
+
+class SearchError(ValueError):
+    """Raised when a query has nothing to search for."""
+
+
+def match_query(q, owner_id):
+    """Turn user input into an FTS5 MATCH expression over one user's items.
+
+    Every word is quoted so FTS5 operators in the input are taken literally
+    and all words must match. Words ending in "*" match as prefixes, and so
+    does the last word, so results can be shown while the user is typing.
+    """
+    terms = TERM.findall(q or "")
+    if not terms:
+        raise SearchError("Query must contain at least one word")
+    parts = []
+    for n, (word, star) in enumerate(terms):
+        prefix = star or n == len(terms) - 1
+        parts.append(f'"{word}"' + ("*" if prefix else ""))
+    return f'owner : "{int(owner_id)}" AND content : ({" ".join(parts)})'
+
+
+def fts_enabled():
+    return db.session.get_bind().dialect.name == "sqlite"
+
+
+def search_hits(owner_id, q, limit, offset):
+    # One page of (item, list title, score) rows, best matches first
+    if fts_enabled():
+        # The owner is part of the MATCH expression, so the page is ranked and
+        # cut inside the index and only its rows are joined to the tables
+        return db.session.execute(
+            text(
+                "SELECT i.id, i.content, i.completed, i.list_id, i.parent_id, i.path,"
+                " l.title AS list_title, hits.score"
+                # Rank on content only; the owner column is a filter
+                f" FROM (SELECT rowid, bm25({FTS_TABLE}, 1.0, 0.0) AS score"
+                f" FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match"
+                " ORDER BY score, rowid LIMIT :limit OFFSET :offset) AS hits"
+                " JOIN todo_items i ON i.id = hits.rowid"
+                " JOIN todo_lists l ON l.id = i.list_id"
+                " ORDER BY hits.score, i.id"
+            ),
+            {
+                "match": match_query(q, owner_id),
+                "limit": limit,
+                "offset": offset,
+            },
+        ).all()
+
+    words = [word for word, _ in TERM.findall(q or "")]
+    if not words:
+        raise SearchError("Query must contain at least one word")
+    query = (
+        select(
+            TodoItem.id,
+            TodoItem.content,
+            TodoItem.completed,
+            TodoItem.list_id,
+            TodoItem.parent_id,
+            TodoItem.path,
+            TodoList.title.label("list_title"),
+        )
+        .join(TodoList, TodoItem.list_id == TodoList.id)
+        .where(TodoList.owner_id == owner_id)
+    )
+    for word in words:
+        query = query.where(TodoItem.content.ilike(f"%{word}%"))
+    return db.session.execute(
+        query.order_by(TodoItem.id).limit(limit).offset(offset)
+    ).all()
+
+
+def search_items(owner_id, q, limit, offset=0):
+    """Search a user's items and return one page of serialized hits.
+
+    Each hit carries its list title and the content of its ancestors, read
+    for the whole page with a single query. Returns (hits, next_offset).
+    """
+    rows = search_hits(owner_id, q, limit + 1, offset)
+    more = len(rows) > limit
+    rows = rows[:limit]
+
+    ancestor_ids = {ancestor for row in rows for ancestor in path_ids(row.path)}
+    contents = {}
+    if ancestor_ids:
+        contents = dict(
+            db.session.execute(
+                select(TodoItem.id, TodoItem.content).where(
+                    TodoItem.id.in_(ancestor_ids)
+                )
+            ).all()
+        )
+
+    hits = [
+        {
+            "id": row.id,
+            "content": row.content,
+            "completed": bool(row.completed),
+            "list_id": row.list_id,
+            "list_title": row.list_title,
+            "parent_id": row.parent_id,
+            # Ancestors from the top-level item down to the direct parent
+            "ancestors": [
+                {"id": ancestor, "content": contents.get(ancestor)}
+                for ancestor in path_ids(row.path)
+            ],
+            # bm25() is lower for better matches; report higher-is-better
+            "score": -row.score if "score" in row._fields else None,
+        }
+        for row in rows
+    ]
+    return hits, offset + limit if more else None
+
+
+# CLI command to rebuild the search index: flask --app backend rebuild-search
+@click.command("rebuild-search")
+@with_appcontext
+def rebuild_search_command():
+    if not fts_enabled():
+        raise click.ClickException("Full-text search needs an SQLite database")
+    db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')"))
+    db.session.commit()
+    click.echo("Rebuilt the search index")
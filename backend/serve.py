@@ -0,0 +1,116 @@
+import argparse
+import os
+import sys
+
+# Production server, in place of the debug server of "python -m backend":
+#
+#   python -m backend.serve           gunicorn, a pool of threads per worker
+#   python -m backend.serve --asgi    uvicorn with backend.asgi (see aio.py)
+#
+# Settings come from the environment, with these defaults, and can be
+# overridden on the command line.
+DEFAULTS = {
+    "WEB_BIND": "127.0.0.1:5000",
+    # Worker processes. The /list snapshot cache and the in-process change
+    # feed are per process, so more than one worker needs shared backends
+    # (SNAPSHOT_CACHE_BACKEND, CHANGE_FEED_BACKEND) to stay consistent. The
+    # list owner cache (access.py) and the rate limits are per process too:
+    # a deleted list can be readable for LIST_OWNER_TTL seconds in the others
+    "WEB_WORKERS": "1",
+    # Threads per worker serving the Flask routes. Under WSGI each open
+    # /events stream holds one of them; under ASGI streams hold none
+    "WEB_THREADS": "8",
+    # Seconds before a silent worker is restarted, and for a graceful stop
+    "WEB_TIMEOUT": "30",
+}
+
+
+def load_server_config(environ=None):
+    """Read the server settings from environment variables."""
+    environ = os.environ if environ is None else environ
+
+    def setting(name):
+        return environ.get(name, DEFAULTS[name])
+
+    return {
+        "bind": setting("WEB_BIND"),
+        "workers": int(setting("WEB_WORKERS")),
+        "threads": int(setting("WEB_THREADS")),
+        "timeout": int(setting("WEB_TIMEOUT")),
+    }
+
+
+def run_wsgi(config):
+    # gunicorn's threaded workers: each worker runs up to "threads" requests
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", [config["bind"]])
+            self.cfg.set("workers", config["workers"])
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", config["threads"])
+            self.cfg.set("timeout", config["timeout"])
+            self.cfg.set("graceful_timeout", config["timeout"])
+
+        def load(self):
+            from .wsgi import app
+
+            return app
+
+    Server().run()
+
+
+def run_asgi(config):
+    import uvicorn
+
+    host, _, port = config["bind"].rpartition(":")
+    # Worker processes import backend.asgi themselves and read the thread
+    # count from the environment
+    os.environ["WEB_THREADS"] = str(config["threads"])
+    uvicorn.run(
+        "backend.asgi:app",
+        host=host or "127.0.0.1",
+        port=int(port),
+        workers=config["workers"],
+        lifespan="on",
+        timeout_graceful_shutdown=config["timeout"],
+    )
+
+
+def migrate():
+    # Bring the schema up to date once, before workers start and race to do it
+    from . import create_app, db
+
+    app = create_app()
+    with app.app_context():
+        db.engine.dispose()  # Workers open their own connections
+
+
+def main(argv=None):
+    config = load_server_config()
+    parser = argparse.ArgumentParser(description="Serve the backend in production.")
+    parser.add_argument("--asgi", action="store_true", help="serve with uvicorn")
+    parser.add_argument("--bind", default=config["bind"], help="host:port")
+    parser.add_argument("--workers", type=int, default=config["workers"])
+    parser.add_argument("--threads", type=int, default=config["threads"])
+    parser.add_argument("--timeout", type=int, default=config["timeout"])
+    args = parser.parse_args(argv)
+    config.update(
+        bind=args.bind,
+        workers=args.workers,
+        threads=args.threads,
+        timeout=args.timeout,
+    )
+    if config["workers"] > 1:
+        print(
+            "Serving with several workers: configure shared SNAPSHOT_CACHE_BACKEND"
+            " and CHANGE_FEED_BACKEND backends",
+            file=sys.stderr,
+        )
+    migrate()
+    (run_asgi if args.asgi else run_wsgi)(config)
+
+
+if __name__ == "__main__":
+    main()
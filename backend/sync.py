@@ -0,0 +1,251 @@
+from datetime import datetime, timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import delete, event, func, insert, inspect, select, update
+from .models import db, User, TodoList, TodoItem, Tombstone
+
+# Delta sync. Every user has a revision counter that each write transaction
+# bumps once, up front, with begin_revision(). Lists and items changed by the
+# transaction are stamped with that revision (ORM changes automatically, bulk
+# statements through stamp()), and deleted rows leave a tombstone carrying it.
+# A client that remembers the revision of its copy can then ask /sync for the
+# rows changed and deleted since, instead of downloading everything again.
+#
+# Progress counters (total/completed_descendants) are not synced: they change
+# on every ancestor of an edited item and are cheap to recompute locally.
+
+# Columns whose change makes a row part of the next sync
+SYNCED_COLUMNS = {
+    TodoList: ("title",),
+    TodoItem: ("content", "completed", "parent_id", "list_id", "rank"),
+}
+
+
+class RevisionError(RuntimeError):
+    """Raised when lists or items change outside of a revision."""
+
+
+def begin_revision(user_id):
+    """Allocate the user's next revision for the current transaction.
+
+    Call before changing the user's lists or items. Calling it again in the
+    same transaction returns the same revision. The UPDATE also takes the
+    write lock first, so revisions are committed in order.
+    """
+    entry = db.session.info.get("revision")
+    if entry is not None:
+        if entry[0] != user_id:
+            raise RevisionError("A transaction can only change one user's data")
+        return entry[1]
+    revision = db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(revision=User.revision + 1)
+        .returning(User.revision)
+    ).scalar_one()
+    db.session.info["revision"] = (user_id, revision, datetime.utcnow())
+    return revision
+
+
+def revision_entry(session):
+    entry = session.info.get("revision")
+    if entry is None:
+        raise RevisionError(
+            "Call begin_revision() before changing a user's lists or items"
+        )
+    return entry
+
+
+def stamp():
+    # Column values marking rows written by a bulk statement as changed
+    _, revision, now = revision_entry(db.session)
+    return {"revision": revision, "updated_at": now}
+
+
+def stamp_other_owner(owner_id, condition):
+    """Stamp items of another user that this transaction changed on the side.
+
+    begin_revision() allows one user per transaction, so the other user's
+    revision is bumped here directly and the matching items are stamped with
+    it, for their /sync clients to pick up. Flush first. Returns the revision.
+    """
+    revision = db.session.execute(
+        update(User)
+        .where(User.id == owner_id)
+        .values(revision=User.revision + 1)
+        .returning(User.revision)
+    ).scalar_one()
+    db.session.execute(
+        update(TodoItem)
+        .where(condition)
+        .values(revision=revision, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return revision
+
+
+def add_tombstones(kind, row_ids):
+    # Record deleted lists or items under the current revision
+    if not row_ids:
+        return
+    user_id, revision, now = revision_entry(db.session)
+    db.session.execute(
+        insert(Tombstone),
+        [
+            {
+                "user_id": user_id,
+                "kind": kind,
+                "row_id": row_id,
+                "revision": revision,
+                "deleted_at": now,
+            }
+            for row_id in row_ids
+        ],
+    )
+
+
+def last_revision():
+    # Revision of the transaction this session committed last, if any
+    return db.session.info.get("committed_revision")
+
+
+@event.listens_for(db.session, "before_flush")
+def stamp_changed_rows(session, flush_context, instances):
+    # Stamp new lists and items, and loaded ones whose synced columns changed
+    for obj in list(session.new) + list(session.dirty):
+        names = SYNCED_COLUMNS.get(type(obj))
+        if names is None:
+            continue
+        if obj not in session.new:
+            attrs = inspect(obj).attrs
+            if not any(attrs[name].history.has_changes() for name in names):
+                continue
+        _, obj.revision, obj.updated_at = revision_entry(session)
+
+
+@event.listens_for(db.session, "after_commit")
+def remember_revision(session):
+    entry = session.info.get("revision")
+    session.info["committed_revision"] = None if entry is None else entry[1]
+
+
+@event.listens_for(db.session, "after_transaction_end")
+def end_revision(session, transaction):
+    # A revision never outlives its transaction, committed or rolled back
+    if transaction.parent is None:
+        session.info.pop("revision", None)
+
+
+def changes_since(user_id, since=None):
+    """Return the user's lists and items changed after a revision, and deletes.
+
+    Without ``since``, or when it is older than the tombstones still kept,
+    every row is returned with ``"full": true`` and the client replaces its
+    copy. Otherwise clients apply "deleted" first and then upsert the rows,
+    since SQLite may hand a deleted ID to a new row. All reads share one
+    transaction, so they agree with "revision".
+    """
+    user = db.session.execute(
+        select(User.revision, User.sync_floor).where(User.id == user_id)
+    ).one()
+    # Also start over if the client claims a revision this database never had
+    full = (
+        since is None or since <= 0 or since < user.sync_floor or since > user.revision
+    )
+
+    lists = select(
+        TodoList.id, TodoList.title, TodoList.revision, TodoList.updated_at
+    ).where(TodoList.owner_id == user_id)
+    items = (
+        select(
+            TodoItem.id,
+            TodoItem.list_id,
+            TodoItem.parent_id,
+            TodoItem.content,
+            TodoItem.completed,
+            TodoItem.rank,
+            TodoItem.revision,
+            TodoItem.updated_at,
+        )
+        .join(TodoList, TodoItem.list_id == TodoList.id)
+        .where(TodoList.owner_id == user_id)
+    )
+    if not full:
+        lists = lists.where(TodoList.revision > since)
+        items = items.where(TodoItem.revision > since)
+    lists = db.session.execute(lists.order_by(TodoList.id)).all()
+    items = db.session.execute(items.order_by(TodoItem.id)).all()
+    deleted = {"lists": [], "items": []}
+    if not full:
+        rows = db.session.execute(
+            select(Tombstone.kind, Tombstone.row_id)
+            .where(Tombstone.user_id == user_id, Tombstone.revision > since)
+            .order_by(Tombstone.id)
+        )
+        for row in rows:
+            deleted[f"{row.kind}s"].append(row.row_id)
+
+    return {
+        "revision": user.revision,
+        "full": full,
+        "lists": [
+            {
+                "id": row.id,
+                "title": row.title,
+                "revision": row.revision,
+                "updated_at": iso(row.updated_at),
+            }
+            for row in lists
+        ],
+        "items": [
+            {
+                "id": row.id,
+                "list_id": row.list_id,
+                "parent_id": row.parent_id,
+                "content": row.content,
+                "completed": bool(row.completed),
+                "rank": row.rank,
+                "revision": row.revision,
+                "updated_at": iso(row.updated_at),
+            }
+            for row in items
+        ],
+        "deleted": deleted,
+    }
+
+
+def iso(value):
+    return None if value is None else value.isoformat()
+
+
+def prune_tombstones(older_than):
+    """Delete tombstones older than a timedelta and return how many went.
+
+    Each affected user's sync_floor moves up to the newest pruned revision,
+    so clients that were offline longer than that get a full sync instead
+    of silently missing deletes.
+    """
+    cutoff = datetime.utcnow() - older_than
+    floors = db.session.execute(
+        select(Tombstone.user_id, func.max(Tombstone.revision))
+        .where(Tombstone.deleted_at < cutoff)
+        .group_by(Tombstone.user_id)
+    ).all()
+    for user_id, floor in floors:
+        db.session.execute(
+            update(User)
+            .where(User.id == user_id, User.sync_floor < floor)
+            .values(sync_floor=floor)
+        )
+    result = db.session.execute(delete(Tombstone).where(Tombstone.deleted_at < cutoff))
+    db.session.commit()
+    return result.rowcount
+
+
+# CLI command to drop old tombstones: flask --app backend prune-tombstones
+@click.command("prune-tombstones")
+@click.option("--days", type=int, default=30, show_default=True)
+@with_appcontext
+def prune_tombstones_command(days):
+    pruned = prune_tombstones(timedelta(days=days))
+    click.echo(f"Pruned {pruned} tombstone(s) older than {days} day(s)")
@@ -1,32 +1,56 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, current_app, request, jsonify, stream_with_context
+from sqlalchemy import delete, update
 from .models import db, TodoList, TodoItem
+from .access import (
+    check_list_owner,
+    get_owned_archived_item,
+    get_owned_item,
+    get_owned_list,
+    list_owners,
+)
+from .archive import ArchiveError, add_archived, archived_items_query, restore_subtree
+from .cache import snapshots
+from .encoding import (
+    EncodingError,
+    compress,
+    encode_lists,
+    encoded_response,
+    make_conditional,
+    negotiate,
+    variant,
+)
+from .events import (
+    changes as change_feed,
+    create_stream_token,
+    publish_change,
+    query_token_allowed,
+)
+from .rollup import RollupDeltas, completion_changed, item_added
+from .transfer import TransferError, export_ndjson, import_records, iter_ndjson
+from .batch import BatchError, apply_batch, is_content, is_real_id
+from .search import SearchError, search_items
+from .ranks import append_rank
+from .sync import add_tombstones, begin_revision, changes_since, stamp
+from .tree import (
+    keyset_page,
+    load_user_tree,
+    page_size,
+    ranked_page,
+    serialize_nodes,
+)
+from .hierarchy import (
+    HierarchyError,
+    child_path,
+    delete_list_items,
+    delete_subtree,
+    move_subtree,
+)
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 # Create a Blueprint for grouping the todo-related routes
 todo = Blueprint("todo", __name__)
 
 
-# Function to recursively serialize items to build a nested structure
-def serialize_items(items, depth=1):
-    if depth > 3:  # Limit nesting to 3 levels to prevent infinite recursion
-        return []
-    serialized_items = []
-    for item in items:
-        serialized_items.append(
-            {
-                "id": item.id,
-                "content": item.content,
-                "parent_id": item.parent_id,
-                "completed": item.completed,
-                # Recursively serialize child items
-                "items": serialize_items(
-                    TodoItem.query.filter_by(parent_id=item.id).all(), depth + 1
-                ),
-            }
-        )
-    return serialized_items
-
-
 # Route to add a new todo list
 @todo.route("/list/add", methods=["POST"])
 @jwt_required()  # Require JWT authentication
@@ -37,10 +61,15 @@ def add_list():
         # Return an error response if the title is missing
         return jsonify({"success": False, "message": "Title is required"}), 400
 
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
     # Create a new TodoList instance and associate it with the current user
     new_list = TodoList(title=title, owner_id=current_user_id)
     db.session.add(new_list)  # Add the new list to the database session
     db.session.commit()  # Commit the session to save changes
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    publish_change(
+        current_user_id, "list.create", list_id=new_list.id, fields={"title": title}
+    )
     # Return a success response with the new list's ID
     return jsonify({"success": True, "list_id": new_list.id}), 200
 
@@ -50,24 +79,135 @@ def add_list():
 @jwt_required()  # Require JWT authentication
 def get_lists():
     current_user_id = get_jwt_identity()  # Get the current user's ID
-    # Query all TodoList instances owned by the current user
-    todo_lists = TodoList.query.filter_by(owner_id=current_user_id).all()
+    # Pick the nested or columnar format and a compression (see encoding.py)
+    try:
+        fmt, coding = negotiate(request)
+    except EncodingError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    if request.args.get("include_archived", "").lower() in ("1", "true", "yes"):
+        # Live and archived items together, built on demand and never cached
+        todo_lists, children = load_user_tree(current_user_id)
+        archived = db.session.scalars(archived_items_query(current_user_id)).all()
+        add_archived(children, archived)
+        body = compress(encode_lists(fmt, todo_lists, children), coding)
+        return encoded_response(body, fmt, coding), 200
+
+    # Read the version first so a concurrent change can only make the snapshot stale
+    version = snapshots.version(current_user_id)
+    encoding = variant(fmt, coding)  # Each encoding is cached on its own
+    body = snapshots.get(current_user_id, version, encoding)
+    if body is None:
+        # Load all lists and items for the user in a constant number of queries
+        todo_lists, children = load_user_tree(current_user_id)
+
+        # Serialize each TodoList, including its items and nested subtasks, and
+        # keep the compressed bytes so later requests skip both steps
+        body = compress(encode_lists(fmt, todo_lists, children), coding)
+        snapshots.put(current_user_id, version, body, encoding)
+
+    # Return the serialized lists, or 304 if the client already has this version
+    response = encoded_response(body, fmt, coding)
+    response.set_etag(snapshots.etag(current_user_id, version, encoding))
+    response.headers["Cache-Control"] = "private, no-cache"
+    return make_conditional(response, request)
+
+
+# Route to page through the current user's lists without loading their items
+@todo.route("/list/page", methods=["GET"])
+@jwt_required()  # Require JWT authentication
+def page_lists():
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    after = request.args.get("after", type=int)  # Last list ID of the previous page
+    limit = page_size(request.args.get("limit", type=int))
+
+    # Fetch one page of lists ordered by ID, continuing after the cursor
+    todo_lists, next_cursor = keyset_page(
+        TodoList.query.filter_by(owner_id=current_user_id), TodoList.id, after, limit
+    )
+    lists_data = [{"id": lst.id, "title": lst.title} for lst in todo_lists]
+    return jsonify({"lists": lists_data, "next_cursor": next_cursor}), 200
+
 
-    # Serialize each TodoList, including its items and nested subtasks
-    lists_data = [
+# Route to get the completion progress of every list of the current user
+@todo.route("/list/summary", methods=["GET"])
+@jwt_required()  # Require JWT authentication
+def list_summary():
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    # Read the maintained counters of all lists with a single indexed query
+    rows = db.session.execute(
+        db.select(
+            TodoList.id,
+            TodoList.title,
+            TodoList.total_descendants,
+            TodoList.completed_descendants,
+        )
+        .where(TodoList.owner_id == current_user_id)
+        .order_by(TodoList.id)
+    ).all()
+    summary = [
         {
-            "id": lst.id,
-            "title": lst.title,
-            # Serialize top-level items (those without a parent)
-            "items": serialize_items(
-                TodoItem.query.filter_by(list_id=lst.id, parent_id=None).all()
-            ),
+            "id": row.id,
+            "title": row.title,
+            "total": row.total_descendants,
+            "completed": row.completed_descendants,
         }
-        for lst in todo_lists
+        for row in rows
     ]
+    return jsonify({"lists": summary}), 200
+
+
+# Route to page through the top-level items of a list
+@todo.route("/list/<int:list_id>/items", methods=["GET"])
+@jwt_required()  # Require JWT authentication
+def page_list_items(list_id):
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    # Verify that the current user owns the list (cached for a few seconds)
+    check_list_owner(list_id, current_user_id)
+
+    after = request.args.get("after", type=int)  # Last item ID of the previous page
+    limit = page_size(request.args.get("limit", type=int))
+    # Fetch one page of top-level items in rank order, flagging the ones that
+    # have subtasks
+    items, next_cursor = ranked_page(
+        TodoItem.query.filter_by(list_id=list_id, parent_id=None), after, limit
+    )
+    return jsonify({"items": serialize_nodes(items), "next_cursor": next_cursor}), 200
+
+
+# Route to expand one item, paging through its direct subtasks
+@todo.route("/item/<int:item_id>/children", methods=["GET"])
+@jwt_required()  # Require JWT authentication
+def page_item_children(item_id):
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    # Retrieve the item and check that the current user owns it, in one query
+    item = get_owned_item(item_id, current_user_id)
+
+    after = request.args.get("after", type=int)  # Last item ID of the previous page
+    limit = page_size(request.args.get("limit", type=int))
+    # Fetch one page of direct children in rank order, flagging the ones that
+    # can be expanded
+    items, next_cursor = ranked_page(
+        TodoItem.query.filter_by(parent_id=item_id), after, limit
+    )
+    return jsonify({"items": serialize_nodes(items), "next_cursor": next_cursor}), 200
 
-    # Return the serialized lists as a JSON response
-    return jsonify({"lists": lists_data}), 200
+
+# Route to search the content of the current user's items
+@todo.route("/search", methods=["GET"])
+@jwt_required()  # Require JWT authentication
+def search():
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    q = request.args.get("q", "")  # Words to look for; "plan*" matches as a prefix
+    offset = max(0, request.args.get("offset", 0, type=int))  # Hits to skip
+    limit = page_size(request.args.get("limit", type=int))
+
+    try:
+        # Rank the user's matching items through the full-text index
+        hits, next_offset = search_items(current_user_id, q, limit, offset)
+    except SearchError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    return jsonify({"items": hits, "next_offset": next_offset}), 200
 
 
 # Route to add a new item to a specific list
@@ -75,12 +215,8 @@ def get_lists():
 @jwt_required()  # Require JWT authentication
 def add_item(list_id):
     current_user_id = get_jwt_identity()  # Get the current user's ID
-    # Retrieve the TodoList or return a 404 error if not found
-    todo_list = TodoList.query.get_or_404(list_id)
-    # Verify that the current user owns the list
-    if todo_list.owner_id != current_user_id:
-        # Return an unauthorized error if the user doesn't own the list
-        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    # Verify that the current user owns the list, which must still exist
+    get_owned_list(list_id, current_user_id)
 
     data = request.json
     content = data.get("content")  # Get the item's content from the request body
@@ -89,10 +225,33 @@ def add_item(list_id):
         # Return an error if the content is missing
         return jsonify({"success": False, "message": "Content is required"}), 400
 
+    parent_item = None
+    if parent_id is not None:
+        # The parent must be an existing item of the same list
+        parent_item = db.session.get(TodoItem, parent_id)
+        if parent_item is None or parent_item.list_id != list_id:
+            return jsonify({"success": False, "message": "Invalid parent item"}), 400
+
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
     # Create a new TodoItem and associate it with the list and parent (if provided)
-    new_item = TodoItem(content=content, list_id=list_id, parent_id=parent_id)
+    new_item = TodoItem(
+        content=content,
+        list_id=list_id,
+        parent_id=parent_id,
+        path=child_path(parent_item),
+        rank=append_rank(list_id, parent_id),  # After its existing siblings
+    )
     db.session.add(new_item)  # Add the new item to the database session
+    item_added(new_item)  # Count it in the progress of its ancestors and list
     db.session.commit()  # Commit the session to save changes
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    publish_change(
+        current_user_id,
+        "item.create",
+        item_id=new_item.id,
+        list_id=list_id,
+        fields={"content": content, "parent_id": parent_id, "completed": False},
+    )
     # Return a success response with the new item's ID
     return (
         jsonify(
@@ -107,26 +266,56 @@ def add_item(list_id):
 
 
 # Route to move an item to a different parent (change its position in the hierarchy)
+# and/or reorder it among its siblings
 @todo.route("/item/move", methods=["POST"])
 @jwt_required()  # Require JWT authentication
 def move_item():
     current_user_id = get_jwt_identity()  # Get the current user's ID
     data = request.json
     item_id = data.get("item_id")  # ID of the item to move
-    new_parent_id = data.get("new_parent_id")  # ID of the new parent item
-
-    # Retrieve the item to move or return a 404 error if not found
-    item = TodoItem.query.get_or_404(item_id)
-    # Verify that the current user owns the list containing the item
-    if item.list.owner_id != current_user_id:
-        # Return an unauthorized error if the user doesn't own the item
-        return jsonify({"success": False, "message": "Unauthorized"}), 403
-
-    # Update the item's parent ID to move it under a new parent
-    item.parent_id = new_parent_id
+    # ID of the new parent item; the current parent when only reordering
+    new_parent_id = data.get("new_parent_id")
+    after_id = data.get("after_id")  # Sibling to place the item after (optional)
+    before_id = data.get("before_id")  # Sibling to place the item before (optional)
+
+    # Retrieve the item and check that the current user owns it, in one query
+    item = get_owned_item(item_id, current_user_id)
+
+    new_parent = None
+    if new_parent_id is not None:
+        # Retrieve the new parent and verify that the current user owns it too
+        new_parent = get_owned_item(new_parent_id, current_user_id)
+    # Retrieve the siblings to place the item between, if any
+    after = None if after_id is None else get_owned_item(after_id, current_user_id)
+    before = None if before_id is None else get_owned_item(before_id, current_user_id)
+
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
+    try:
+        # Move the item under its new parent, carrying its subtasks along, at
+        # the requested position; a reorder only rewrites the item's rank
+        move_subtree(item, new_parent, after, before)
+    except HierarchyError as e:
+        # Reject moves that would create a cycle in the hierarchy
+        return jsonify({"success": False, "message": str(e)}), 400
     db.session.commit()  # Commit the session to save changes
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    publish_change(
+        current_user_id,
+        "item.move",
+        item_id=item.id,
+        fields={
+            "parent_id": item.parent_id,
+            "list_id": item.list_id,
+            "rank": item.rank,
+        },
+    )
     # Return a success response indicating the item was moved
-    return jsonify({"success": True, "message": "Item moved successfully"}), 200
+    return (
+        jsonify(
+            {"success": True, "message": "Item moved successfully", "rank": item.rank}
+        ),
+        200,
+    )
 
 
 # Route to update a todo list's title and its items
@@ -139,30 +328,118 @@ def update_list():
     new_title = data.get("title")  # New title for the list
     new_items = data.get("items")  # List of items to update
 
-    # Retrieve the TodoList or return a 404 error if not found
-    todo_list = TodoList.query.get_or_404(list_id)
-    # Verify that the current user owns the list
-    if todo_list.owner_id != current_user_id:
-        # Return an unauthorized error if the user doesn't own the list
-        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    # Retrieve the TodoList and verify that the current user owns it
+    todo_list = get_owned_list(list_id, current_user_id)
 
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
+    changes = []  # Compact change entries for the user's other clients
     # Update the list's title if a new one is provided
-    if new_title:
+    if new_title and new_title != todo_list.title:
         todo_list.title = new_title
+        changes.append(
+            {"op": "list.update", "list_id": list_id, "fields": {"title": new_title}}
+        )
 
     # Update the items if provided
+    outcome = {"updated": [], "unchanged": [], "rejected": []}
     if new_items is not None:
-        for item_data in new_items:
-            item = TodoItem.query.get(item_data["id"])  # Get the item by ID
-            if item and item.list_id == list_id:
-                # Update item attributes with new values or keep existing ones
-                item.content = item_data.get("content", item.content)
-                item.completed = item_data.get("completed", item.completed)
-                item.parent_id = item_data.get("parent_id", item.parent_id)
+        outcome, item_changes = update_items(list_id, new_items)
+        changes.extend(item_changes)
 
     db.session.commit()  # Commit the session to save changes
-    # Return a success response indicating the list was updated
-    return jsonify({"success": True, "message": "List updated successfully"}), 200
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    publish_change(current_user_id, "batch", changes=changes)
+    # Return a success response with the outcome for each submitted item
+    return (
+        jsonify({"success": True, "message": "List updated successfully", **outcome}),
+        200,
+    )
+
+
+def update_items(list_id, new_items):
+    """Apply a list save to its items with one SELECT and one bulk UPDATE.
+
+    Returns the submitted item IDs split into "updated", "unchanged" and
+    "rejected" (unknown, in another list, or an invalid new parent), and the
+    change feed entries of the updated items.
+    """
+    outcome = {"updated": [], "unchanged": [], "rejected": []}
+    if not isinstance(new_items, list):
+        return outcome, []
+    entries = [data for data in new_items if isinstance(data, dict)]
+
+    # Load every submitted item and requested parent with a single IN query
+    wanted = {data.get("id") for data in entries}
+    wanted |= {data.get("parent_id") for data in entries}
+    wanted = {ref for ref in wanted if is_real_id(ref)}
+    items = {}
+    if wanted:
+        items = {
+            item.id: item
+            for item in TodoItem.query.filter(
+                TodoItem.list_id == list_id, TodoItem.id.in_(wanted)
+            )
+        }
+
+    # First pass: re-parent items through the hierarchy index so paths stay valid
+    accepted = []  # (entry, item, moved) for every entry that was not rejected
+    for data in entries:
+        item = items.get(data.get("id")) if is_real_id(data.get("id")) else None
+        if item is None:
+            outcome["rejected"].append(data.get("id"))
+            continue
+        # Same values the single-item routes accept: non-empty text, a boolean
+        if "content" in data and not is_content(data["content"]):
+            outcome["rejected"].append(item.id)
+            continue
+        if "completed" in data and not isinstance(data["completed"], bool):
+            outcome["rejected"].append(item.id)
+            continue
+
+        moved = False
+        if "parent_id" in data and data["parent_id"] != item.parent_id:
+            new_parent = None
+            if data["parent_id"] is not None:
+                new_parent = items.get(data["parent_id"])
+                if new_parent is None:
+                    outcome["rejected"].append(item.id)
+                    continue
+            try:
+                move_subtree(item, new_parent)
+            except HierarchyError:
+                outcome["rejected"].append(item.id)
+                continue
+            moved = True
+        accepted.append((data, item, moved))
+
+    # Second pass: collect the changed content/completed values
+    changes = []  # Rows for the bulk UPDATE, holding only the changed columns
+    feed = []  # Change feed entries, one per updated item
+    deltas = RollupDeltas()  # Progress counter changes, applied together
+    completed_now = {}  # Completion state as of the entries seen so far
+    for data, item, moved in accepted:
+        row = {"id": item.id}
+        if "content" in data and data["content"] != item.content:
+            row["content"] = data["content"]
+        current = completed_now.get(item.id, bool(item.completed))
+        if "completed" in data and data["completed"] != current:
+            row["completed"] = data["completed"]
+            completed_now[item.id] = row["completed"]
+            deltas.add(item.path, item.list_id, 0, 1 if row["completed"] else -1)
+        if len(row) > 1:
+            changes.append({**row, **stamp()})
+        fields = {key: value for key, value in row.items() if key != "id"}
+        if moved:
+            fields["parent_id"] = item.parent_id
+        if fields:
+            feed.append({"op": "item.update", "item_id": item.id, "fields": fields})
+        outcome["updated" if moved or len(row) > 1 else "unchanged"].append(item.id)
+
+    if changes:
+        # Bulk UPDATE by primary key, sent as executemany batches
+        db.session.execute(update(TodoItem), changes)
+    deltas.apply()
+    return outcome, feed
 
 
 # Route to add a subtask to a parent item
@@ -170,25 +447,34 @@ def update_list():
 @jwt_required()  # Require JWT authentication
 def add_subtask(parent_id):
     current_user_id = get_jwt_identity()  # Get the current user's ID
-    # Retrieve the parent item or return a 404 error if not found
-    parent_item = TodoItem.query.get_or_404(parent_id)
-
-    # Verify that the current user owns the list containing the parent item
-    if parent_item.list.owner_id != current_user_id:
-        # Return an unauthorized error if the user doesn't own the parent item
-        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    # Retrieve the item and check that the current user owns it, in one query
+    parent_item = get_owned_item(parent_id, current_user_id)
 
     content = request.json.get("content")  # Get the subtask's content from the request
     if not content:
         # Return an error if the content is missing
         return jsonify({"success": False, "message": "Content is required"}), 400
 
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
     # Create a new TodoItem as a subtask under the parent item
     new_item = TodoItem(
-        content=content, list_id=parent_item.list_id, parent_id=parent_id
+        content=content,
+        list_id=parent_item.list_id,
+        parent_id=parent_id,
+        path=child_path(parent_item),
+        rank=append_rank(parent_item.list_id, parent_id),  # After its siblings
     )
     db.session.add(new_item)  # Add the new subtask to the database session
+    item_added(new_item)  # Count it in the progress of its ancestors and list
     db.session.commit()  # Commit the session to save changes
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    publish_change(
+        current_user_id,
+        "item.create",
+        item_id=new_item.id,
+        list_id=new_item.list_id,
+        fields={"content": content, "parent_id": parent_id, "completed": False},
+    )
     # Return a success response with the new subtask's ID
     return (
         jsonify(
@@ -207,16 +493,21 @@ def add_subtask(parent_id):
 @jwt_required()  # Require JWT authentication
 def toggle_item(item_id):
     current_user_id = get_jwt_identity()  # Get the current user's ID
-    # Retrieve the item to toggle or return a 404 error if not found
-    item = TodoItem.query.get_or_404(item_id)
-    # Verify that the current user owns the list containing the item
-    if item.list.owner_id != current_user_id:
-        # Return an unauthorized error if the user doesn't own the item
-        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    # Retrieve the item and check that the current user owns it, in one query
+    item = get_owned_item(item_id, current_user_id)
 
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
     # Toggle the item's completion status
+    completion_changed(item, not item.completed)  # Update ancestors' progress
     item.completed = not item.completed
     db.session.commit()  # Commit the session to save changes
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    publish_change(
+        current_user_id,
+        "item.update",
+        item_id=item.id,
+        fields={"completed": item.completed},
+    )
     # Return a success response indicating the item's status was toggled
     return jsonify({"success": True})
 
@@ -226,18 +517,28 @@ def toggle_item(item_id):
 @jwt_required()  # Require JWT authentication
 def delete_list(list_id):
     current_user_id = get_jwt_identity()  # Get the current user's ID
-    # Retrieve the TodoList or return a 404 error if not found
-    todo_list = TodoList.query.get_or_404(list_id)
-    # Verify that the current user owns the list
-    if todo_list.owner_id != current_user_id:
-        # Return an unauthorized error if the user doesn't own the list
-        return jsonify({"success": False, "message": "Unauthorized"}), 403
-
-    # Delete all items associated with the list
-    TodoItem.query.filter_by(list_id=list_id).delete()
-    # Delete the list itself
-    db.session.delete(todo_list)
+    # Verify that the current user owns the list, which must still exist
+    get_owned_list(list_id, current_user_id)
+
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
+    # Delete all items associated with the list, including subtasks of those
+    # items; subtasks other lists keep under them stay as top-level items
+    rerooted = delete_list_items(list_id)
+    # Delete the list itself without loading its (already deleted) items
+    db.session.execute(delete(TodoList).where(TodoList.id == list_id))
+    add_tombstones("list", [list_id])  # Tell syncing clients the list is gone
     db.session.commit()  # Commit the session to save changes
+    list_owners.forget(list_id)  # The list is gone, so stop vouching for its owner
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    publish_change(current_user_id, "list.delete", list_id=list_id)
+    for item_id, moved_list_id, owner_id, revision in rerooted:
+        publish_change(
+            owner_id,
+            "item.move",
+            revision=revision,
+            item_id=item_id,
+            fields={"parent_id": None, "list_id": moved_list_id},
+        )
 
     # Return a success response indicating the list was deleted
     return jsonify({"message": "List deleted successfully"}), 200
@@ -248,31 +549,41 @@ def delete_list(list_id):
 @jwt_required()  # Require JWT authentication
 def delete_item(item_id):
     current_user_id = get_jwt_identity()  # Get the current user's ID
-    # Retrieve the item to delete or return a 404 error if not found
-    item = TodoItem.query.get_or_404(item_id)
-    # Verify that the current user owns the list containing the item
-    if item.list.owner_id != current_user_id:
-        # Return an unauthorized error if the user doesn't own the item
-        return jsonify({"success": False, "message": "Unauthorized"}), 403
-
-    # Recursively delete all child items (subtasks)
-    delete_children(item)
-    # Delete the item itself
-    db.session.delete(item)
+    # Retrieve the item and check that the current user owns it, in one query
+    item = get_owned_item(item_id, current_user_id)
+
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
+    # Delete the item and all of its subtasks in a single statement
+    delete_subtree(item)
     db.session.commit()  # Commit the session to save changes
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    # The item's subtasks are gone too, which clients infer from the tree
+    publish_change(current_user_id, "item.delete", item_id=item_id)
     # Return a success response indicating the item was deleted
     return jsonify({"message": "Item deleted successfully"}), 200
 
 
-def delete_children(item):
-    """Recursively delete all children (subtasks) of an item."""
-    # Get all direct children of the current item
-    children = TodoItem.query.filter_by(parent_id=item.id).all()
-    for child in children:
-        # Recursively delete each child's subtasks
-        delete_children(child)
-        # Delete the child item
-        db.session.delete(child)
+# Route to bring an archived item and its subtasks back into the live tree
+@todo.route("/item/<int:item_id>/restore", methods=["POST"])
+@jwt_required()  # Require JWT authentication
+def restore_item(item_id):
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    # Retrieve the archived item and check that the current user owns its list
+    archived = get_owned_archived_item(item_id, current_user_id)
+
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
+    try:
+        # Restore the subtree under its parent, at its old position
+        item = restore_subtree(archived)
+    except ArchiveError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 400
+    db.session.commit()  # Commit the session to save changes
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    # Clients reload the tree on "item.restore", like after an import
+    publish_change(current_user_id, "item.restore", item_id=item.id)
+    # Return the restored item's ID, the same one it had before archiving
+    return jsonify({"success": True, "item_id": item.id}), 200
 
 
 # Route to edit an item's content
@@ -280,21 +591,22 @@ def delete_children(item):
 @jwt_required()  # Require JWT authentication
 def edit_item(item_id):
     current_user_id = get_jwt_identity()  # Get the current user's ID
-    # Retrieve the item to edit or return a 404 error if not found
-    item = TodoItem.query.get_or_404(item_id)
-    # Verify that the current user owns the list containing the item
-    if item.list.owner_id != current_user_id:
-        # Return an unauthorized error if the user doesn't own the item
-        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    # Retrieve the item and check that the current user owns it, in one query
+    item = get_owned_item(item_id, current_user_id)
 
     content = request.json.get("content")  # Get the new content from the request body
     if not content:
         # Return an error if the new content is missing
         return jsonify({"success": False, "message": "Content is required"}), 400
 
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
     # Update the item's content
     item.content = content
     db.session.commit()  # Commit the session to save changes
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    publish_change(
+        current_user_id, "item.update", item_id=item.id, fields={"content": content}
+    )
     # Return a success response indicating the item was updated
     return jsonify({"success": True})
 
@@ -305,15 +617,124 @@ def edit_item(item_id):
 def toggle_complete(item_id):
     # This route appears to duplicate the functionality of /item/toggle/<int:item_id>
     current_user_id = get_jwt_identity()  # Get the current user's ID
-    # Retrieve the item to toggle or return a 404 error if not found
-    item = TodoItem.query.get_or_404(item_id)
-    # Verify that the current user owns the list containing the item
-    if item.list.owner_id != current_user_id:
-        # Return an unauthorized error if the user doesn't own the item
-        return jsonify({"success": False, "message": "Unauthorized"}), 403
+    # Retrieve the item and check that the current user owns it, in one query
+    item = get_owned_item(item_id, current_user_id)
 
+    begin_revision(current_user_id)  # Stamp this request's changes for /sync
     # Toggle the item's completion status
+    completion_changed(item, not item.completed)  # Update ancestors' progress
     item.completed = not item.completed
     db.session.commit()  # Commit the session to save changes
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    publish_change(
+        current_user_id,
+        "item.update",
+        item_id=item.id,
+        fields={"completed": item.completed},
+    )
     # Return a success response indicating the item's status was toggled
     return jsonify({"success": True})
+
+
+# Route to apply several item operations (create/edit/toggle/move/delete) at once
+@todo.route("/batch", methods=["POST"])
+@jwt_required()  # Require JWT authentication
+def batch():
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    ops = (request.json or {}).get("ops")  # Ordered list of operations to apply
+
+    try:
+        # Check ownership once for everything the batch touches, then apply it
+        results, changes = apply_batch(ops, current_user_id)
+    except BatchError as e:
+        # Undo every operation of the batch if any of them fails
+        db.session.rollback()
+        return (
+            jsonify({"success": False, "message": e.message, "failed_op": e.index}),
+            e.status,
+        )
+
+    db.session.commit()  # Commit all operations in a single transaction
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    publish_change(current_user_id, "batch", changes=changes)
+    # Return the outcome of each operation, including IDs of created items
+    return jsonify({"success": True, "results": results}), 200
+
+
+# Route to fetch the lists and items changed since a revision, plus deletions
+@todo.route("/sync", methods=["GET"])
+@jwt_required()  # Require JWT authentication
+def sync():
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    # Revision the client's copy is at; without it everything is returned
+    since = request.args.get("since", type=int)
+    return jsonify(changes_since(current_user_id, since)), 200
+
+
+# Route to get a short-lived token for opening /events
+@todo.route("/events/token", methods=["POST"])
+@jwt_required()  # Require JWT authentication
+def events_token():
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    # The token goes in the query string, which access logs keep, so it
+    # expires quickly and only opens the event stream (see events.py)
+    token = create_stream_token(current_user_id)
+    expires_in = current_app.config["EVENTS_TOKEN_TTL"]
+    return jsonify({"success": True, "token": token, "expires_in": expires_in}), 200
+
+
+# Route to stream the current user's changes as Server-Sent Events
+@todo.route("/events", methods=["GET"])
+# EventSource cannot send headers, so the token may also come as ?jwt=<token>
+@jwt_required(locations=["headers", "query_string"])
+def events():
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    if not query_token_allowed():
+        # Only stream tokens may travel in the query string
+        message = "Pass a token from /events/token as ?jwt="
+        return jsonify({"success": False, "message": message}), 401
+    # EventSource sends the ID of the last event it saw when it reconnects
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get(
+        "last_event_id"
+    )
+    # Stream events as they are published; the connection stays open
+    response = current_app.response_class(
+        stream_with_context(change_feed.stream(current_user_id, last_event_id)),
+        mimetype="text/event-stream",
+    )
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # Keep nginx from buffering events
+    return response
+
+
+# Route to stream a backup of all the current user's lists and items as NDJSON
+@todo.route("/export", methods=["GET"])
+@jwt_required()  # Require JWT authentication
+def export_lists():
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    # Stream records as they are read instead of building the document in memory
+    response = current_app.response_class(
+        stream_with_context(export_ndjson(current_user_id)),
+        mimetype="application/x-ndjson",
+    )
+    response.headers["Content-Disposition"] = "attachment; filename=todo-export.ndjson"
+    return response
+
+
+# Route to import an NDJSON export as new lists owned by the current user
+@todo.route("/import", methods=["POST"])
+@jwt_required()  # Require JWT authentication
+def import_lists():
+    current_user_id = get_jwt_identity()  # Get the current user's ID
+    try:
+        # Read the request body line by line and insert items in chunks
+        counts = import_records(iter_ndjson(request.stream), current_user_id)
+    except TransferError as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    db.session.commit()  # Commit the whole import at once
+    # Invalidate the cached /list snapshot and notify the user's open clients
+    # Clients reload on "import" rather than receiving every new item
+    publish_change(current_user_id, "import", fields=counts)
+    return jsonify({"success": True, **counts}), 200
@@ -0,0 +1,256 @@
+import json
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import insert, literal, select, union_all, update
+from .models import db, User, ArchivedItem, TodoList, TodoItem
+from .hierarchy import compute_paths
+from .ranks import is_valid_rank, spread_ranks
+from .rollup import rebuild_rollups
+from .events import publish_change
+from .sync import begin_revision, stamp
+
+# Export/import of a user's whole hierarchy as NDJSON, one record per line:
+#
+#   {"type": "list", "id": 7, "title": "Groceries"}
+#   {"type": "item", "id": 16, "list_id": 7, "parent_id": null,
+#    "content": "Milk", "completed": false, "rank": "i"}
+#
+# All lists come first, then all items, each in ID order. IDs are the ones of
+# the exporting database; the importer allocates new ones and remaps them.
+# Ranks order siblings; items without a valid one keep the record order.
+# Items whose parent was not exported, is in another list or would close a
+# parent_id cycle are imported as top-level items.
+# Archived items are exported too, with "archived": true, and come back live.
+
+# Rows fetched per round trip while exporting, and inserted per statement on import
+EXPORT_CHUNK_SIZE = 1000
+IMPORT_CHUNK_SIZE = 1000
+
+
+class TransferError(ValueError):
+    """Raised when an import stream is malformed."""
+
+
+def is_id(value):
+    # Exported IDs are integers; JSON true and false would pass for 1 and 0
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def export_records(owner_id, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield the export records of a user, streaming rows from the database.
+
+    Plain column tuples are fetched ``chunk_size`` at a time, so memory use
+    stays flat no matter how many items the user has.
+    """
+    lists = db.session.execute(
+        select(TodoList.id, TodoList.title)
+        .where(TodoList.owner_id == owner_id)
+        .order_by(TodoList.id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for row in lists:
+        yield {"type": "list", "id": row.id, "title": row.title}
+
+    # Live and archived items, in one ID order
+    item_queries = [
+        select(
+            model.id.label("id"),  # Named, so the union can be ordered by it
+            model.list_id,
+            model.parent_id,
+            model.content,
+            model.completed,
+            model.rank,
+            literal(model is ArchivedItem).label("archived"),
+        )
+        .join(TodoList, model.list_id == TodoList.id)
+        .where(TodoList.owner_id == owner_id)
+        for model in (TodoItem, ArchivedItem)
+    ]
+    items = db.session.execute(
+        union_all(*item_queries).order_by("id").execution_options(yield_per=chunk_size)
+    )
+    for row in items:
+        record = {
+            "type": "item",
+            "id": row.id,
+            "list_id": row.list_id,
+            "parent_id": row.parent_id,
+            "content": row.content,
+            "completed": bool(row.completed),
+            "rank": row.rank,
+        }
+        if row.archived:
+            record["archived"] = True
+        yield record
+
+
+def export_ndjson(owner_id):
+    # Encode each export record as one line of NDJSON
+    for record in export_records(owner_id):
+        yield json.dumps(record) + "\n"
+
+
+def iter_ndjson(lines):
+    """Parse NDJSON records from an iterable of text or byte lines."""
+    for number, line in enumerate(lines, start=1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode("utf-8")
+            except UnicodeDecodeError:
+                raise TransferError(f"Line {number} is not valid UTF-8")
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            raise TransferError(f"Line {number} is not valid JSON")
+        if not isinstance(record, dict):
+            raise TransferError(f"Line {number} is not a JSON object")
+        yield record
+
+
+def import_records(records, owner_id, chunk_size=IMPORT_CHUNK_SIZE):
+    """Import exported records as new lists and items owned by a user.
+
+    Items are bulk-inserted ``chunk_size`` at a time without their parent;
+    once every new ID is known, parent links and paths are restored with
+    executemany UPDATEs, and items exported without a rank are ranked in
+    record order. Only the old-to-new ID maps are kept in memory.
+    The caller owns the transaction. Returns the number of lists and items.
+    """
+    begin_revision(owner_id)
+    list_ids = {}  # Exported list ID -> new list ID
+    item_ids = {}  # Exported item ID -> new item ID
+    old_parents = {}  # Exported item ID -> exported parent ID
+    item_lists = {}  # Exported item ID -> new list ID
+    unranked = {}  # Exported item ID -> new list ID, for items without a rank
+    chunk = []
+
+    def insert_chunk():
+        # Insert with a placeholder path tag so RETURNING rows map back to records
+        returned = db.session.execute(
+            insert(TodoItem).returning(TodoItem.id, TodoItem.path), chunk
+        )
+        for row in returned:
+            item_ids[int(row.path[1:])] = row.id
+        chunk.clear()
+
+    for record in records:
+        kind = record.get("type")
+        if kind == "list":
+            old_id = record.get("id")
+            if not is_id(old_id) or old_id in list_ids:
+                raise TransferError(f"List {old_id!r} has a missing or duplicate ID")
+            title = record.get("title")
+            if not title or not isinstance(title, str):
+                raise TransferError(f"List {old_id} has no title")
+            new_list = TodoList(title=title, owner_id=owner_id)
+            db.session.add(new_list)
+            db.session.flush()
+            list_ids[old_id] = new_list.id
+        elif kind == "item":
+            old_id = record.get("id")
+            if not is_id(old_id) or old_id in old_parents:
+                raise TransferError(f"Item {old_id!r} has a missing or duplicate ID")
+            if not is_id(record.get("list_id")) or record["list_id"] not in list_ids:
+                raise TransferError(f"Item {old_id} refers to an unknown list")
+            parent_id = record.get("parent_id")
+            if parent_id is not None and not is_id(parent_id):
+                raise TransferError(f"Item {old_id} has an invalid parent ID")
+            if not isinstance(record.get("content"), str):
+                raise TransferError(f"Item {old_id} has invalid content")
+            old_parents[old_id] = parent_id
+            item_lists[old_id] = list_ids[record["list_id"]]
+            rank = record.get("rank")
+            if not is_valid_rank(rank):
+                rank = ""
+                unranked[old_id] = list_ids[record["list_id"]]
+            chunk.append(
+                {
+                    "content": record.get("content"),
+                    "completed": bool(record.get("completed")),
+                    "list_id": list_ids[record["list_id"]],
+                    "path": f"~{old_id}",
+                    "rank": rank,
+                    **stamp(),
+                }
+            )
+            if len(chunk) >= chunk_size:
+                insert_chunk()
+        else:
+            raise TransferError(f"Unknown record type {kind!r}")
+    if chunk:
+        insert_chunk()
+
+    # Remap parent links; parents that were not exported, or that are in
+    # another list, become top-level items
+    parents = {
+        item_ids[old_id]: (
+            item_ids[old_parent]
+            if item_lists.get(old_parent) == item_lists[old_id]
+            else None
+        )
+        for old_id, old_parent in old_parents.items()
+    }
+    paths = compute_paths(parents)
+    # compute_paths gives the item where it finds a cycle a top-level path;
+    # cut its parent link to match, which turns the cycle into a branch
+    for new_id, parent_id in parents.items():
+        if parent_id is not None and paths[new_id] != f"{paths[parent_id]}{parent_id}/":
+            parents[new_id] = None
+    links = [
+        {"id": new_id, "parent_id": parent_id, "path": paths[new_id]}
+        for new_id, parent_id in parents.items()
+    ]
+    for start in range(0, len(links), chunk_size):
+        db.session.execute(update(TodoItem), links[start : start + chunk_size])
+    # Spread ranks over each group of unranked siblings, in record order
+    groups = {}
+    for old_id, list_id in unranked.items():
+        new_id = item_ids[old_id]
+        groups.setdefault((list_id, parents[new_id]), []).append(new_id)
+    ranks = [
+        {"id": new_id, "rank": rank}
+        for group in groups.values()
+        for new_id, rank in zip(group, spread_ranks(len(group)))
+    ]
+    for start in range(0, len(ranks), chunk_size):
+        db.session.execute(update(TodoItem), ranks[start : start + chunk_size])
+    # Fill in the progress counters of the new lists and items
+    rebuild_rollups(db.session.connection(), list(list_ids.values()))
+    return {"lists": len(list_ids), "items": len(item_ids)}
+
+
+def find_user(email):
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f"No user with email {email}")
+    return user
+
+
+# CLI command to export a user's lists: flask --app backend export-user EMAIL
+@click.command("export-user")
+@click.argument("email")
+@click.option("--output", "-o", type=click.File("w"), default="-")
+@with_appcontext
+def export_user_command(email, output):
+    user = find_user(email)
+    for line in export_ndjson(user.id):
+        output.write(line)
+
+
+# CLI command to import lists for a user: flask --app backend import-user EMAIL FILE
+@click.command("import-user")
+@click.argument("email")
+@click.argument("source", type=click.File("r"))
+@with_appcontext
+def import_user_command(email, source):
+    user = find_user(email)
+    try:
+        counts = import_records(iter_ndjson(source), user.id)
+    except TransferError as e:
+        db.session.rollback()
+        raise click.ClickException(str(e))
+    db.session.commit()
+    publish_change(user.id, "import", fields=counts)
+    click.echo(f"Imported {counts['lists']} list(s) and {counts['items']} item(s)")
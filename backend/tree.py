@@ -0,0 +1,147 @@
+from collections import defaultdict
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import aliased
+from .metrics import measure
+from .models import db, ArchivedItem, TodoList, TodoItem
+
+
+def user_tree_queries(owner_id):
+    # SELECTs of a user's lists and of every item in them; the ASGI app runs
+    # the same statements on its async engine (see aio.py)
+    lists = select(TodoList).where(TodoList.owner_id == owner_id).order_by(TodoList.id)
+    # All items of those lists with a single join, instead of one query per node.
+    # Each sibling group comes out in rank order straight from the
+    # (list_id, parent_id, rank) index, so index_children keeps that order;
+    # ordering by the list's own ID lets SQLite skip sorting altogether
+    items = (
+        select(TodoItem)
+        .join(TodoList, TodoItem.list_id == TodoList.id)
+        .where(TodoList.owner_id == owner_id)
+        .order_by(TodoList.id, TodoItem.parent_id, TodoItem.rank, TodoItem.id)
+    )
+    return lists, items
+
+
+# Load every list and item owned by a user in a fixed number of queries
+def load_user_tree(owner_id):
+    lists, items = user_tree_queries(owner_id)
+    todo_lists = db.session.scalars(lists).all()
+    return todo_lists, index_children(db.session.scalars(items).all())
+
+
+def index_children(items):
+    """Group items by parent ID so the tree can be walked without hitting the DB.
+
+    Top-level items are stored under the key ("list", list_id) so that each
+    list can find its roots; every other item is stored under its parent's ID.
+    """
+    children = defaultdict(list)
+    for item in items:
+        if item.parent_id is None:
+            children[("list", item.list_id)].append(item)
+        else:
+            children[item.parent_id].append(item)
+    return children
+
+
+# Function to recursively serialize items to build a nested structure
+# Only items reachable from a list's top level are visited, so there is no depth
+# limit: the move routes refuse to create parent_id cycles (see hierarchy.py)
+def serialize_items(items, children):
+    serialized_items = []
+    for item in items:
+        node = {
+            "id": item.id,
+            "content": item.content,
+            "parent_id": item.parent_id,
+            "completed": item.completed,
+            # Recursively serialize child items from the in-memory index
+            "items": serialize_items(children.get(item.id, []), children),
+        }
+        if isinstance(item, ArchivedItem):
+            node["archived"] = True  # Only loaded for ?include_archived=1
+        serialized_items.append(node)
+    return serialized_items
+
+
+# Serialize a TodoList, including its items and nested subtasks
+def serialize_list(todo_list, children):
+    # Serialize top-level items (those without a parent); the time shows up
+    # as "serialize" in Server-Timing and /metrics when instrumentation is on
+    with measure("serialize"):
+        items = serialize_items(children.get(("list", todo_list.id), []), children)
+    return {"id": todo_list.id, "title": todo_list.title, "items": items}
+
+
+# Default and maximum page sizes for the paginated tree endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def page_size(limit):
+    # Clamp a client-supplied page size to a sane range
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def keyset_page(query, column, after, limit):
+    """Fetch one page of a query ordered by a unique column, starting after a cursor.
+
+    One extra row is requested to know whether another page exists, so the
+    work done never depends on how many rows come before the cursor.
+    """
+    if after is not None:
+        query = query.filter(column > after)
+    rows = query.order_by(column).limit(limit + 1).all()
+    next_cursor = getattr(rows[limit - 1], column.key) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def ranked_page(query, after, limit):
+    """Fetch one page of sibling items in rank order, starting after an item.
+
+    Like keyset_page, with the position of the ``after`` item as the cursor:
+    (rank, id) is unique and indexed, so pages never skip or repeat items
+    when others are inserted in between.
+    """
+    if after is not None:
+        anchor = aliased(TodoItem)
+        cursor = select(anchor.rank, anchor.id).where(anchor.id == after)
+        query = query.filter(
+            tuple_(TodoItem.rank, TodoItem.id) > cursor.scalar_subquery()
+        )
+    rows = query.order_by(TodoItem.rank, TodoItem.id).limit(limit + 1).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def child_counts(parent_ids):
+    # Count the direct children of each given item with one grouped query
+    if not parent_ids:
+        return {}
+    rows = (
+        db.session.query(TodoItem.parent_id, db.func.count(TodoItem.id))
+        .filter(TodoItem.parent_id.in_(parent_ids))
+        .group_by(TodoItem.parent_id)
+        .all()
+    )
+    return dict(rows)
+
+
+# Serialize items without their subtasks, flagging which ones can be expanded
+def serialize_nodes(items):
+    counts = child_counts([item.id for item in items])
+    return [
+        {
+            "id": item.id,
+            "content": item.content,
+            "parent_id": item.parent_id,
+            "completed": item.completed,
+            "child_count": counts.get(item.id, 0),
+            "has_children": item.id in counts,
+            "total_descendants": item.total_descendants,
+            "completed_descendants": item.completed_descendants,
+        }
+        for item in items
+    ]
@@ -0,0 +1,5 @@
+from . import create_app
+
+# WSGI entry point for production servers: gunicorn backend.wsgi:app
+# ("python -m backend.serve" starts gunicorn with the tuned settings)
+app = create_app()
@@ -0,0 +1,117 @@
+"""Stress test for concurrent writers on the SQLite database.
+
+Spawns several worker processes, each with its own app and connection pool
+like gunicorn workers, which hammer the write routes of the same database
+file at once and count the requests that fail.
+
+    python benchmarks/concurrent_writers.py --workers 8 --writes 200
+    python benchmarks/concurrent_writers.py --baseline   # rollback journal, no busy wait
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings that reproduce the old behaviour: rollback journal, full fsync on
+# every commit and an immediate "database is locked" error on contention
+BASELINE_ENV = {
+    "SQLITE_JOURNAL_MODE": "DELETE",
+    "SQLITE_SYNCHRONOUS": "FULL",
+    "SQLITE_BUSY_TIMEOUT_MS": "0",
+}
+
+
+def seed(uri):
+    from backend import create_app, db
+    from backend.models import User, TodoList
+    from backend.sync import begin_revision
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": uri})
+    with app.app_context():
+        user = User(email="stress@example.com", name="Stress", username="stress")
+        db.session.add(user)
+        db.session.flush()
+        begin_revision(user.id)
+        todo_list = TodoList(title="Stress", owner_id=user.id)
+        db.session.add(todo_list)
+        db.session.commit()
+        return user.id, todo_list.id
+
+
+def worker(uri, user_id, list_id, writes, results):
+    from flask_jwt_extended import create_access_token
+    from backend import create_app
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": uri})
+    app.logger.disabled = True  # Failed requests are counted, not printed
+    client = app.test_client()
+    with app.app_context():
+        headers = {"Authorization": "Bearer " + create_access_token(identity=user_id)}
+
+    errors = 0
+    item_id = None
+    for n in range(writes):
+        try:
+            if item_id is None or n % 2 == 0:
+                response = client.post(
+                    f"/list/{list_id}/add",
+                    json={"content": f"item {n}"},
+                    headers=headers,
+                )
+                if response.status_code == 200:
+                    item_id = response.json["item_id"]
+            else:
+                response = client.post(f"/item/toggle/{item_id}", headers=headers)
+            if response.status_code != 200:
+                errors += 1
+        except Exception:
+            # "database is locked" surfaces as an OperationalError from the route
+            errors += 1
+    results.put(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=200, help="requests per worker")
+    parser.add_argument(
+        "--baseline", action="store_true", help="run with the untuned settings"
+    )
+    args = parser.parse_args()
+
+    if args.baseline:
+        os.environ.update(BASELINE_ENV)
+    tmpdir = tempfile.mkdtemp()
+    uri = "sqlite:///" + os.path.join(tmpdir, "stress.db")
+    user_id, list_id = seed(uri)
+
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=worker, args=(uri, user_id, list_id, args.writes, results)
+        )
+        for _ in range(args.workers)
+    ]
+    started = time.perf_counter()
+    for process in processes:
+        process.start()
+    errors = sum(results.get() for _ in processes)
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - started
+
+    total = args.workers * args.writes
+    print(f"mode:       {'baseline' if args.baseline else 'tuned'}")
+    print(f"requests:   {total} from {args.workers} workers in {elapsed:.2f}s")
+    print(f"throughput: {total / elapsed:.0f} writes/s")
+    print(f"errors:     {errors}")
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
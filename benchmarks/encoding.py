@@ -0,0 +1,117 @@
+"""Benchmark of the GET /list payload encodings: size and encoding time.
+
+Builds a user's lists in memory with the tree shapes of routes.py (no
+database), then times, for each shape, what a snapshot cache miss spends
+turning the loaded tree into bytes:
+
+    nested/flask     the original nested payload through Flask's JSON provider
+    nested           the nested payload through encoding.dumps (orjson)
+    columnar         the flat columnar payload through encoding.dumps
+
+and prints the body size raw, gzipped and (with brotli installed) brotli
+compressed, with the best time of --repeat runs of each step.
+
+    python benchmarks/encoding.py
+    python benchmarks/encoding.py --shapes deep --lists 50 --depth 9
+"""
+
+import argparse
+import itertools
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from flask import Flask  # noqa: E402
+from routes import SHAPES, build_tree  # noqa: E402
+
+from backend import encoding  # noqa: E402
+from backend.tree import index_children, serialize_list  # noqa: E402
+
+
+def load_tree(lists, fanout, depth, rng):
+    # Lists and items as load_user_tree returns them, minus the database
+    counter = itertools.count(1)
+    todo_lists, items = [], []
+    for list_id in range(1, lists + 1):
+        todo_lists.append(SimpleNamespace(id=list_id, title=f"List {list_id}"))
+        rows, _ = build_tree(list_id, fanout, depth, lambda: next(counter), rng)
+        items.extend(
+            SimpleNamespace(
+                id=row["id"],
+                content=row["c"],
+                completed=row["done"],
+                list_id=row["l"],
+                parent_id=row["p"],
+            )
+            for row in rows
+        )
+    return todo_lists, index_children(items)
+
+
+def best_time(fn, repeat):
+    # Fastest of ``repeat`` runs in milliseconds, and the last result
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def run_shape(name, args):
+    shape = dict(SHAPES[name])
+    shape.update({k: getattr(args, k) for k in ("fanout", "depth") if getattr(args, k)})
+    todo_lists, children = load_tree(
+        args.lists, shape["fanout"], shape["depth"], random.Random(args.seed)
+    )
+    provider = Flask(__name__).json  # What jsonify used before encoding.py
+    variants = {
+        "nested/flask": lambda: provider.dumps(
+            {"lists": [serialize_list(lst, children) for lst in todo_lists]}
+        ).encode(),
+        "nested": lambda: encoding.encode_lists("nested", todo_lists, children),
+        "columnar": lambda: encoding.encode_lists("columnar", todo_lists, children),
+    }
+    codings = ["gzip"] + (["br"] if encoding.brotli is not None else [])
+    items = sum(len(group) for group in children.values())
+    print(f"{name}: {args.lists} lists, {items} items")
+    print(
+        f"  {'encoding':<14}{'encode ms':>10}{'bytes':>10}"
+        + "".join(f"{coding + ' bytes':>12}{coding + ' ms':>9}" for coding in codings)
+    )
+    for label, encode in variants.items():
+        encode_ms, body = best_time(encode, args.repeat)
+        line = f"  {label:<14}{encode_ms:>10.2f}{len(body):>10}"
+        for coding in codings:
+            compress_ms, compressed = best_time(
+                lambda: encoding.compress(body, coding), args.repeat
+            )
+            line += f"{len(compressed):>12}{compress_ms:>9.2f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shapes", default=",".join(SHAPES))
+    parser.add_argument("--lists", type=int, default=20, help="lists of the user")
+    parser.add_argument("--fanout", type=int, default=None, help="override shape")
+    parser.add_argument("--depth", type=int, default=None, help="override shape")
+    parser.add_argument("--repeat", type=int, default=20, help="best of N runs")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    print(
+        f"orjson: {'yes' if encoding.orjson else 'no'},"
+        f" brotli: {'yes' if encoding.brotli else 'no'}"
+    )
+    for name in args.shapes.split(","):
+        run_shape(name, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Query plans and timings of the hot queries before and after the index migration.
+
+Seeds a fresh SQLite database migrated up to the schema that predates the
+hot-query indexes, prints the plan and median time of each hot query, then
+applies the remaining migrations and prints them again.
+
+    python benchmarks/query_plans.py --users 50 --lists 20 --items 200
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text  # noqa: E402
+
+# Migration version of the schema as it was before the index migration
+BEFORE_INDEXES = 2
+
+# The query shapes issued by backend/todo.py and backend/tree.py, with the
+# parameters they need; sibling groups come in (rank, id) order
+HOT_QUERIES = {
+    "lists of a user": (
+        "SELECT id, title FROM todo_lists WHERE owner_id = :owner_id ORDER BY id",
+        ("owner_id",),
+    ),
+    "all items of a user (/list)": (
+        "SELECT todo_items.* FROM todo_items JOIN todo_lists"
+        " ON todo_items.list_id = todo_lists.id"
+        " WHERE todo_lists.owner_id = :owner_id ORDER BY todo_lists.id,"
+        " todo_items.parent_id, todo_items.rank, todo_items.id",
+        ("owner_id",),
+    ),
+    "top-level items of a list": (
+        "SELECT * FROM todo_items WHERE list_id = :list_id AND parent_id IS NULL"
+        " ORDER BY rank, id LIMIT 51",
+        ("list_id",),
+    ),
+    "children of an item": (
+        "SELECT * FROM todo_items WHERE parent_id = :item_id"
+        " ORDER BY rank, id LIMIT 51",
+        ("item_id",),
+    ),
+    "items of a list (delete_list)": (
+        "SELECT id FROM todo_items WHERE list_id = :list_id",
+        ("list_id",),
+    ),
+}
+
+
+def seed(conn, users, lists, items, fanout):
+    rng = random.Random(42)
+    conn.execute(
+        text("INSERT INTO users (id, email, name, username) VALUES (:id, :e, :n, :u)"),
+        [
+            {"id": u, "e": f"u{u}@example.com", "n": f"User {u}", "u": f"u{u}"}
+            for u in range(1, users + 1)
+        ],
+    )
+    conn.execute(
+        text("INSERT INTO todo_lists (id, title, owner_id) VALUES (:id, :t, :o)"),
+        [
+            {"id": n, "t": f"List {n}", "o": (n - 1) // lists + 1}
+            for n in range(1, users * lists + 1)
+        ],
+    )
+    rows, item_id = [], 0
+    for list_id in range(1, users * lists + 1):
+        first = item_id + 1
+        for n in range(items):
+            item_id += 1
+            # The first `fanout` items are roots, the others hang under earlier ones
+            parent = None if n < fanout else rng.randint(first, item_id - 1)
+            rows.append(
+                {
+                    "id": item_id,
+                    "c": f"task {item_id}",
+                    "d": rng.random() < 0.3,
+                    "l": list_id,
+                    "p": parent,
+                }
+            )
+    conn.execute(
+        text(
+            "INSERT INTO todo_items (id, content, completed, list_id, parent_id, path)"
+            " VALUES (:id, :c, :d, :l, :p, '')"
+        ),
+        rows,
+    )
+    return item_id
+
+
+def measure(engine, params, repeat):
+    results = {}
+    with engine.connect() as conn:
+        for name, (sql, keys) in HOT_QUERIES.items():
+            args = {key: params[key] for key in keys}
+            plan = conn.execute(text("EXPLAIN QUERY PLAN " + sql), args).all()
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                conn.execute(text(sql), args).all()
+                timings.append(time.perf_counter() - started)
+            results[name] = ([row[-1] for row in plan], statistics.median(timings))
+
+        # Inserts and edits pay for every index on the table
+        conn.rollback()
+        started = time.perf_counter()
+        with conn.begin() as transaction:
+            conn.execute(
+                text(
+                    "INSERT INTO todo_items (content, completed, list_id, path)"
+                    " VALUES (:c, 0, :l, '')"
+                ),
+                [{"c": f"new task {n}", "l": params["list_id"]} for n in range(5000)],
+            )
+            conn.execute(text("UPDATE todo_items SET content = content || '!'"))
+            transaction.rollback()
+        results["5k inserts + full edit"] = ([], time.perf_counter() - started)
+    return results
+
+
+def report(title, results):
+    print(f"\n== {title}")
+    for name, (plan, seconds) in results.items():
+        print(f"{name:32} {seconds * 1000:9.3f} ms")
+        for step in plan:
+            print(f"    {step}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--lists", type=int, default=20, help="lists per user")
+    parser.add_argument("--items", type=int, default=200, help="items per list")
+    parser.add_argument("--fanout", type=int, default=10, help="roots per list")
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    from backend import create_app, db
+    from backend.hierarchy import rebuild_paths
+    from backend.migrations import run_migrations
+
+    path = os.path.join(tempfile.mkdtemp(), "plans.db")
+    app = create_app(
+        {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + path, "AUTO_MIGRATE": False}
+    )
+    with app.app_context():
+        run_migrations(target=BEFORE_INDEXES)
+        with db.engine.begin() as conn:
+            # The bare column the queries order by; the sibling ranks migration
+            # fills it in and adds its indexes later
+            conn.execute(
+                text(
+                    "ALTER TABLE todo_items"
+                    " ADD COLUMN rank VARCHAR NOT NULL DEFAULT ''"
+                )
+            )
+        with db.engine.begin() as conn:
+            total = seed(conn, args.users, args.lists, args.items, args.fanout)
+        rebuild_paths()
+        print(
+            f"seeded {args.users} users, {args.users * args.lists} lists, {total} items"
+        )
+
+        # A user, list and item from the middle of the data set
+        params = {
+            "owner_id": args.users // 2 + 1,
+            "list_id": args.users * args.lists // 2 + 1,
+            "item_id": total // 2 + 1,
+        }
+        with db.engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        before = measure(db.engine, params, args.repeat)
+        run_migrations()
+        with db.engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        after = measure(db.engine, params, args.repeat)
+
+    report("before index migration", before)
+    report("after index migration", after)
+
+
+if __name__ == "__main__":
+    main()
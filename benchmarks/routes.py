@@ -0,0 +1,424 @@
+"""Benchmark of the API routes on synthetic hierarchical data.
+
+Seeds a fresh SQLite database through create_app with users whose lists hold
+trees of a given shape, then drives the real routes through the Flask test
+client: /list (from the snapshot cache and rebuilt), /list/update,
+/item/move, /item/delete, toggles, /signup and /login. Reports throughput,
+latency percentiles and SQL statements per request as JSON, so runs can be
+compared between commits; with --compare, routes that got slower than the
+threshold or run more queries than the baseline make the script exit with 1.
+
+Shapes: "wide" (many children, shallow), "deep" (few children, deep) and
+"skewed" (a few power users own most of the data). --fanout and --depth
+override a shape's defaults. The same --seed gives the same data and requests.
+
+    python benchmarks/routes.py --output baseline.json
+    python benchmarks/routes.py --compare baseline.json --threshold 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import event, text  # noqa: E402
+
+# Tree shape defaults: children per item (and top-level items per list) and
+# levels below the list. "skew" spreads lists over users by a Pareto law
+SHAPES = {
+    "wide": {"fanout": 12, "depth": 2, "skew": False},
+    "deep": {"fanout": 2, "depth": 7, "skew": False},
+    "skewed": {"fanout": 6, "depth": 3, "skew": True},
+}
+
+# Routes timed for each shape, in the order they run
+ROUTES = (
+    "list (cached)",
+    "list (rebuilt)",
+    "list/update",
+    "item/toggle",
+    "item/move",
+    "item/delete",
+    "signup",
+    "login",
+)
+
+PASSWORD = "benchmark-password"
+
+
+def build_tree(list_id, fanout, depth, next_id, rng):
+    """Return the item rows of one list and the IDs of its leaves.
+
+    Every item gets between half and all of ``fanout`` children, down to
+    ``depth`` levels, with the paths the hierarchy index expects.
+    """
+    rows, leaves = [], []
+    level = [(None, "")]  # (parent ID, path of its children)
+    for depth_left in range(depth, 0, -1):
+        below = []
+        for parent_id, path in level:
+            for _ in range(rng.randint(max(1, fanout // 2), fanout)):
+                item_id = next_id()
+                rows.append(
+                    {
+                        "id": item_id,
+                        "c": f"Item {item_id}",
+                        "done": rng.random() < 0.3,
+                        "l": list_id,
+                        "p": parent_id,
+                        "path": path,
+                    }
+                )
+                if depth_left == 1 and parent_id is not None:
+                    leaves.append(item_id)
+                below.append((item_id, f"{path}{item_id}/"))
+        level = below
+    return rows, leaves
+
+
+def seed(app, users, lists, fanout, depth, skew, rng):
+    """Fill the database and return what the requests pick from.
+
+    Returns {user_id: {"lists": [...], "roots": {list_id: [...]}, "items":
+    [...], "movable": [...], "leaves": [...]}} and the number of items.
+    """
+    from backend import db
+    from backend.rollup import rebuild_rollups
+
+    counter = iter(range(1, 10**9))
+    next_id = lambda: next(counter)  # noqa: E731
+    data = {}
+    user_rows, list_rows, item_rows = [], [], []
+    list_id = 0
+    for user_id in range(1, users + 1):
+        count = lists
+        if skew:
+            # Most users have a list or two, a few have dozens
+            count = max(1, min(lists * 20, round(lists * rng.paretovariate(1.2) / 3)))
+        user = {"lists": [], "roots": {}, "items": [], "movable": [], "leaves": []}
+        for _ in range(count):
+            list_id += 1
+            rows, leaves = build_tree(list_id, fanout, depth, next_id, rng)
+            list_rows.append({"id": list_id, "t": f"List {list_id}", "o": user_id})
+            item_rows.extend(rows)
+            user["lists"].append(list_id)
+            user["roots"][list_id] = [row["id"] for row in rows if row["p"] is None]
+            user["items"].extend(row["id"] for row in rows)
+            user["movable"].extend(row["id"] for row in rows if row["p"] is not None)
+            user["leaves"].extend(leaves)
+        user_rows.append(
+            {"id": user_id, "e": f"user{user_id}@example.com", "u": f"user{user_id}"}
+        )
+        data[user_id] = user
+
+    with app.app_context(), db.engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO users (id, email, name, username) VALUES (:id, :e, :u, :u)"
+            ),
+            user_rows,
+        )
+        conn.execute(
+            text("INSERT INTO todo_lists (id, title, owner_id) VALUES (:id, :t, :o)"),
+            list_rows,
+        )
+        if item_rows:
+            conn.execute(
+                text(
+                    "INSERT INTO todo_items (id, content, completed, list_id,"
+                    " parent_id, path) VALUES (:id, :c, :done, :l, :p, :path)"
+                ),
+                item_rows,
+            )
+        rebuild_rollups(conn)
+        conn.execute(text("ANALYZE"))
+    return data, len(item_rows)
+
+
+class Driver:
+    """Sends the requests of each route with the test client and times them."""
+
+    def __init__(self, app, data, rng):
+        from flask_jwt_extended import create_access_token
+
+        self.app = app
+        self.client = app.test_client()
+        self.data = data
+        self.rng = rng
+        # Users picked in proportion to their data, as power users are busier
+        self.users = list(data)
+        self.weights = [len(data[user_id]["items"]) + 1 for user_id in self.users]
+        with app.app_context():
+            self.headers = {
+                user_id: {"Authorization": "Bearer " + create_access_token(user_id)}
+                for user_id in data
+            }
+        self.signups = 0
+
+    def user(self, need="items"):
+        for _ in range(100):
+            user_id = self.rng.choices(self.users, self.weights)[0]
+            if self.data[user_id][need]:
+                return user_id
+        return None
+
+    def request(self, route):
+        # Return the test client call for one request of the route, or None
+        # when the data has nothing left to use (e.g. every leaf is deleted)
+        from backend.cache import snapshots
+
+        if route == "signup":
+            self.signups += 1
+            email = f"new{self.signups}@example.com"
+            body = {"email": email, "name": "New", "password": PASSWORD}
+            return lambda: self.client.post("/signup", json=body)
+        if route == "login":
+            body = {"email": "new1@example.com", "password": PASSWORD}
+            body["session"] = False
+            return lambda: self.client.post("/login", json=body)
+
+        need = {"item/delete": "leaves", "item/move": "movable"}.get(route, "items")
+        user_id = self.user(need)
+        if user_id is None:
+            return None
+        user = self.data[user_id]
+        headers = self.headers[user_id]
+        if route == "list (cached)":
+            self.client.get("/list", headers=headers)  # Untimed, fills the cache
+            return lambda: self.client.get("/list", headers=headers)
+        if route == "list (rebuilt)":
+
+            def rebuilt():
+                snapshots.bump(user_id)  # As after a write by another client
+                return self.client.get("/list", headers=headers)
+
+            return rebuilt
+        if route == "list/update":
+            list_id = self.rng.choice(user["lists"])
+            roots = user["roots"][list_id]
+            items = [
+                {"id": item_id, "content": f"Edited {item_id}", "completed": True}
+                for item_id in self.rng.sample(roots, min(10, len(roots)))
+            ]
+            body = {"id": list_id, "title": f"List {list_id}*", "items": items}
+            return lambda: self.client.post("/list/update", json=body, headers=headers)
+        if route == "item/toggle":
+            item_id = self.rng.choice(user["items"])
+            return lambda: self.client.post(f"/item/toggle/{item_id}", headers=headers)
+        if route == "item/move":
+            # Move a nested item under one of the seeded top-level items, or
+            # to the top level. Those never move or get deleted themselves, so
+            # moves can neither create cycles nor orphan anything
+            list_id = self.rng.choice(user["lists"])
+            item_id = self.rng.choice(user["movable"])
+            target = self.rng.choice(user["roots"][list_id] + [None])
+            body = {"item_id": item_id, "new_parent_id": target}
+            return lambda: self.client.post("/item/move", json=body, headers=headers)
+        if route == "item/delete":
+            # Leaves stay leaves: moves only put items under top-level ones
+            item_id = user["leaves"].pop(self.rng.randrange(len(user["leaves"])))
+            user["items"].remove(item_id)
+            user["movable"].remove(item_id)
+            return lambda: self.client.post(f"/item/delete/{item_id}", headers=headers)
+        raise ValueError(route)
+
+
+def run_route(driver, route, requests, warmup, queries):
+    latencies, statements, errors = [], [], 0
+    elapsed = 0.0
+    for n in range(warmup + requests):
+        call = driver.request(route)
+        if call is None:
+            break
+        queries[0] = 0
+        started = time.perf_counter()
+        response = call()
+        seconds = time.perf_counter() - started
+        if n < warmup:
+            continue
+        elapsed += seconds
+        if response.status_code >= 400:
+            errors += 1
+        latencies.append(seconds)
+        statements.append(queries[0])
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "req_per_s": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "queries_mean": statistics.mean(statements),
+        "queries_max": max(statements),
+    }
+
+
+def percentile(ordered, pct):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run_shape(name, args):
+    from backend import create_app, db
+
+    shape = dict(SHAPES[name])
+    if args.fanout is not None:
+        shape["fanout"] = args.fanout
+    if args.depth is not None:
+        shape["depth"] = args.depth
+    rng = random.Random(args.seed)
+
+    path = os.path.join(tempfile.mkdtemp(), f"{name}.db")
+    # Every request comes from the same address, so rate limits would reject
+    # the login and signup runs after their first few requests
+    app = create_app(
+        {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + path, "RATE_LIMIT_ENABLED": False}
+    )
+    app.logger.disabled = True  # Failed requests are counted, not printed
+    started = time.perf_counter()
+    data, items = seed(
+        app, args.users, args.lists, shape["fanout"], shape["depth"], shape["skew"], rng
+    )
+    seeded = time.perf_counter() - started
+
+    # Statements of the request being timed
+    queries = [0]
+    with app.app_context():
+        event.listen(
+            db.engine,
+            "before_cursor_execute",
+            lambda *_: queries.__setitem__(0, queries[0] + 1),
+        )
+
+    driver = Driver(app, data, rng)
+    routes = {}
+    for route in ROUTES:
+        auth = route in ("signup", "login")
+        requests = args.auth_requests if auth else args.requests
+        warmup = 1 if auth else args.warmup
+        routes[route] = run_route(driver, route, requests, warmup, queries)
+    return {
+        "shape": {**shape, "users": args.users, "lists_per_user": args.lists},
+        "seed": {
+            "lists": sum(len(user["lists"]) for user in data.values()),
+            "items": items,
+            "seconds": seeded,
+        },
+        "routes": routes,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+    }
+
+
+def compare(results, baseline, threshold, slack_ms):
+    """Return the regressions of ``results`` against a baseline run.
+
+    A route regresses when its p50 latency grew by more than ``threshold``
+    (a fraction) and by more than ``slack_ms``, which keeps timer noise on
+    sub-millisecond routes from failing the check, or when it runs more SQL
+    statements per request. Query counts do not depend on the machine.
+    """
+    regressions = []
+    for shape, run in results["shapes"].items():
+        base_run = baseline.get("shapes", {}).get(shape)
+        if base_run is None:
+            continue
+        for route, result in run["routes"].items():
+            base = base_run["routes"].get(route)
+            if not base or not base.get("requests") or not result.get("requests"):
+                continue
+            limit = max(base["p50_ms"] * (1 + threshold), base["p50_ms"] + slack_ms)
+            if result["p50_ms"] > limit:
+                regressions.append(
+                    f"{shape} {route}: p50 {base['p50_ms']:.2f} ->"
+                    f" {result['p50_ms']:.2f} ms"
+                )
+            if result["queries_max"] > base["queries_max"]:
+                regressions.append(
+                    f"{shape} {route}: up to {base['queries_max']} ->"
+                    f" {result['queries_max']} queries per request"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shapes", default=",".join(SHAPES))
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--lists", type=int, default=3, help="lists per user")
+    parser.add_argument("--fanout", type=int, default=None, help="override shape")
+    parser.add_argument("--depth", type=int, default=None, help="override shape")
+    parser.add_argument("--requests", type=int, default=200, help="per route")
+    parser.add_argument(
+        "--auth-requests", type=int, default=10, help="per auth route (hashing)"
+    )
+    parser.add_argument("--warmup", type=int, default=10, help="untimed requests")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--compare", help="baseline JSON to check against")
+    parser.add_argument(
+        "--threshold", type=float, default=0.25, help="allowed p50 slowdown"
+    )
+    parser.add_argument(
+        "--slack-ms", type=float, default=1.0, help="p50 slowdown always allowed"
+    )
+    args = parser.parse_args()
+
+    results = {
+        "environment": environment(),
+        "arguments": vars(args),
+        "shapes": {},
+    }
+    for name in args.shapes.split(","):
+        results["shapes"][name] = run_shape(name, args)
+        print(f"ran {name}", file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.slack_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print("no regressions", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
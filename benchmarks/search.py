@@ -0,0 +1,207 @@
+"""Full-text search timings on a large synthetic data set.
+
+Seeds a fresh SQLite database (1M items by default) at the schema that
+predates the search index, times the migration that builds it and the cost
+its triggers add to inserts, then compares the median time of the FTS5
+search used by /search with the LIKE scan it replaces for a few query shapes,
+and times the route itself.
+
+    python benchmarks/search.py --users 100 --items 1000000
+"""
+
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import insert, text  # noqa: E402
+
+# Migration version of the schema as it was before the search index
+BEFORE_SEARCH = 4
+LISTS_PER_USER = 10
+SEED_CHUNK = 10000
+
+# Query shapes, from words in most items to words in a handful of them
+QUERIES = {
+    "common word": "w0",
+    "uncommon word": "w300",
+    "rare word": "w4000",
+    "prefix": "w12*",
+    "two words": "w1 w40",
+}
+
+
+def vocabulary(size, rng):
+    # Zipf-like word frequencies, so a few words are everywhere and most are rare
+    words = [f"w{n}" for n in range(size)]
+    cum_weights = list(itertools.accumulate(1 / (n + 1) for n in range(size)))
+    return lambda k: rng.choices(words, cum_weights=cum_weights, k=k)
+
+
+def seed(conn, users, items, rng):
+    conn.execute(
+        text("INSERT INTO users (id, email, name, username) VALUES (:id, :e, :n, :u)"),
+        [
+            {"id": u, "e": f"u{u}@example.com", "n": f"User {u}", "u": f"u{u}"}
+            for u in range(1, users + 1)
+        ],
+    )
+    lists = users * LISTS_PER_USER
+    conn.execute(
+        text("INSERT INTO todo_lists (id, title, owner_id) VALUES (:id, :t, :o)"),
+        [
+            {"id": n, "t": f"List {n}", "o": (n - 1) // LISTS_PER_USER + 1}
+            for n in range(1, lists + 1)
+        ],
+    )
+    words = vocabulary(5000, rng)
+    per_list = max(1, items // lists)
+    item_id = 0
+    while item_id < items:
+        rows = []
+        for _ in range(min(SEED_CHUNK, items - item_id)):
+            item_id += 1
+            list_id = min(lists, (item_id - 1) // per_list + 1)
+            # Every tenth item is a root, the others hang under the previous root
+            root = item_id - (item_id - 1) % 10
+            rows.append(
+                {
+                    "id": item_id,
+                    "c": " ".join(words(rng.randint(3, 8))),
+                    "l": list_id,
+                    "p": None if root == item_id else root,
+                    "path": "" if root == item_id else f"{root}/",
+                }
+            )
+        conn.execute(
+            text(
+                "INSERT INTO todo_items (id, content, completed, list_id, parent_id,"
+                " path) VALUES (:id, :c, 0, :l, :p, :path)"
+            ),
+            rows,
+        )
+    return item_id
+
+
+def like_scan(owner_id, q, limit):
+    # What a search had to do without the index: scan the user's items until a
+    # page of substring matches is found, with no ranking at all
+    from backend import db
+
+    clauses = " AND ".join(f"i.content LIKE :w{n}" for n in range(len(q.split())))
+    params = {f"w{n}": f"%{word.rstrip('*')}%" for n, word in enumerate(q.split())}
+    return db.session.execute(
+        text(
+            "SELECT i.id, i.content, l.title FROM todo_items i"
+            " JOIN todo_lists l ON l.id = i.list_id"
+            f" WHERE l.owner_id = :owner_id AND {clauses} ORDER BY i.id LIMIT :limit"
+        ),
+        {"owner_id": owner_id, "limit": limit, **params},
+    ).all()
+
+
+def time_writes(engine, commits=500, bulk=SEED_CHUNK):
+    """Time one-item commits, like /list/<id>/add, and a bulk insert like /import.
+
+    Returns milliseconds per commit and for the whole bulk insert, which is
+    rolled back.
+    """
+    from backend.models import TodoItem
+
+    started = time.perf_counter()
+    for n in range(commits):
+        with engine.begin() as conn:
+            conn.execute(
+                insert(TodoItem).values(
+                    content=f"w1 w2 new{n}", completed=False, list_id=1, path=""
+                )
+            )
+    per_commit = (time.perf_counter() - started) / commits
+
+    rows = [
+        {"content": f"w1 w2 bulk{n}", "completed": False, "list_id": 1, "path": ""}
+        for n in range(bulk)
+    ]
+    with engine.connect() as conn:
+        started = time.perf_counter()
+        conn.execute(insert(TodoItem).returning(TodoItem.id), rows).all()
+        seconds = time.perf_counter() - started
+        conn.rollback()
+    return {
+        "ms per one-item commit": per_commit * 1000,
+        f"ms per {bulk}-item bulk insert": seconds * 1000,
+    }
+
+
+def median_ms(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--items", type=int, default=1000000, help="items in total")
+    parser.add_argument("--limit", type=int, default=50, help="hits per page")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    from flask_jwt_extended import create_access_token
+    from backend import create_app, db
+    from backend.migrations import run_migrations
+    from backend.search import search_items
+
+    path = os.path.join(tempfile.mkdtemp(), "search.db")
+    app = create_app(
+        {"SQLALCHEMY_DATABASE_URI": "sqlite:///" + path, "AUTO_MIGRATE": False}
+    )
+    with app.app_context():
+        run_migrations(target=BEFORE_SEARCH)
+        with db.engine.begin() as conn:
+            total = seed(conn, args.users, args.items, random.Random(42))
+        print(f"seeded {args.users} users and {total} items")
+
+        before = time_writes(db.engine)
+
+        started = time.perf_counter()
+        run_migrations()
+        print(f"built the search index in {time.perf_counter() - started:.1f} s")
+        with db.engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+        print(f"database file {os.path.getsize(path) / 2**20:.0f} MiB with the index")
+
+        # What keeping the index in sync adds to the write paths
+        after = time_writes(db.engine)
+        print(f"\n{'writes':36} {'no index':>9} {'index':>9}")
+        for name in before:
+            print(f"{name:36} {before[name]:9.3f} {after[name]:9.3f}")
+
+        owner_id = args.users // 2 + 1
+        headers = {"Authorization": "Bearer " + create_access_token(identity=owner_id)}
+        print(
+            f"\n{'query':16} {'hits':>6} {'fts ms':>9} {'like ms':>9} {'route ms':>9}"
+        )
+        client = app.test_client()
+        for name, q in QUERIES.items():
+            hits, _ = search_items(owner_id, q, args.limit)
+            fts = median_ms(lambda: search_items(owner_id, q, args.limit), args.repeat)
+            like = median_ms(lambda: like_scan(owner_id, q, args.limit), args.repeat)
+            route = median_ms(
+                lambda: client.get("/search", query_string={"q": q}, headers=headers),
+                args.repeat,
+            )
+            print(f"{name:16} {len(hits):6} {fts:9.3f} {like:9.3f} {route:9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""Load test of the serving modes: debug server, gunicorn (WSGI) and uvicorn (ASGI).
+
+Seeds a database, then for each mode starts the server as a subprocess,
+opens a number of idle /events streams like parked browser tabs, and has
+client threads request /list (with some writes that invalidate the cached
+snapshots) for a fixed time. Prints requests per second, p50/p99 latency
+and the requests that failed or timed out.
+
+    python benchmarks/serving.py --clients 32 --streams 0
+    python benchmarks/serving.py --clients 32 --streams 64   # idle SSE tabs
+"""
+
+import argparse
+import http.client
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import text  # noqa: E402
+
+# Command line of each mode; {port} and {threads} are filled in
+MODES = {
+    "dev": "-m flask --app backend run --port {port} --with-threads",
+    "wsgi": "-m backend.serve --bind 127.0.0.1:{port} --threads {threads}",
+    "asgi": "-m backend.serve --asgi --bind 127.0.0.1:{port} --threads {threads}",
+}
+
+
+def seed(uri, users, items):
+    # Users with one list each, holding a shallow tree of items
+    from backend import create_app, db
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": uri})
+    with app.app_context(), db.engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (id, username, email) VALUES (:id, :u, :e)"),
+            [
+                {"id": u, "u": f"u{u}", "e": f"u{u}@example.com"}
+                for u in range(1, users + 1)
+            ],
+        )
+        conn.execute(
+            text("INSERT INTO todo_lists (id, title, owner_id) VALUES (:id, :t, :id)"),
+            [{"id": u, "t": f"List {u}"} for u in range(1, users + 1)],
+        )
+        rows = []
+        for u in range(1, users + 1):
+            for n in range(items):
+                item_id = (u - 1) * items + n + 1
+                root = item_id - n % 5  # Every fifth item is top-level
+                rows.append(
+                    {
+                        "id": item_id,
+                        "c": f"Item {n}",
+                        "l": u,
+                        "p": None if root == item_id else root,
+                        "path": "" if root == item_id else f"{root}/",
+                    }
+                )
+        conn.execute(
+            text(
+                "INSERT INTO todo_items (id, content, completed, list_id, parent_id,"
+                " path) VALUES (:id, :c, 0, :l, :p, :path)"
+            ),
+            rows,
+        )
+    return app
+
+
+def tokens(app, users):
+    from flask_jwt_extended import create_access_token
+
+    with app.app_context():
+        return {u: create_access_token(identity=u) for u in range(1, users + 1)}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+def open_streams(port, count, token):
+    # Idle EventSource connections: send the request and never read. Full
+    # access tokens are refused in the query string, so send it as a header
+    streams = []
+    for _ in range(count):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(
+            "GET /events HTTP/1.1\r\nHost: localhost\r\n"
+            f"Authorization: Bearer {token}\r\n"
+            "Accept: text/event-stream\r\n\r\n".encode()
+        )
+        streams.append(sock)
+    return streams
+
+
+def client(port, tokens, items, seconds, write_ratio, timeout, rng, results):
+    latencies, errors = [], 0
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    ends_at = time.monotonic() + seconds
+    while time.monotonic() < ends_at:
+        user_id = rng.choice(list(tokens))
+        headers = {"Authorization": "Bearer " + tokens[user_id]}
+        if rng.random() < write_ratio:
+            # Toggle one of the user's items, which invalidates their snapshot
+            item_id = (user_id - 1) * items + rng.randrange(items) + 1
+            method, path = "POST", f"/item/toggle/{item_id}"
+        else:
+            method, path = "GET", "/list"
+        started = time.perf_counter()
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()  # Reconnect on the next request
+    conn.close()
+    results.append((latencies, errors))
+
+
+def run_mode(mode, args, uri, tokens):
+    port = free_port()
+    command = MODES[mode].format(port=port, threads=args.threads).split()
+    env = {**os.environ, "SQLALCHEMY_DATABASE_URI": uri, "WEB_WORKERS": "1"}
+    server = subprocess.Popen(
+        [sys.executable, *command],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_for_port(port)
+        streams = open_streams(port, args.streams, tokens[1])
+        time.sleep(0.5)  # Let the server pick the streams up
+        results = []
+        threads = [
+            threading.Thread(
+                target=client,
+                args=(
+                    port,
+                    tokens,
+                    args.items,
+                    args.seconds,
+                    args.write_ratio,
+                    args.timeout,
+                    random.Random(n),
+                    results,
+                ),
+            )
+            for n in range(args.clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for sock in streams:
+            sock.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+    latencies = sorted(latency for result, _ in results for latency in result)
+    errors = sum(count for _, count in results)
+    if not latencies:
+        return {"req/s": 0, "p50 ms": None, "p99 ms": None, "errors": errors}
+    return {
+        "req/s": len(latencies) / args.seconds,
+        "p50 ms": statistics.median(latencies) * 1000,
+        "p99 ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", default="dev,wsgi,asgi")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--items", type=int, default=200, help="items per user")
+    parser.add_argument("--clients", type=int, default=32, help="client threads")
+    parser.add_argument("--streams", type=int, default=0, help="idle /events streams")
+    parser.add_argument("--threads", type=int, default=8, help="server threads")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=5, help="client timeout")
+    args = parser.parse_args()
+
+    uri = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "serving.db")
+    app = seed(uri, args.users, args.items)
+    user_tokens = tokens(app, args.users)
+    print(
+        f"{args.users} users x {args.items} items, {args.clients} clients,"
+        f" {args.streams} idle streams, {args.threads} server threads"
+    )
+    print(f"{'mode':6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for mode in args.modes.split(","):
+        result = run_mode(mode, args, uri, user_tokens)
+        p50, p99 = result["p50 ms"], result["p99 ms"]
+        print(
+            f"{mode:6} {result['req/s']:8.0f} {p50 or 0:8.1f} {p99 or 0:8.1f}"
+            f" {result['errors']:7}"
+        )
+
+
+if __name__ == "__main__":
+    main()
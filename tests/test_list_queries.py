@@ -0,0 +1,92 @@
+"""GET /list must load a tree in a fixed number of SQL statements.
+
+Serializing used to query the children of every item on its own (N+1), so
+the statement count grew with the tree. Trees of different depths and
+fan-outs are built through the API and the statements run while /list
+rebuilds its snapshot are counted.
+"""
+
+import pytest
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event
+
+from backend import create_app, db
+from backend.cache import snapshots
+
+# (fan-out, depth) of the trees; every item gets "fan-out" children
+SHAPES = [(1, 1), (4, 2), (2, 5), (6, 3)]
+
+
+@pytest.fixture
+def client(tmp_path):
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+            "RATE_LIMIT_ENABLED": False,
+        }
+    )
+    client = app.test_client()
+    response = client.post(
+        "/signup", json={"email": "a@example.com", "name": "A", "password": "pw"}
+    )
+    assert response.status_code == 200
+    with app.app_context():
+        token = create_access_token(identity=1)
+    client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    return client
+
+
+def build_tree(client, fanout, depth):
+    # A list whose items all have ``fanout`` children, ``depth`` levels deep
+    list_id = client.post("/list/add", json={"title": "Tree"}).json["list_id"]
+    level = [None]
+    for _ in range(depth):
+        below = []
+        for parent_id in level:
+            for n in range(fanout):
+                response = client.post(
+                    f"/list/{list_id}/add",
+                    json={"content": f"Item {n}", "parent_id": parent_id},
+                )
+                below.append(response.json["item_id"])
+        level = below
+    return list_id
+
+
+def count_list_queries(client):
+    # Statements run by a GET /list that has to rebuild the snapshot
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    snapshots.bump(1)
+    with client.application.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        response = client.get("/list")
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert response.status_code == 200
+    return len(statements), response.json
+
+
+def count_items(items):
+    return sum(1 + count_items(item["items"]) for item in items)
+
+
+def test_list_query_count_does_not_grow_with_the_tree(client):
+    counts = []
+    for fanout, depth in SHAPES:
+        build_tree(client, fanout, depth)
+        queries, body = count_list_queries(client)
+        # Every list built so far comes back whole
+        expected = sum(
+            sum(f**level for level in range(1, d + 1))
+            for f, d in SHAPES[: len(counts) + 1]
+        )
+        assert sum(count_items(lst["items"]) for lst in body["lists"]) == expected
+        counts.append(queries)
+    assert len(set(counts)) == 1, counts
+    assert counts[0] == 2  # The user's lists, then all of their items